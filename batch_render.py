@@ -0,0 +1,275 @@
+"""Headless batch rendering of graph scenes, e.g. for worksheets.
+
+Scenes are described by specs in a JSON or YAML file: a list of specs, or a mapping with a
+"scenes" list. A spec looks like
+
+    {
+        "name": "sine",
+        "axes": {"xuserlower": -2, "xuserupper": 8, "yuserlower": -2, "yuserupper": 8},
+        "functions": [{"latex": "\\frac{x}{2}-\\sin(x)", "color": "blue", "line_style": "--"}],
+        "implicit_functions": [{"latex": "x^2 + y^2 - 1", "color": "red", "relation": "<"}],
+        "parametric_functions": [{"x": "\\cos(t)", "y": "\\sin(t)", "t_range": ["-\\pi", "\\pi"]}],
+        "points": [{"x": 1, "y": 2, "marker": "o", "color": "green"}],
+        "areas": [{"upper": "\\sin(x)", "lower": "0", "x_range": [0, 3.14], "color": "yellow"}],
+        "parameters": {"a": 2}
+    }
+
+Everything but "name" is optional; "name" is the file name without its extension, so it
+cannot contain a path. "axes" takes the sidebar settings of the app (see DEFAULT_AXES).
+An implicit function's "relation" is "=" (the curve, default), "<", "<=", ">" or ">="
+(also shade the region where the function is negative or positive, with or without zero). Colours are names from MY_COLORS or any matplotlib colour.
+"parameters" gives the values of free parameters in the expressions, e.g. a in a\\sin(x).
+
+Usage:
+    python batch_render.py specs.json -o out/ --format png --workers 8
+
+--format svg-compact writes smaller SVG files, with paths simplified to the size they are
+printed at (see IMAGE_FORMATS in graph_utils).
+
+This module uses the Agg backend and never imports Streamlit.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+
+from graph_utils import (MY_COLORS, IMAGE_FORMATS, REGION_RELATIONS, latex_to_python, compile_latex,
+                         adaptive_sample, adaptive_sample_parametric, explicit_boundary,
+                         area_between, encode_scene, free_parameters, bind_parameters)
+
+# Same defaults as the sidebar of the app
+DEFAULT_AXES = {
+    "xuserlower": -2.0,
+    "xuserupper": 8.0,
+    "yuserlower": -2.0,
+    "yuserupper": 8.0,
+    "xstep": 2,
+    "ystep": 2,
+    "gridstyle": "None",
+    "xminordivisor": 4,
+    "yminordivisor": 4,
+    "imagewidth": 10,
+    "imageheight": 8,
+    "showvalues": True,
+    "axis_weight": 3.0,
+    "label_size": 20,
+    "white_background": True,
+}
+
+LINE_STYLES = {"solid": "-", "dashed": "--", "dotted": ":"}
+
+SAMPLE_DPI = 300  # curves are sampled to be exact at this resolution, like the app's PNG download
+
+
+def _color(name):
+    return MY_COLORS.get(name, name)
+
+
+def _line_style(style):
+    return LINE_STYLES.get(style, style)
+
+
+def _relation(relation):
+    if relation != "=" and relation not in REGION_RELATIONS:
+        raise ValueError(f"unknown relation {relation!r}, use one of =, {', '.join(REGION_RELATIONS)}")
+    return relation
+
+
+def _python_expr(latex_str, parameters, param_var='x', variables=None):
+    """The Python expression for latex_str in the variables (param_var by default), with the
+    values of its free parameters from the spec's "parameters" filled in."""
+    python_str, error = latex_to_python(str(latex_str), param_var=param_var)
+    if python_str is None:
+        raise ValueError(f"{latex_str!r}: {error}")
+    names = free_parameters(python_str, variables or (param_var,))
+    missing = [name for name in names if name not in parameters]
+    if missing:
+        raise ValueError(f"{latex_str!r}: no value for {', '.join(missing)}; "
+                         f"give it in the \"parameters\" of the spec")
+    return bind_parameters(python_str, parameters) if names else python_str
+
+
+def _parameters(spec):
+    parameters = spec.get("parameters", {})
+    if not isinstance(parameters, dict):
+        raise ValueError('"parameters" must map names to numbers')
+    try:
+        return {str(name): float(value) for name, value in parameters.items()}
+    except (TypeError, ValueError):
+        raise ValueError('"parameters" must map names to numbers') from None
+
+
+def _file_name(name):
+    """The spec's name, which must be usable as a file name in the output directory."""
+    name = str(name)
+    if name in ("", ".", "..") or "/" in name or (os.altsep and os.altsep in name) or os.sep in name:
+        raise ValueError(f"name {name!r} is not a plain file name")
+    return name
+
+
+def _number(value):
+    """A number given as a number or as LaTeX, e.g. "-\\pi" or "\\frac{3}{2}"."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    import sympy as sp  # like graph_utils, only imported when needed
+
+    compiled = compile_latex(str(value))
+    if compiled.python_str is None:
+        raise ValueError(f"{value!r}: {compiled.expr}")
+    return float(compiled.expr.subs(sp.Symbol('pi'), sp.pi).evalf())  # parse_latex gives pi as a symbol
+
+
+def scene_from_spec(spec):
+    """Builds the scene render_scene draws from a spec (see the module docstring):
+    pads the axes like the app does, samples every curve and resolves colours."""
+    axes = dict(DEFAULT_AXES, **spec.get("axes", {}))
+    xdifference = axes["xuserupper"] - axes["xuserlower"]
+    ydifference = axes["yuserupper"] - axes["yuserlower"]
+    axes["xlower"] = axes["xuserlower"] - 0.025 * xdifference
+    axes["xupper"] = axes["xuserupper"] + 0.025 * xdifference
+    axes["ylower"] = axes["yuserlower"] - 0.025 * ydifference
+    axes["yupper"] = axes["yuserupper"] + 0.025 * ydifference
+    viewport = (axes["xlower"], axes["xupper"], axes["ylower"], axes["yupper"])
+    pixel_size = (axes["imagewidth"] * SAMPLE_DPI, axes["imageheight"] * SAMPLE_DPI)
+    parameters = _parameters(spec)
+
+    zorder = 10  # later items are drawn on top, like the plot counter in the app
+    scene = {"axes": axes, "functions": [], "implicit_functions": [], "parametric_functions": [],
+             "points": [], "areas": []}
+
+    for item in spec.get("functions", []):
+        zorder += 1
+        x, y = adaptive_sample(_python_expr(item["latex"], parameters), *viewport, pixel_size)
+        scene["functions"].append({"x": x, "y": y, "color": _color(item.get("color", "blue")),
+                                   "line_style": _line_style(item.get("line_style", "-")),
+                                   "zorder": zorder})
+
+    for item in spec.get("implicit_functions", []):
+        zorder += 1
+        scene["implicit_functions"].append({"function": _python_expr(item["latex"], parameters,
+                                                                      variables=('x', 'y')),
+                                            "relation": _relation(item.get("relation", "=")),
+                                            "color": _color(item.get("color", "blue")),
+                                            "line_style": _line_style(item.get("line_style", "-")),
+                                            "zorder": zorder})
+
+    for item in spec.get("parametric_functions", []):
+        zorder += 1
+        t_start, t_end = (_number(value) for value in item.get("t_range", [-np.pi, np.pi]))
+        x, y = adaptive_sample_parametric(_python_expr(item["x"], parameters, 't'),
+                                          _python_expr(item["y"], parameters, 't'),
+                                          t_start, t_end, *viewport, pixel_size)
+        scene["parametric_functions"].append({"x": x, "y": y, "color": _color(item.get("color", "blue")),
+                                              "line_style": _line_style(item.get("line_style", "-")),
+                                              "zorder": zorder})
+
+    for item in spec.get("points", []):
+        zorder += 1
+        scene["points"].append({"x": float(item["x"]), "y": float(item["y"]),
+                                "marker": item.get("marker", "x"),
+                                "color": _color(item.get("color", "blue")),
+                                "zorder": 1000 + zorder})
+
+    for item in spec.get("areas", []):
+        # Areas between two explicit functions (or constants) of x
+        x_start, x_end = (_number(value) for value in item.get("x_range", [axes["xuserlower"], axes["xuserupper"]]))
+        upper, lower = (explicit_boundary(_python_expr(item.get(side, "0"), parameters), *viewport, pixel_size)
+                        for side in ("upper", "lower"))
+        filled = area_between(upper, lower, x_start, x_end,
+                              axes["ylower"] - 0.025 * ydifference, axes["yupper"] + 0.025 * ydifference)
+        scene["areas"].append({"x": filled.x, "lower": filled.lower, "upper": filled.upper,
+                               "color": _color(item.get("color", "blue")),
+                               "opacity": item.get("opacity", 0.3)})
+
+    return scene
+
+
+def render_spec(spec, output_dir, fmt="svg", dpi=None, options=None):
+    """Renders one spec and writes it to output_dir/<name>.<fmt>, with options overriding
+    those of the format (see encode_scene).
+    Returns (name, path, seconds, error) where error is None on success."""
+    start = time.perf_counter()
+    name = spec["name"]
+    extension = IMAGE_FORMATS[fmt]["format"]
+    try:
+        path = os.path.join(output_dir, f"{_file_name(name)}.{extension}")
+        data = encode_scene(scene_from_spec(spec), fmt, dpi, **(options or {}))
+        with open(path, "w" if extension == "svg" else "wb") as file:
+            file.write(data)
+    except Exception as e:
+        return name, None, time.perf_counter() - start, f"{type(e).__name__}: {e}"
+    return name, path, time.perf_counter() - start, None
+
+
+def _render_spec_args(args):
+    return render_spec(*args)
+
+
+def render_batch(specs, output_dir, fmt="svg", dpi=None, workers=None, chunksize=4, options=None):
+    """Renders specs across a process pool, writing each file as soon as it is done.
+    Yields render_spec results in the order of specs. workers=1 renders in this process."""
+    os.makedirs(output_dir, exist_ok=True)
+    specs = [dict(spec, name=spec.get("name") or f"graph{i:05d}") for i, spec in enumerate(specs)]
+    jobs = [(spec, output_dir, fmt, dpi, options) for spec in specs]
+    if workers == 1:
+        yield from map(_render_spec_args, jobs)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(_render_spec_args, jobs, chunksize=chunksize)
+
+
+def load_specs(path):
+    """Reads a list of specs from a .json, .yaml or .yml file."""
+    with open(path) as file:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise SystemExit("Reading YAML specs needs PyYAML (pip install pyyaml)")
+            data = yaml.safe_load(file)
+        else:
+            data = json.load(file)
+    if isinstance(data, dict):
+        data = data.get("scenes", [])
+    return data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render graph scenes from JSON or YAML specs.")
+    parser.add_argument("specs", help="JSON or YAML file with a list of scene specs")
+    parser.add_argument("-o", "--output", default="graphs", help="output directory (default: graphs)")
+    parser.add_argument("-f", "--format", choices=["svg", "svg-compact", "png"], default="svg")
+    parser.add_argument("--dpi", type=int, default=None, help="PNG resolution (default: 300)")
+    parser.add_argument("--rasterize-dense", action="store_true",
+                        help="embed dense curves and areas in SVG files as images")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="only print the summary")
+    args = parser.parse_args(argv)
+
+    specs = load_specs(args.specs)
+    start = time.perf_counter()
+    failed = 0
+    for done, (name, path, seconds, error) in enumerate(
+            render_batch(specs, args.output, args.format, args.dpi, args.workers,
+                         options={"rasterize_dense": True} if args.rasterize_dense else None), start=1):
+        if error:
+            failed += 1
+            print(f"[{done}/{len(specs)}] {name}: {error}", file=sys.stderr)
+        elif not args.quiet:
+            print(f"[{done}/{len(specs)}] {path} ({seconds * 1000:.0f} ms)")
+    elapsed = time.perf_counter() - start
+    rate = len(specs) / elapsed if elapsed > 0 else 0
+    print(f"Rendered {len(specs) - failed} of {len(specs)} scenes in {elapsed:.1f} s "
+          f"({rate:.1f} scenes/s)", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,459 @@
+"""Benchmarks for the hot paths of graph_utils.
+
+Every case is timed (the median of at least --repeat runs, and of as many as fit in
+MIN_MEASURE_SECONDS) and run once more under tracemalloc for its peak memory. Results are
+compared with benchmark_baseline.json and the run fails if a case got slower or bigger
+than the thresholds allow. Timings on a shared machine are noisy, so the allowed slowdown
+also covers the spread of the runs (their interquartile range), and a case that looks
+slower is measured again, after the other cases, before it counts as a regression.
+Baselines depend on the machine, so refresh them with --update after changing hardware,
+or when a change is meant to be slower.
+
+Usage:
+    python benchmark.py                 # compare with the baseline
+    python benchmark.py --update        # record a new baseline
+    python benchmark.py -k implicit     # only cases whose name contains "implicit"
+
+This module uses the Agg backend and never imports Streamlit.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+
+import graph_utils as gu
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(HERE, "benchmark_baseline.json")
+
+TIME_THRESHOLD = 0.5  # fail when a case takes 50% longer than its baseline...
+MIN_TIME_REGRESSION = 0.005  # ...and at least 5 ms longer, so timer noise on small cases does not count...
+NOISE_SPREADS = 3  # ...and longer by more than 3 times the spread of its runs
+MIN_MEASURE_SECONDS = 1.0  # cases run at least this long in total...
+MAX_RUNS = 100  # ...unless they are this many runs in
+MEMORY_THRESHOLD = 0.25  # fail when the peak memory grows by more than 25%...
+MIN_MEMORY_REGRESSION = 64 * 1024  # ...and by at least 64 kB
+MAX_RSS_GROWTH = 8 * 1024 * 1024  # lifecycle cases fail when the process still grows by this...
+LIFECYCLE_WARMUP = 50  # ...after this many renders...
+LIFECYCLE_RENDERS = 600  # ...from the first half of this many more to the second
+RSS_SAMPLE_EVERY = 50
+
+# The app's defaults: the axes from the sidebar and the functions in the first input rows
+AXES = {
+    "xlower": -2.25, "xupper": 8.25, "ylower": -2.25, "yupper": 8.25,
+    "xstep": 2, "ystep": 2, "gridstyle": "None", "xminordivisor": 4, "yminordivisor": 4,
+    "imagewidth": 10, "imageheight": 8,
+    "xuserlower": -2.0, "xuserupper": 8.0, "yuserlower": -2.0, "yuserupper": 8.0,
+    "showvalues": True, "axis_weight": 3.0, "label_size": 20, "white_background": True,
+}
+VIEWPORT = (AXES["xlower"], AXES["xupper"], AXES["ylower"], AXES["yupper"])
+PIXEL_SIZE = (AXES["imagewidth"] * 300, AXES["imageheight"] * 300)  # sampled for the 300 dpi PNG
+
+DEFAULT_LATEX = r"\frac{x}{2}-\sin(x)"
+DEFAULT_FUNCTION = "x/2 - lib.sin(x)"
+TRIG_FUNCTION = "lib.tan(x)"  # asymptotes
+DENSE_TRIG_FUNCTION = "lib.tan(5*x) + lib.sin(40*x)"
+LAZY_MODULES = ("sympy", "antlr4", "streamlit")  # must not be imported with the plotting core
+PARAMETER_FUNCTION = "a*lib.sin(b*x)"
+CIRCLE = "x**2 + y**2 - 1"
+DENSE_IMPLICIT = "lib.sin(x**2 + y**2) - lib.cos(x*y)"  # many closed curves
+
+CASES = {}
+
+def case(name, repeat=None):
+    """Registers a setup function returning the callable to benchmark. The callable may
+    return bytes or str, whose length is reported as the output size. repeat overrides
+    --repeat, e.g. 1 for checks that are slow and not about time."""
+    def register(setup):
+        setup.repeat = repeat
+        CASES[name] = setup
+        return setup
+    return register
+
+def clear_caches():
+    for cache in (gu.expression_cache, gu.code_cache, gu.sample_cache, gu.extent_cache,
+                  gu.singularity_cache, gu.contour_cache, gu.region_cache, gu.render_cache):
+        cache.clear()
+
+def default_scene():
+    x, y = gu.sampled_function(DEFAULT_FUNCTION, *VIEWPORT, PIXEL_SIZE)
+    t, u = gu.sampled_function(TRIG_FUNCTION, *VIEWPORT, PIXEL_SIZE)
+    px, py = gu.sampled_parametric("lib.cos(t)", "lib.sin(t)", -np.pi, np.pi, *VIEWPORT, PIXEL_SIZE)
+    return {
+        "axes": AXES,
+        "functions": [
+            {"x": x, "y": y, "color": gu.MY_COLORS["blue"], "line_style": "-", "zorder": 11},
+            {"x": t, "y": u, "color": gu.MY_COLORS["red"], "line_style": "--", "zorder": 12},
+        ],
+        "implicit_functions": [{"function": CIRCLE, "relation": "=", "color": gu.MY_COLORS["green"],
+                                "line_style": "-", "zorder": 13}],
+        "parametric_functions": [{"x": px, "y": py, "color": gu.MY_COLORS["pink"], "line_style": ":",
+                                  "zorder": 14}],
+        "points": [{"x": 1.0, "y": 2.0, "marker": "o", "color": gu.MY_COLORS["grey"], "zorder": 1015}],
+        "areas": [],
+    }
+
+def cold_import(module):
+    """Imports module in a fresh interpreter (so the time includes starting Python) and
+    fails if that imported any of LAZY_MODULES."""
+    code = f"import sys, {module}; print(' '.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    loaded = subprocess.run([sys.executable, "-c", code], cwd=HERE, check=True,
+                            capture_output=True, text=True).stdout.strip()
+    if loaded:
+        raise RuntimeError(f"importing {module} also imported {loaded}")
+
+@case("import/graph_utils")
+def _():
+    return lambda: cold_import("graph_utils")
+
+@case("import/batch_render")
+def _():
+    return lambda: cold_import("batch_render")
+
+@case("latex_to_python/parse")
+def _():
+    def run():
+        gu.expression_cache.clear()
+        gu.code_cache.clear()
+        gu.latex_to_python(DEFAULT_LATEX)
+        gu.latex_to_python(r"\tan(x)")
+        gu.latex_to_python(r"\cos(t)", param_var='t')
+    return run
+
+@case("latex_to_python/cached")
+def _():
+    gu.latex_to_python(DEFAULT_LATEX)
+    return lambda: [gu.latex_to_python(DEFAULT_LATEX) for _ in range(1000)]
+
+@case("eval_function/default-100k")
+def _():
+    x = np.linspace(AXES["xlower"], AXES["xupper"], 100_000)
+    return lambda: gu.eval_function(DEFAULT_FUNCTION, x.copy(), np, AXES["ylower"], AXES["yupper"])
+
+@case("eval_function/tan-100k")
+def _():
+    x = np.linspace(AXES["xlower"], AXES["xupper"], 100_000)
+    return lambda: gu.eval_function(TRIG_FUNCTION, x.copy(), np, AXES["ylower"], AXES["yupper"])
+
+@case("eval_function/trig-sum-1M")
+def _():
+    x = np.linspace(AXES["xlower"], AXES["xupper"], 1_000_000)
+    return lambda: gu.eval_function("lib.sin(x)**2 + lib.cos(2*x) - x/3", x.copy(), np,
+                                    AXES["ylower"], AXES["yupper"])
+
+@case("adaptive_sample/default")
+def _():
+    return lambda: gu.adaptive_sample(DEFAULT_FUNCTION, *VIEWPORT, PIXEL_SIZE)
+
+@case("adaptive_sample/tan")
+def _():
+    return lambda: gu.adaptive_sample(TRIG_FUNCTION, *VIEWPORT, PIXEL_SIZE)
+
+@case("adaptive_sample/dense-trig")
+def _():
+    return lambda: gu.adaptive_sample(DENSE_TRIG_FUNCTION, *VIEWPORT, PIXEL_SIZE)
+
+@case("adaptive_sample/parametric-circle")
+def _():
+    return lambda: gu.adaptive_sample_parametric("lib.cos(t)", "lib.sin(t)", -np.pi, np.pi,
+                                                 *VIEWPORT, PIXEL_SIZE)
+
+@case("singular_points/tan-symbolic")
+def _():
+    def run():
+        gu.singularity_cache.clear()
+        return gu.singular_points(TRIG_FUNCTION, AXES["xlower"], AXES["xupper"])
+    return run
+
+@case("get_y_values_for_curve/100k")
+def _():
+    t = np.linspace(0, 2 * np.pi, 100_000)
+    x, y = 3 + 3 * np.cos(t), 3 + 2 * np.sin(t)
+    x_fill = np.linspace(0, 6, 1000)
+    return lambda: (gu.get_y_values_for_curve(x_fill, x, y, take_max=True),
+                    gu.get_y_values_for_curve(x_fill, x, y, take_max=False))
+
+@case("implicit/circle")
+def _():
+    def run():
+        gu.contour_cache.clear()
+        return gu.implicit_contour(CIRCLE, *VIEWPORT)
+    return run
+
+@case("implicit/dense")
+def _():
+    def run():
+        gu.contour_cache.clear()
+        return gu.implicit_contour(DENSE_IMPLICIT, *VIEWPORT)
+    return run
+
+@case("implicit/region-300dpi")
+def _():
+    gu.implicit_contour(CIRCLE, *VIEWPORT)
+    def run():
+        gu.region_cache.clear()
+        return gu.inequality_mask(CIRCLE, "<", *VIEWPORT, *PIXEL_SIZE)
+    return run
+
+@case("area_between/explicit-implicit")
+def _():
+    upper = gu.explicit_boundary(DEFAULT_FUNCTION, *VIEWPORT, PIXEL_SIZE)
+    lower = gu.curve_boundary(gu.implicit_contour(CIRCLE, *VIEWPORT).segments)
+    return lambda: gu.area_between(upper, lower, -2, 8, AXES["ylower"], AXES["yupper"])
+
+@case("create_graph/default")
+def _():
+    def run():
+        fig, _ = gu.create_graph(**AXES)
+        gu.release_figure(fig)
+    return run
+
+@case("scene_hash/default")
+def _():
+    scene = default_scene()
+    def run():
+        gu.scene_hash(scene)
+    return run
+
+@case("savefig/preview-png")
+def _():
+    scene = default_scene()
+    return lambda: gu.encode_scene(scene, "preview")
+
+@case("savefig/png-300dpi")
+def _():
+    scene = default_scene()
+    return lambda: gu.encode_scene(scene, "png", 300)
+
+@case("savefig/svg")
+def _():
+    scene = default_scene()
+    return lambda: gu.encode_scene(scene, "svg")
+
+@case("savefig/svg-compact")
+def _():
+    scene = default_scene()
+    return lambda: gu.encode_scene(scene, "svg-compact")
+
+def dense_scene():
+    """The default scene with a dense explicit function, DENSE_IMPLICIT, a shaded region and an area."""
+    x, y = gu.sampled_function(DENSE_TRIG_FUNCTION, *VIEWPORT, PIXEL_SIZE)
+    upper = gu.explicit_boundary(DEFAULT_FUNCTION, *VIEWPORT, PIXEL_SIZE)
+    area = gu.area_between(upper, gu.constant_boundary(0.0), 0, 6, AXES["ylower"], AXES["yupper"])
+    scene = default_scene()
+    scene["functions"].append({"x": x, "y": y, "color": gu.MY_COLORS["orange"], "line_style": "-", "zorder": 15})
+    scene["implicit_functions"] += [
+        {"function": DENSE_IMPLICIT, "relation": "=", "color": gu.MY_COLORS["blue"], "line_style": "-", "zorder": 16},
+        {"function": CIRCLE, "relation": "<", "color": gu.MY_COLORS["red"], "line_style": "--", "zorder": 17},
+    ]
+    scene["areas"].append({"x": area.x, "lower": area.lower, "upper": area.upper,
+                           "color": gu.MY_COLORS["yellow"], "opacity": 0.3})
+    return scene
+
+@case("savefig/svg-dense")
+def _():
+    scene = dense_scene()
+    return lambda: gu.encode_scene(scene, "svg")
+
+@case("savefig/svg-compact-dense")
+def _():
+    scene = dense_scene()
+    return lambda: gu.encode_scene(scene, "svg-compact")
+
+@case("vector_preview/default")
+def _():
+    # The JSON sent to the browser in place of the preview PNG above
+    from vector_preview import _vector_preview
+
+    scene = default_scene()
+    return lambda: json.dumps(_vector_preview(scene))
+
+CLASS_SIZE = 30  # sessions opening the app at once
+
+@case("cache/classroom")
+def _():
+    # Every session starts with the same function, circle and parametric curve, so the shared
+    # caches should compute each once however many sessions ask for them at the same time
+    def session(_):
+        python_str, _ = gu.latex_to_python(DEFAULT_LATEX)
+        gu.sampled_function(python_str, *VIEWPORT, PIXEL_SIZE)
+        gu.implicit_contour(CIRCLE, *VIEWPORT)
+        gu.sampled_parametric("lib.cos(t)", "lib.sin(t)", -np.pi, np.pi, *VIEWPORT, PIXEL_SIZE)
+    def run():
+        clear_caches()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(session, range(CLASS_SIZE)))
+        for cache, curves in ((gu.sample_cache, 2), (gu.contour_cache, 1)):
+            if cache.misses > curves:
+                raise RuntimeError(f"{cache.misses} misses for {curves} curves, sessions computed them again")
+    return run
+
+def rss_bytes():
+    """The resident set size of this process, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+@case("lifecycle/preview-x600")
+def _():
+    # tracemalloc does not see Agg's pixel buffers, so this checks the RSS instead: every
+    # preview has a pixel buffer, which must be freed with its figure. After a warm-up, the
+    # RSS is sampled every RSS_SAMPLE_EVERY renders, as over the reruns of a long session.
+    # That runs once here; the timed runs are single previews
+    scene = dict(default_scene(), axes=dict(AXES, imagewidth=4, imageheight=3))  # smaller, so quicker
+    def render(count):
+        for _ in range(count):
+            gu.render_cache.clear()
+            gu.render_scene_cached(scene, "preview")
+    render(LIFECYCLE_WARMUP)  # the allocator and the caches settle first
+    samples = [rss_bytes()]
+    for _ in range(LIFECYCLE_RENDERS // RSS_SAMPLE_EVERY):
+        render(RSS_SAMPLE_EVERY)
+        samples.append(rss_bytes())
+    if None not in samples:
+        # The RSS dips by a buffer whenever one happens to be free, so the halves compare by their peaks
+        half = len(samples) // 2
+        grown = max(samples[half:]) - max(samples[:half])
+        if grown > MAX_RSS_GROWTH:
+            raise RuntimeError(f"the RSS grew by {grown / 1e6:.1f} MB over {LIFECYCLE_RENDERS} previews after the "
+                               "warm-up, something is not freed")
+    return lambda: render(1)
+
+def sweep_scene():
+    """The default scene with a*sin(b*x) as a curve with parameters."""
+    return dict(default_scene(), parameters={"a": 2.0, "b": 1.0},
+                curves=[{"kind": "explicit", "function": PARAMETER_FUNCTION, "color": gu.MY_COLORS["orange"],
+                         "line_style": "-", "zorder": 15}])
+
+@case("sweep/frame-preview")
+def _():
+    from sweep import SweepRenderer
+
+    renderer = SweepRenderer(sweep_scene(), gu.IMAGE_FORMATS["preview"]["dpi"])
+    values = iter(np.linspace(0.5, 3, 10_000))  # a new value every run, so nothing is cached
+    return lambda: renderer.frame({"a": next(values)})
+
+@case("sweep/redraw-preview")
+def _():
+    # What a frame costs without SweepRenderer: the whole figure, drawn but not encoded
+    scene = sweep_scene()
+    values = iter(np.linspace(0.5, 3, 10_000))
+    def run():
+        fig, _ = gu.render_scene(dict(scene, parameters={"a": next(values), "b": 1.0}),
+                                 gu.IMAGE_FORMATS["preview"]["dpi"])
+        fig.set_dpi(gu.IMAGE_FORMATS["preview"]["dpi"])
+        fig.canvas.draw()
+        gu.release_figure(fig)
+    return run
+
+def measure(setup, repeat):
+    """Runs one case: at least `repeat` timed runs (as many as fit in MIN_MEASURE_SECONDS,
+    up to MAX_RUNS) for the median time and its spread, then one run under tracemalloc."""
+    clear_caches()
+    repeat = setup.repeat or repeat
+    run = setup()
+    output = run()  # warm up: imports, mathtext and tick label caches
+    times = []
+    while len(times) < repeat or (sum(times) < MIN_MEASURE_SECONDS and len(times) < MAX_RUNS and not setup.repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    lower, median, upper = np.percentile(times, [25, 50, 75])
+    result = {"seconds": float(median), "spread_seconds": float(upper - lower), "runs": len(times), "peak_bytes": peak}
+    if isinstance(output, (bytes, str)):
+        result["output_bytes"] = len(output)
+    return result
+
+def compare(name, result, baseline, time_threshold, memory_threshold):
+    """Returns a list of the ways result regressed from baseline."""
+    problems = []
+    spread = max(baseline.get("spread_seconds", 0), result.get("spread_seconds", 0))
+    if result["seconds"] - baseline["seconds"] > max(baseline["seconds"] * time_threshold, MIN_TIME_REGRESSION,
+                                                     NOISE_SPREADS * spread):
+        problems.append(f"time {baseline['seconds'] * 1000:.1f} -> {result['seconds'] * 1000:.1f} ms")
+    if result["peak_bytes"] > baseline["peak_bytes"] * (1 + memory_threshold) and \
+            result["peak_bytes"] - baseline["peak_bytes"] > MIN_MEMORY_REGRESSION:
+        problems.append(f"peak memory {baseline['peak_bytes'] / 1e6:.2f} -> {result['peak_bytes'] / 1e6:.2f} MB")
+    return problems
+
+def result_line(name, result):
+    line = (f"{name:40} {result['seconds'] * 1000:9.2f} ms ±{result['spread_seconds'] * 500:7.2f} "
+            f"{result['peak_bytes'] / 1e6:9.2f} MB")
+    if "output_bytes" in result:
+        line += f" {result['output_bytes'] / 1e3:9.1f} kB out"
+    return line
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths of graph_utils.")
+    parser.add_argument("-k", "--filter", default="", help="only run cases whose name contains this")
+    parser.add_argument("-r", "--repeat", type=int, default=9,
+                        help="least number of timed runs per case (default: %(default)s)")
+    parser.add_argument("--update", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline file (default: %(default)s)")
+    parser.add_argument("--time-threshold", type=float, default=TIME_THRESHOLD,
+                        help="allowed relative slowdown (default: %(default)s)")
+    parser.add_argument("--memory-threshold", type=float, default=MEMORY_THRESHOLD,
+                        help="allowed relative growth of peak memory (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baselines = json.load(file)
+
+    results = {}
+    suspects = []
+    for name, setup in CASES.items():
+        if args.filter not in name:
+            continue
+        result = results[name] = measure(setup, args.repeat)
+        line = result_line(name, result)
+        if not args.update and name in baselines and \
+                compare(name, result, baselines[name], args.time_threshold, args.memory_threshold):
+            suspects.append(name)
+            line += "  slower, measuring again at the end"
+        print(line)
+
+    # A burst of load on the machine can last a few cases, so the suspects are measured again
+    # after the others, and each keeps its faster result
+    failures = 0
+    for name in suspects:
+        again = measure(CASES[name], args.repeat)
+        if again["seconds"] < results[name]["seconds"]:
+            results[name] = again
+        problems = compare(name, results[name], baselines[name], args.time_threshold, args.memory_threshold)
+        if problems:
+            failures += 1
+            print(result_line(name, results[name]) + "  REGRESSION: " + "; ".join(problems))
+        else:
+            print(result_line(name, results[name]))
+
+    if args.update:
+        baselines.update(results)
+        with open(args.baseline, "w") as file:
+            json.dump(baselines, file, indent=2, sort_keys=True)
+            file.write("\n")
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+        return 0
+    if failures:
+        print(f"{failures} case(s) regressed", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
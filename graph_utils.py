@@ -1,20 +1,192 @@
+"""Parsing, sampling and drawing of the graphs, without Streamlit.
+
+Only NumPy and Matplotlib are imported with this module. SymPy, and the LaTeX parser with
+its ANTLR runtime, take longer to import than everything else together, so they are
+imported by the functions that need them, the first time those run: parsing LaTeX,
+finding poles, tracing implicit curves and labelling non-integer ticks. Worker processes
+and command line tools that never do those start quickly; benchmark.py tracks the import time.
+"""
 import numpy as np
-from matplotlib.animation import FuncAnimation
-import matplotlib.pyplot as plt
-from matplotlib.ticker import FuncFormatter
-import sympy as sp
-from sympy import nsimplify, pi, E, latex
-from sympy.parsing.latex import parse_latex
-import streamlit as st
+from matplotlib.backend_bases import FigureCanvasBase
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.ticker import FuncFormatter, MultipleLocator
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.colors import to_rgba
+from matplotlib.mathtext import MathTextParser
+from matplotlib.path import Path
+import ast
 import io
+import operator
+import os
+import re
+import sys
+import threading
+import time
+import hashlib
+import inspect
+from collections import Counter, OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from timing import span, timed, in_context
 
 # Add this constant at the top with the other imports
 E = 2.7182818284590452  # Euler's number
 
+MY_COLORS = {
+    'blue': '#82DCF2',
+    'red': '#EF665F',
+    'green': '#8FE384',
+    'yellow': '#FFC753',
+    'orange': '#FF8A56',
+    'pink': '#F688C9',
+    'grey': '#4C5B64'
+}
+
+def state_nbytes(obj):
+    """Roughly how many bytes obj holds: array buffers plus the containers, strings and
+    numbers around them. Used to report the size of a session's state and for the memory
+    budget of the shared caches."""
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) if obj.base is None else sys.getsizeof(obj) + obj.nbytes
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(state_nbytes(k) + state_nbytes(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set)):
+        return sys.getsizeof(obj) + sum(state_nbytes(item) for item in obj)
+    return sys.getsizeof(obj)
+
+class LRUCache:
+    """A bounded, thread-safe least-recently-used cache that counts hits and misses.
+    Module-level instances are shared by every Streamlit session in the process.
+    Besides maxsize entries, it can be bounded to maxbytes as measured by sizeof
+    (state_nbytes by default); least recently used entries are evicted first."""
+
+    def __init__(self, maxsize=256, maxbytes=None, sizeof=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof or state_nbytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._pending = {}  # key -> Event set once the thread computing it is done
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        size = self.sizeof(value) if self.maxbytes is not None else 0
+        with self._lock:
+            if key in self._data:
+                self.nbytes -= self._sizes.pop(key)
+                del self._data[key]
+            if self.maxbytes is not None and size > self.maxbytes:
+                return  # would evict everything else and still not fit
+            self._data[key] = value
+            self._sizes[key] = size
+            self.nbytes += size
+            while len(self._data) > self.maxsize or (self.maxbytes is not None and self.nbytes > self.maxbytes):
+                old, _ = self._data.popitem(last=False)
+                self.nbytes -= self._sizes.pop(old)
+
+    def get_or_compute(self, key, compute):
+        """Returns the cached value for key, calling compute() and storing its result on a miss.
+        Threads missing a key that another thread is computing wait for its result, so a class
+        opening the same page at once computes it once."""
+        while True:
+            with self._lock:
+                if key in self._data:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return self._data[key]
+                pending = self._pending.get(key)
+                if pending is None:
+                    self.misses += 1
+                    pending = self._pending[key] = threading.Event()
+                    break
+            # Then it is cached, unless compute() failed or it was evicted already: try again
+            pending.wait()
+        try:
+            value = compute()
+            self.put(key, value)
+            return value
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """Returns the hit and miss counts, the current and maximum size and the bytes held."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "maxsize": self.maxsize,
+                    "nbytes": self.nbytes, "maxbytes": self.maxbytes}
+
+    def __len__(self):
+        return len(self._data)
+
+MB = 1024 * 1024  # for the memory budgets of the caches
+
+# Parsed form of one LaTeX input: the SymPy expression, the Python source built from it
+# and that source compiled to a code object (None when the LaTeX could not be parsed)
+CompiledExpression = namedtuple("CompiledExpression", ["expr", "python_str", "code"])
+
+expression_cache = LRUCache(maxsize=256)  # (latex_str, param_var) -> CompiledExpression
+code_cache = LRUCache(maxsize=512)  # python source -> code object, used by eval_function
+
+def compile_source(python_str):
+    """Returns the code object for a Python expression string, compiling it only once."""
+    return code_cache.get_or_compute(python_str, lambda: compile(python_str, "<expression>", "eval"))
+
+def compile_latex(latex_str, param_var='x'):
+    """Returns the cached CompiledExpression for a LaTeX input, parsing it on first use.
+    For invalid LaTeX, python_str and code are None and expr holds the error message."""
+    return expression_cache.get_or_compute((latex_str, param_var),
+                                           lambda: _compile_latex(latex_str, param_var))
+
+@timed("parse LaTeX")
+def _compile_latex(latex_str, param_var):
+    python_str, expr = _latex_to_python(latex_str, param_var)
+    if python_str is None:
+        return CompiledExpression(expr, None, None)
+    try:
+        code = compile_source(python_str)
+    except SyntaxError:
+        code = None  # eval_function reports the error when the function is actually plotted
+    return CompiledExpression(expr, python_str, code)
+
+def expression_cache_info():
+    """Returns hit/miss statistics of the LaTeX and code caches."""
+    return {"latex": expression_cache.info(), "code": code_cache.info()}
+
+@timed()
 def latex_to_python(latex_str, param_var='x'):
     """Converts LaTeX math expression to Python code.
     Returns (python_str, preview_expr) on success or (None, error_msg) on failure.
-    param_var: the variable to use in the expression (default 'x' for regular functions, 't' for parametric)"""
+    param_var: the variable to use in the expression (default 'x' for regular functions, 't' for parametric)
+    Results are cached, so unchanged inputs are not parsed again on every rerun."""
+    compiled = compile_latex(latex_str, param_var)
+    return compiled.python_str, compiled.expr
+
+def _latex_to_python(latex_str, param_var='x'):
+    """Uncached implementation of latex_to_python."""
+    from sympy.parsing.latex import parse_latex  # slow to import, see the module docstring
+
     try:
         # Handle \log(x) before parsing - replace with \log_{10}(x)
         if r'\log(' in latex_str and not r'\log_' in latex_str:
@@ -60,57 +232,1259 @@ def latex_to_python(latex_str, param_var='x'):
     except Exception as e:
         return None, f"Invalid LaTeX: {str(e)}"
 
+# Explicit and parametric functions of NumPy arrays are evaluated by kernels compiled from
+# their Python source. Every operation is a NumPy ufunc writing into a scratch buffer that is
+# reused, over chunks of KERNEL_CHUNK values, so an evaluation allocates its result and
+# nothing else. The ufuncs and their order are the ones eval() uses, so results are identical.
+KERNEL_CHUNK = 1 << 13  # values per chunk: the scratch buffers of a kernel stay in cache
+
+_BINARY_OPERATORS = {ast.Add: (operator.add, np.add), ast.Sub: (operator.sub, np.subtract),
+                     ast.Mult: (operator.mul, np.multiply), ast.Div: (operator.truediv, np.true_divide),
+                     ast.Pow: (operator.pow, np.power)}
+_UNARY_OPERATORS = {ast.USub: (operator.neg, np.negative), ast.UAdd: (operator.pos, np.positive)}
+
+kernel_cache = LRUCache(maxsize=512)  # (python source, variable) -> ExpressionKernel, or None
+
+# Names an expression may use besides its variables; any other name is a free parameter
+EXPRESSION_NAMES = frozenset({"lib", "log", "log10", "E", "pi"})
+
+class ExpressionKernel:
+    """An expression of one variable compiled to steps (ufunc, arguments, target) over
+    registers: register 0 is the variable, the others are scratch buffers and target None is
+    the result. Arguments are register numbers, constants wrapped in a 1-tuple, or the names
+    of free parameters."""
+
+    def __init__(self, steps, registers):
+        self.steps = steps
+        self.registers = registers
+        self.parameterized = any(isinstance(a, str) for _, arguments, _ in steps for a in arguments)
+
+    def __call__(self, values, parameters=None):
+        """Evaluates the expression at every value of a float64 array, with parameters
+        mapping the names of its free parameters to numbers; returns a new array."""
+        steps = self.steps
+        if self.parameterized:
+            steps = [(ufunc, tuple((_parameter(parameters, a),) if isinstance(a, str) else a
+                                   for a in arguments), target)
+                     for ufunc, arguments, target in steps]
+        result = np.empty(values.shape)
+        flat_values, flat_result = values.reshape(-1), result.reshape(-1)
+        buffers = _scratch_buffers(self.registers - 1)
+        for start in range(0, flat_values.size, KERNEL_CHUNK):
+            stop = min(start + KERNEL_CHUNK, flat_values.size)
+            registers = [flat_values[start:stop]] + [buffer[:stop - start] for buffer in buffers]
+            out = flat_result[start:stop]
+            for ufunc, arguments, target in steps:
+                ufunc(*[registers[a] if isinstance(a, int) else a[0] for a in arguments],
+                      out=out if target is None else registers[target])
+        return result
+
+def _parameter(parameters, name):
+    if not parameters or name not in parameters:
+        raise NameError(f"name '{name}' is not defined")  # what eval() would say
+    return parameters[name]
+
+_scratch = threading.local()
+
+def _scratch_buffers(count, dtype=float):
+    """count buffers of KERNEL_CHUNK values, reused by every call from the same thread."""
+    buffers = _scratch.__dict__.setdefault(np.dtype(dtype).char, [])
+    if buffers and len(buffers[0]) != KERNEL_CHUNK:
+        buffers.clear()  # KERNEL_CHUNK was changed
+    while len(buffers) < count:
+        buffers.append(np.empty(KERNEL_CHUNK, dtype=dtype))
+    return buffers[:count]
+
+def compile_kernel(python_str, param_var='x'):
+    """Returns the cached ExpressionKernel of a Python expression in param_var as
+    latex_to_python writes them, evaluated with lib=np. Returns None for what it cannot
+    compile (constants, and anything but numbers, arithmetic and calls of NumPy ufuncs),
+    which is evaluated with eval() instead."""
+    return kernel_cache.get_or_compute((python_str, param_var),
+                                       lambda: _compile_kernel(python_str, param_var))
+
+class _Unsupported(Exception):
+    pass
+
+def _compile_kernel(python_str, param_var):
+    steps = []
+    free = []  # scratch registers whose values are no longer needed
+    registers = 1
+
+    def emit(ufunc, arguments):
+        nonlocal registers
+        free.extend(a for a in arguments if isinstance(a, int) and a > 0)
+        if free:
+            target = free.pop()  # ufuncs may write over one of their own arguments
+        else:
+            target, registers = registers, registers + 1
+        steps.append((ufunc, arguments, target))
+        return target
+
+    def function(node):
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == "lib":
+            name = node.attr
+        elif isinstance(node, ast.Name) and node.id in ("log", "log10"):
+            name = node.id
+        else:
+            raise _Unsupported(ast.dump(node))
+        ufunc = getattr(np, name, None)
+        if not isinstance(ufunc, np.ufunc) or ufunc.nout != 1:
+            raise _Unsupported(name)
+        return ufunc
+
+    def visit(node):
+        """The register holding the value of node, or (value,) when it is a constant."""
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            return (node.value,)
+        if isinstance(node, ast.Name) and node.id == param_var:
+            return 0
+        if isinstance(node, ast.Name) and node.id in ("E", "pi"):
+            return (E if node.id == "E" else np.pi,)
+        if isinstance(node, ast.Name) and node.id not in EXPRESSION_NAMES:
+            return node.id  # a free parameter, given when the kernel is called
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == "lib" \
+                and isinstance(getattr(np, node.attr, None), float):
+            return (getattr(np, node.attr),)  # lib.e, lib.pi
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+            scalar, ufunc = _BINARY_OPERATORS[type(node.op)]
+            arguments = (visit(node.left), visit(node.right))
+        elif isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPERATORS:
+            scalar, ufunc = _UNARY_OPERATORS[type(node.op)]
+            arguments = (visit(node.operand),)
+        elif isinstance(node, ast.Call) and not node.keywords:
+            scalar = ufunc = function(node.func)
+            if ufunc.nin != len(node.args):
+                raise _Unsupported(ast.dump(node))
+            arguments = tuple(visit(arg) for arg in node.args)
+        else:
+            raise _Unsupported(ast.dump(node))
+        if all(isinstance(a, tuple) for a in arguments):
+            return (scalar(*(a[0] for a in arguments)),)  # computed once, like eval() does
+        return emit(ufunc, arguments)
+
+    try:
+        root = visit(ast.parse(python_str, mode="eval").body)
+    except Exception:
+        return None  # eval() gives the result, or raises the error
+    if isinstance(root, tuple):
+        return None  # constants are broadcast by the callers
+    if root == 0 or isinstance(root, str):
+        steps.append((np.positive, (root,), None))  # just the variable (a copy) or a parameter
+    else:
+        ufunc, arguments, _ = steps[-1]
+        steps[-1] = (ufunc, arguments, None)  # the last step writes the result
+    return ExpressionKernel(steps, registers)
+
+def evaluate_expression(user_func, values, lib=np, param_var='x', parameters=None):
+    """Evaluates the Python source of a function at values (an array, or symbols), like
+    eval() with lib, log, log10, E and pi defined, and the free parameters of the
+    expression taken from the dict parameters. float64 arrays evaluated with NumPy go
+    through the compiled kernel of the expression when it has one."""
+    if lib is np and isinstance(values, np.ndarray) and values.dtype == np.float64:
+        kernel = compile_kernel(user_func, param_var)
+        if kernel is not None:
+            return kernel(values, parameters)
+    return eval(compile_source(user_func), {**(parameters or {}), param_var: values, "lib": lib,
+                                            "log": lib.log, "log10": lib.log10, "E": E, "pi": lib.pi})
+
+parameter_cache = LRUCache(maxsize=512)  # (python source, variables) -> names of the free parameters
+
+def free_parameters(python_str, variables=('x',)):
+    """Returns the sorted names of the free parameters of a Python expression in the given
+    variables, e.g. ('a', 'b') for a*lib.sin(b*x): the names that are neither variables nor
+    in EXPRESSION_NAMES, and are not called or looked up as lib is."""
+    return parameter_cache.get_or_compute((python_str, tuple(variables)),
+                                          lambda: _free_parameters(python_str, variables))
+
+def _free_parameters(python_str, variables):
+    try:
+        tree = ast.parse(python_str, mode="eval")
+    except SyntaxError:
+        return ()
+    not_values = {id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call)} | \
+                 {id(node.value) for node in ast.walk(tree) if isinstance(node, ast.Attribute)}
+    names = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and id(node) not in not_values}
+    return tuple(sorted(names - set(variables) - EXPRESSION_NAMES))
+
+def bind_parameters(python_str, parameters):
+    """Returns the Python source of an expression with its free parameters replaced by their
+    values from the dict parameters, e.g. 2.0 * lib.sin(0.5 * x) for a*lib.sin(b*x)."""
+    class Bind(ast.NodeTransformer):
+        def visit_Name(self, node):
+            if node.id not in parameters:
+                return node
+            value = float(parameters[node.id])
+            constant = ast.Constant(abs(value))
+            return ast.UnaryOp(ast.USub(), constant) if np.signbit(value) else constant
+
+    return ast.unparse(Bind().visit(ast.parse(python_str, mode="eval")))
+
+def _nan_jumps(y, threshold):
+    """Sets y to nan on both sides of every step between neighbours larger than threshold,
+    in place. Same as y[1:][dy > threshold] = y[:-1][dy > threshold] = nan with
+    dy = abs(diff(y)), without the temporaries."""
+    jumps = np.empty(max(y.size - 1, 0), dtype=bool)
+    step = _scratch_buffers(1)[0]
+    for start in range(0, jumps.size, KERNEL_CHUNK):
+        stop = min(start + KERNEL_CHUNK, jumps.size)
+        dy = step[:stop - start]
+        np.subtract(y[start + 1:stop + 1], y[start:stop], out=dy)
+        np.absolute(dy, out=dy)
+        np.greater(dy, threshold, out=jumps[start:stop])
+    np.copyto(y[1:], np.nan, where=jumps)
+    np.copyto(y[:-1], np.nan, where=jumps)
+
+def _nan_outside(y, ylower, yupper, x=None, xlower=None, xupper=None):
+    """Sets y to nan where it is outside [ylower, yupper] (or x is outside [xlower, xupper]),
+    in place, a chunk at a time."""
+    outside, more = _scratch_buffers(2, bool)
+    for start in range(0, y.size, KERNEL_CHUNK):
+        stop = min(start + KERNEL_CHUNK, y.size)
+        mask, other = outside[:stop - start], more[:stop - start]
+        np.less(y[start:stop], ylower, out=mask)
+        np.logical_or(mask, np.greater(y[start:stop], yupper, out=other), out=mask)
+        if x is not None:
+            np.logical_or(mask, np.less(x[start:stop], xlower, out=other), out=mask)
+            np.logical_or(mask, np.greater(x[start:stop], xupper, out=other), out=mask)
+        np.copyto(y[start:stop], np.nan, where=mask)
+
 def eval_function(user_func, x, lib, ylower=None, yupper=None, xlower=None, xupper=None, param_var='x'):
     """Evaluates the user-defined function with the given library (np or sp).
+    For explicit functions, y is set to nan on both sides of every pole.
     For implicit functions, x should be a tuple of (x_sym, y_sym).
     For parametric functions, param_var should be 't'."""
     if isinstance(x, tuple):  # Handle implicit function case
         x_vals, y_vals = x[0], x[1]
-        result = eval(user_func, {"x": x_vals, "y": y_vals, "lib": lib})
+        result = eval(compile_source(user_func), {"x": x_vals, "y": y_vals, "lib": lib})
         # Filter points outside plot boundaries for implicit functions
         if ylower is not None and yupper is not None and xlower is not None and xupper is not None:
             result[(y_vals < ylower) | (y_vals > yupper) | (x_vals < xlower) | (x_vals > xupper)] = np.nan
         return result
     else:  # Handle explicit and parametric function cases
-        eval_dict = {
-            param_var: x, 
-            "lib": lib,
-            "log": lib.log,
-            "log10": lib.log10,
-            "E": E
-        }
-        y = eval(user_func, eval_dict)
+        y = evaluate_expression(user_func, x, lib, param_var)
         
         if isinstance(x, np.ndarray):
-            if param_var == 'x':  # For explicit functions
-                # Detect rapid changes
-                threshold_change = 10000
-                dy = lib.abs(lib.diff(y))
-                y[1:][dy > threshold_change] = lib.nan    # Handles asymptotes
-                y[:-1][dy > threshold_change] = lib.nan
+            if np.ndim(y) == 0:  # constant functions
+                y = np.full_like(x, y, dtype=float)
+            if param_var == 'x':  # For explicit functions (x increasing)
+                poles = singular_points(user_func, x[0], x[-1]) if len(x) else None
+                if poles is not None:
+                    # Break the curve on both sides of each pole
+                    near = np.searchsorted(x, poles)
+                    y[np.clip(np.concatenate([near - 1, near]), 0, len(x) - 1)] = np.nan
+                else:
+                    # SymPy could not find the poles: detect rapid changes
+                    threshold_change = 10000
+                    _nan_jumps(y, threshold_change)  # Handles asymptotes
                 
                 # Apply y-range filtering
                 if ylower is not None and yupper is not None:
-                    y[(y < ylower) | (y > yupper)] = np.nan
+                    _nan_outside(y, ylower, yupper)
             else:  # For parametric functions
                 # Detect rapid changes in both x and y for parametric curves
                 threshold_change = 10000
                 if isinstance(y, np.ndarray):  # y coordinate
-                    dy = lib.abs(lib.diff(y))
-                    y[1:][dy > threshold_change] = lib.nan
-                    y[:-1][dy > threshold_change] = lib.nan
+                    _nan_jumps(y, threshold_change)
                     
                 # Filter points outside plot boundaries
                 if ylower is not None and yupper is not None and xlower is not None and xupper is not None:
-                    y[(y < ylower) | (y > yupper) | (x < xlower) | (x > xupper)] = lib.nan
-            
+                    _nan_outside(y, ylower, yupper, x, xlower, xupper)
+
         return y
 
+# Poles and other singular points of each function, found once per expression with SymPy
+singularity_cache = LRUCache(maxsize=256)  # (python source, variable) -> Singularities, or None
+
+# Singular points as plain numbers: isolated points, and (step, offset) pairs for the
+# progressions n*step + offset over all integers n, e.g. (pi, pi/2) for tan(x)
+Singularities = namedtuple("Singularities", ["points", "progressions"])
+
+MAX_SINGULAR_POINTS = 1000  # more than this in the viewport and the sampler is on its own
+
+class _SympyLib:
+    """Stands in for lib (and the names latex_to_python leaves bare) when the Python source of
+    a function is evaluated on SymPy symbols."""
+
+    def __init__(self):
+        import sympy
+        self.sympy = sympy
+        self.e = sympy.E
+        self.pi = sympy.pi
+
+    def log10(self, value):
+        return self.sympy.log(value, 10)
+
+    def __getattr__(self, name):
+        return getattr(self.sympy, name)
+
+@timed()
+def singular_points(user_func, lower, upper, param_var='x'):
+    """Returns the sorted values in [lower, upper] where user_func has a pole or another
+    singularity, e.g. the odd multiples of pi/2 for tan(x), or None if SymPy cannot find them."""
+    singular = singularity_cache.get_or_compute((user_func, param_var),
+                                                lambda: _singularities(user_func, param_var))
+    if singular is None:
+        return None
+    points = [singular.points[(singular.points >= lower) & (singular.points <= upper)]]
+    for step, offset in singular.progressions:
+        first, last = np.ceil((lower - offset) / step), np.floor((upper - offset) / step)
+        if last - first > MAX_SINGULAR_POINTS:
+            return None
+        points.append(offset + step * np.arange(first, last + 1))
+    points = np.unique(np.concatenate(points))
+    return points if len(points) <= MAX_SINGULAR_POINTS else None
+
+def _singularities(user_func, param_var):
+    import sympy as sp
+    from sympy.calculus.singularities import singularities
+
+    symbol = sp.Symbol(param_var)
+    lib = _SympyLib()
+    try:
+        expr = eval(compile_source(user_func), {param_var: symbol, "lib": lib, "log": sp.log,
+                                                "log10": lib.log10, "E": sp.E, "pi": sp.pi})
+        points, progressions = _split_singularities(singularities(sp.sympify(expr), symbol,
+                                                                  domain=sp.S.Reals))
+        return Singularities(np.array(sorted(points), dtype=float), progressions)
+    except Exception:
+        return None  # anything SymPy cannot handle is sampled without the split
+
+def _split_singularities(singular):
+    """Splits a SymPy set of singularities into (real points, [(step, offset), ...]).
+    Raises ValueError for sets that are not finite sets, or unions of those and of
+    arithmetic progressions over the integers."""
+    import sympy as sp
+
+    if singular is sp.S.EmptySet:
+        return [], []
+    if isinstance(singular, sp.Union):
+        points, progressions = [], []
+        for part in singular.args:
+            more_points, more_progressions = _split_singularities(part)
+            points += more_points
+            progressions += more_progressions
+        return points, progressions
+    if isinstance(singular, sp.FiniteSet):
+        return [float(p) for p in singular if p.is_real], []
+    if isinstance(singular, sp.ImageSet) and singular.base_sets == (sp.S.Integers,):
+        n = singular.lamda.variables[0]
+        step, offset = sp.diff(singular.lamda.expr, n), singular.lamda.expr.subs(n, 0)
+        if step.has(n) or not offset.is_real:
+            raise ValueError(f"unsupported set of singularities {singular}")
+        if step == 0 or not step.is_real:
+            return [float(offset)], []  # only n = 0 gives a real point
+        return [], [(abs(float(step)), float(offset))]
+    raise ValueError(f"unsupported set of singularities {singular}")
+
+def _eval_raw(user_func, t, lib=np, param_var='x', parameters=None):
+    """Evaluates user_func at every value of t, without any asymptote or range filtering.
+    Always returns a float array shaped like t (constant functions are broadcast)."""
+    with np.errstate(all='ignore'):  # log/sqrt of negatives and division by zero just give nan/inf
+        values = evaluate_expression(user_func, t, lib, param_var, parameters)
+    if isinstance(values, np.ndarray) and values.dtype == np.float64 and values.shape == np.shape(t) \
+            and values is not t and values.base is None:
+        return values  # a new array already, e.g. from the kernel
+    return np.array(np.broadcast_to(np.asarray(values, dtype=float), np.shape(t)))
+
+SEED_PIXELS = 4  # spacing of the first samples of a curve, in pixels of the window (see _refine_curve)
+
+def _refine_curve(evaluate, lower, upper, view_size, tolerance, initial_points, max_depth, breaks=(),
+                  screen_length=None):
+    """Adaptively refines a curve t -> (px, py) given in pixel coordinates.
+
+    [lower, upper] spans screen_length pixels (the width of the window by default): a step
+    of t of (upper - lower) / screen_length is "a pixel" of t. Starts from initial_points
+    evenly spaced values of t (by default one every SEED_PIXELS pixels), plus the given
+    breaks (poles), which are always treated as invisible so the curve is never joined
+    across them, and bisects an interval only when
+    - its midpoint is more than `tolerance` pixels away from the chord (curvature / pixel error),
+    - the slope changes sign inside it while the chord is longer than a pixel (turning points),
+    - its ends and midpoint are not all visible (asymptotes, domain edges, leaving the view),
+      until the visible part of the chord is shorter than `tolerance`, or
+    - none of them is visible, until it is a pixel of t wide: a fast oscillation can leave
+      the view at all three and still come back into it in between.
+    Returns (t, px, py, visible) sorted by t."""
+    width, height = view_size
+    pixel = (upper - lower) / (screen_length or width)
+    if initial_points is None:
+        initial_points = max(int((upper - lower) / (pixel * SEED_PIXELS)), 128) + 1
+    t = np.union1d(np.linspace(lower, upper, initial_points), breaks)
+    px, py = evaluate(t)
+
+    eps = 1e-9 * (width + height)  # so rounding at the window edges does not hide the end points
+
+    def is_visible(px, py):
+        with np.errstate(invalid='ignore'):
+            return (px >= -eps) & (px <= width + eps) & (py >= -eps) & (py <= height + eps)
+
+    visible = is_visible(px, py) & ~np.isin(t, breaks)
+    active = np.arange(len(t) - 1)  # intervals whose midpoint still needs checking
+
+    for _ in range(max_depth):
+        if len(active) == 0:
+            break
+        tm = (t[active] + t[active + 1]) / 2
+        pxm, pym = evaluate(tm)
+        vm = is_visible(pxm, pym)
+        x0, x1, y0, y1 = px[active], px[active + 1], py[active], py[active + 1]
+        v0, v1 = visible[active], visible[active + 1]
+
+        with np.errstate(invalid='ignore'):
+            # Distance of the midpoint from the middle of the chord
+            deviation = np.hypot(pxm - (x0 + x1) / 2, pym - (y0 + y1) / 2)
+            chord = np.hypot(x1 - x0, y1 - y0)
+            turning = ((pym - y0) * (y1 - pym) < 0) & (chord > 1)
+            clipped = _clipped_length(x0, y0, x1, y1, width, height)
+        all_visible = v0 & v1 & vm
+        # Partly visible, or finite at both ends and possibly crossing the view in between
+        partial = ~all_visible & (v0 | v1 | vm | (np.isfinite(chord)))
+        hidden = ~(v0 | v1 | vm) & (t[active + 1] - t[active] > pixel)
+        bad = (all_visible & ((deviation > tolerance) | turning)) | (partial & ~(clipped <= tolerance)) | hidden
+
+        # Keep the midpoints of bad intervals and check both halves on the next pass
+        keep = active[bad]
+        t = np.insert(t, keep + 1, tm[bad])
+        px = np.insert(px, keep + 1, pxm[bad])
+        py = np.insert(py, keep + 1, pym[bad])
+        visible = np.insert(visible, keep + 1, vm[bad])
+        inserted = keep + 1 + np.arange(len(keep))  # positions of the new points
+        active = np.column_stack([inserted - 1, inserted]).ravel()
+
+    return t, px, py, visible
+
+def _clipped_length(x0, y0, x1, y1, width, height):
+    """Length of the part of each segment (x0, y0)-(x1, y1) inside the box [0, width] x [0, height]
+    (Liang-Barsky clipping). nan where an end is not finite."""
+    dx, dy = x1 - x0, y1 - y0
+    t_in = np.zeros_like(dx)
+    t_out = np.ones_like(dx)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for p, q in ((-dx, x0), (dx, width - x0), (-dy, y0), (dy, height - y0)):
+            r = q / p
+            t_in = np.where(p < 0, np.maximum(t_in, r), t_in)
+            t_out = np.where(p > 0, np.minimum(t_out, r), t_out)
+            t_out = np.where((p == 0) & (q < 0), 0, t_out)  # parallel to and outside this edge
+        return np.maximum(t_out - t_in, 0) * np.hypot(dx, dy)
+
+def _compact_breaks(*arrays):
+    """Collapses runs of consecutive nan points (in the last array) into a single nan break."""
+    nan = np.isnan(arrays[-1])
+    keep = ~nan
+    keep[1:] |= nan[1:] & ~nan[:-1]  # first nan of each run
+    return tuple(a[keep] for a in arrays)
+
+def adaptive_sample(user_func, xlower, xupper, ylower, yupper, pixel_size=(1000, 800),
+                    tolerance=0.25, initial_points=None, max_depth=12, parameters=None):
+    """Samples an explicit function y = f(x) over [xlower, xupper] adaptively.
+    pixel_size is the (width, height) in pixels of the plotting window and tolerance is the
+    largest allowed distance, in those pixels, between the drawn polyline and the curve.
+    initial_points defaults to one every SEED_PIXELS pixel columns.
+    parameters gives the values of the free parameters of the function, if it has any.
+    Returns (x, y) with y set to nan outside [ylower, yupper] and across asymptotes,
+    like eval_function."""
+    sx = pixel_size[0] / (xupper - xlower)
+    sy = pixel_size[1] / (yupper - ylower)
+
+    def evaluate(x):
+        return (x - xlower) * sx, (_eval_raw(user_func, x, parameters=parameters) - ylower) * sy
+
+    x, _, py, visible = _refine_curve(evaluate, xlower, xupper, pixel_size, tolerance, initial_points,
+                                      max_depth, _breaks(user_func, xlower, xupper))
+    y = py / sy + ylower
+    y[~visible] = np.nan
+    return _compact_breaks(x, y)
+
+def adaptive_sample_parametric(x_func, y_func, t_start, t_end, xlower, xupper, ylower, yupper,
+                               pixel_size=(1000, 800), tolerance=0.25, initial_points=None, max_depth=12,
+                               parameters=None):
+    """Samples a parametric curve (x(t), y(t)) for t in [t_start, t_end] adaptively.
+    Same pixel tolerance and parameters as adaptive_sample; the t range counts as long as
+    the perimeter of the window for the initial points. Returns (x, y) with both set
+    to nan where the curve leaves the plotting window."""
+    sx = pixel_size[0] / (xupper - xlower)
+    sy = pixel_size[1] / (yupper - ylower)
+
+    def evaluate(t):
+        return ((_eval_raw(x_func, t, param_var='t', parameters=parameters) - xlower) * sx,
+                (_eval_raw(y_func, t, param_var='t', parameters=parameters) - ylower) * sy)
+
+    _, px, py, visible = _refine_curve(evaluate, t_start, t_end, pixel_size, tolerance, initial_points,
+                                       max_depth, _breaks((x_func, y_func), t_start, t_end, 't'),
+                                       screen_length=2 * (pixel_size[0] + pixel_size[1]))
+    x = px / sx + xlower
+    y = py / sy + ylower
+    x[~visible] = np.nan
+    y[~visible] = np.nan
+    return _compact_breaks(x, y)
+
+def _breaks(user_funcs, lower, upper, param_var='x'):
+    """The singular points of one or more functions in [lower, upper], where the sampler
+    breaks the curve. Empty when SymPy could not find them, and for functions with free
+    parameters, whose poles move with the parameters; the sampler then relies on the curve
+    leaving the window near a pole."""
+    if isinstance(user_funcs, str):
+        user_funcs = (user_funcs,)
+    points = [singular_points(f, lower, upper, param_var) for f in user_funcs
+              if not free_parameters(f, (param_var,))]
+    return np.unique(np.concatenate([p for p in points if p is not None] or [[]]))
+
+def decimate_minmax(x, y, xlower, xupper, columns):
+    """Reduces an explicit curve to at most four points per pixel column, its first, last,
+    lowest and highest point there, for an image with the given number of columns across
+    [xlower, xupper]. The polyline through them covers the same pixels as the full curve.
+    x must be increasing; nan breaks in y are kept."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if len(x) <= 4 * columns:
+        return x, y
+    column = np.floor((x - xlower) * (columns / (xupper - xlower)))
+    nan = np.isnan(y)
+    # Runs of points in the same column; every nan is a run of its own so breaks survive
+    new_run = np.ones(len(x), dtype=bool)
+    new_run[1:] = (column[1:] != column[:-1]) | nan[1:] | nan[:-1]
+    run = np.cumsum(new_run) - 1
+    starts = np.flatnonzero(new_run)
+    ends = np.append(starts[1:], len(x)) - 1
+    order = np.lexsort((y, run))  # by run, then by y within a run
+    keep = np.unique(np.concatenate([starts, ends, order[starts], order[ends]]))
+    return x[keep], y[keep]
+
+def snap_polyline(x, y, xlower, xupper, ylower, yupper, width, height):
+    """Maps a polyline from data coordinates to whole units of a width x height grid over the
+    viewport (row 0 at yupper, like an image) and drops the points that add nothing at that
+    resolution: repeats of the previous point and points inside a straight run. Every point
+    moves by at most half a unit in x and y. Returns (px, py) with nan breaks kept, each
+    run of nans collapsed to one."""
+    px = np.round((np.asarray(x, dtype=float) - xlower) * (width / (xupper - xlower)))
+    py = np.round((yupper - np.asarray(y, dtype=float)) * (height / (yupper - ylower)))
+    nan = ~(np.isfinite(px) & np.isfinite(py))
+    px[nan] = py[nan] = np.nan
+    keep = np.ones(len(px), dtype=bool)
+    keep[1:] = ((px[1:] != px[:-1]) | (py[1:] != py[:-1])) & ~(nan[1:] & nan[:-1])
+    px, py = px[keep], py[keep]
+    # Middle points of three on a line, going the same way (nan compares false, so breaks stay)
+    dx0, dy0 = px[1:-1] - px[:-2], py[1:-1] - py[:-2]
+    dx1, dy1 = px[2:] - px[1:-1], py[2:] - py[1:-1]
+    keep = np.ones(len(px), dtype=bool)
+    keep[1:-1] = ~((dx0 * dy1 == dx1 * dy0) & (dx0 * dx1 + dy0 * dy1 > 0))
+    return px[keep], py[keep]
+
+# The cache keys are what each kind of curve depends on: explicit and parametric samples on
+# the viewport and pixel size (and the domain for parametric ones), nothing else in the sidebar
+sample_cache = LRUCache(maxsize=4096, maxbytes=64 * MB)  # (expression, domain, viewport, pixel size) -> (x, y)
+
+# Latest samples of an explicit function for one y range and image height, so panning or
+# zooming out along x only has to sample the newly exposed x intervals
+SampledExtent = namedtuple("SampledExtent", ["x", "y", "scale"])
+extent_cache = LRUCache(maxsize=1024, maxbytes=32 * MB)  # (expression, ylower, yupper, height) -> SampledExtent
+
+@timed()
+def sampled_function(user_func, xlower, xupper, ylower, yupper, pixel_size=(1000, 800)):
+    """adaptive_sample through the shared sample_cache, so session state only needs to keep
+    the expression. The returned arrays are shared between sessions and are read-only."""
+    key = ("explicit", user_func, float(xlower), float(xupper), float(ylower), float(yupper),
+           tuple(pixel_size))
+    return sample_cache.get_or_compute(
+        key, lambda: _read_only(_sample_function(user_func, xlower, xupper, ylower, yupper, pixel_size)))
+
+def _sample_function(user_func, xlower, xupper, ylower, yupper, pixel_size):
+    """Samples user_func for a new viewport. When the function was last sampled with the same
+    y range and at least this finely in x, the samples still inside the new x range are kept
+    and only the newly exposed intervals on either side are sampled."""
+    extent_key = (user_func, float(ylower), float(yupper), pixel_size[1])
+    scale = pixel_size[0] / (xupper - xlower)  # pixels per unit of x
+    last = extent_cache.get(extent_key)
+    if last is None or last.scale < scale or not (last.x[0] < xupper and xlower < last.x[-1]):
+        x, y = adaptive_sample(user_func, xlower, xupper, ylower, yupper, pixel_size)
+    else:
+        # Old samples inside the window, plus one on either side so the line reaches its edges
+        start = max(np.searchsorted(last.x, xlower, side='right') - 1, 0)
+        stop = np.searchsorted(last.x, xupper, side='left') + 1
+        xs, ys = [last.x[start:stop]], [last.y[start:stop]]
+        if xlower < last.x[0]:
+            width = (last.x[0] - xlower) * scale
+            x, y = adaptive_sample(user_func, xlower, last.x[0], ylower, yupper, (width, pixel_size[1]))
+            xs.insert(0, x[:-1])  # its last point is last.x[0]
+            ys.insert(0, y[:-1])
+        if last.x[-1] < xupper:
+            width = (xupper - last.x[-1]) * scale
+            x, y = adaptive_sample(user_func, last.x[-1], xupper, ylower, yupper, (width, pixel_size[1]))
+            xs.append(x[1:])
+            ys.append(y[1:])
+        x, y = _compact_breaks(np.concatenate(xs), np.concatenate(ys))
+        # New sides are only as fine as this view, which is then the coarsest in the extent;
+        # without them, the kept samples are as fine as they were
+        if len(xs) == 1:
+            scale = last.scale
+    extent_cache.put(extent_key, SampledExtent(x, y, scale))
+    return x, y
+
+@timed()
+def sampled_parametric(x_func, y_func, t_start, t_end, xlower, xupper, ylower, yupper,
+                       pixel_size=(1000, 800)):
+    """adaptive_sample_parametric through the shared sample_cache, like sampled_function."""
+    key = ("parametric", x_func, y_func, float(t_start), float(t_end),
+           float(xlower), float(xupper), float(ylower), float(yupper), tuple(pixel_size))
+    return sample_cache.get_or_compute(
+        key, lambda: _read_only(adaptive_sample_parametric(x_func, y_func, t_start, t_end,
+                                                           xlower, xupper, ylower, yupper, pixel_size)))
+
+def _read_only(arrays):
+    for a in arrays:
+        a.setflags(write=False)
+    return arrays
+
+def trace_implicit_curve(func, xlower, xupper, ylower, yupper, base_cells=64, max_depth=5):
+    """Traces the curve func(x, y) = 0 over the viewport with an adaptive quadtree.
+
+    The viewport starts as base_cells x base_cells cells. A cell is split in four only while
+    f changes sign at its corners or centre, or while |f| at the centre is small compared to
+    how much f changes across the cell (a crossing may hide inside), down to max_depth levels.
+    Crossings are located on the edges of the finest cells by linear interpolation (marching
+    squares) and joined into polylines.
+    func must accept NumPy arrays. Returns a list of (N, 2) arrays that ax.plot or a
+    LineCollection can draw; closed loops repeat their first point."""
+    unit = 2 ** (max_depth + 1)  # lattice units per base cell, so the finest cells have lattice centres
+    n = base_cells * unit
+    dx = (xupper - xlower) / n
+    dy = (yupper - ylower) / n
+
+    def evaluate(i, j):
+        # Each lattice point is evaluated once per call and always at the same coordinates,
+        # so neighbouring cells see bitwise identical values on their shared corners
+        keys, inverse = np.unique(i * (n + 1) + j, return_inverse=True)
+        with np.errstate(all='ignore'):
+            values = func(xlower + (keys // (n + 1)) * dx, ylower + (keys % (n + 1)) * dy)
+        return np.broadcast_to(np.asarray(values, dtype=float), keys.shape)[inverse.ravel()]
+
+    i, j = np.meshgrid(np.arange(base_cells) * unit, np.arange(base_cells) * unit, indexing='ij')
+    i, j = i.ravel(), j.ravel()
+    size = unit
+    # Rows: f at the (0, 0), (1, 0), (0, 1) and (1, 1) corners and at the centre of each cell
+    values = evaluate(np.concatenate([i, i + size, i, i + size, i + size // 2]),
+                      np.concatenate([j, j, j + size, j + size, j + size // 2])).reshape(5, -1)
+
+    for _ in range(max_depth):
+        f00, f10, f01, f11, fc = values
+        sign_change = (values > 0).any(axis=0) & (values <= 0).any(axis=0)
+        gx = (f10 - f00 + f11 - f01) / 2
+        gy = (f01 - f00 + f11 - f10) / 2
+        with np.errstate(invalid='ignore'):
+            near = np.abs(fc) < np.hypot(gx, gy) + np.abs((f00 + f10 + f01 + f11) / 4 - fc)
+        split = sign_change | near
+
+        i, j, values = i[split], j[split], values[:, split]
+        p00, p10, p01, p11, pc = values
+        h, q = size // 2, size // 4
+        # Edge midpoints (bottom, left, top, right) and the centres of the four children
+        mb, ml, mt, mr, c00, c10, c01, c11 = evaluate(
+            np.concatenate([i + h, i, i + h, i + size, i + q, i + h + q, i + q, i + h + q]),
+            np.concatenate([j, j + h, j + size, j + h, j + q, j + q, j + h + q, j + h + q])).reshape(8, -1)
+        values = np.stack([
+            np.concatenate([p00, mb, ml, pc]),
+            np.concatenate([mb, p10, pc, mr]),
+            np.concatenate([ml, pc, p01, mt]),
+            np.concatenate([pc, mr, mt, p11]),
+            np.concatenate([c00, c10, c01, c11])])
+        i = np.concatenate([i, i + h, i, i + h])
+        j = np.concatenate([j, j, j + h, j + h])
+        size = h
+
+    # Marching squares on the finest cells whose four corners are finite and change sign
+    corners = values[:4]
+    leaf = np.isfinite(corners).all(axis=0) & (corners > 0).any(axis=0) & (corners <= 0).any(axis=0)
+    f00, f10, f01, f11, fc = values[:, leaf]
+    i, j = i[leaf], j[leaf]
+    s00, s10, s01, s11 = f00 > 0, f10 > 0, f01 > 0, f11 > 0
+
+    x0, x1 = xlower + i * dx, xlower + (i + size) * dx
+    y0, y1 = ylower + j * dy, ylower + (j + size) * dy
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Crossing on each edge (bottom, right, top, left), always interpolated from the
+        # lower/left end so a shared edge gives the same point in both cells
+        px = np.stack([x0 + f00 / (f00 - f10) * (x1 - x0), x1,
+                       x0 + f01 / (f01 - f11) * (x1 - x0), x0], axis=1)
+        py = np.stack([y0, y0 + f10 / (f10 - f11) * (y1 - y0),
+                       y1, y0 + f00 / (f00 - f01) * (y1 - y0)], axis=1)
+    # Edge ids: horizontal edges are even, vertical edges odd
+    edge_keys = np.stack([(i * (n + 1) + j) * 2, ((i + size) * (n + 1) + j) * 2 + 1,
+                          (i * (n + 1) + j + size) * 2, (i * (n + 1) + j) * 2 + 1], axis=1)
+    crossed = np.stack([s00 != s10, s10 != s11, s01 != s11, s00 != s01], axis=1)
+
+    # Two crossings: one segment between them. Four (a saddle): the centre decides which
+    # pairs of corners are connected
+    cells = np.arange(len(i))
+    two = crossed.sum(axis=1) == 2
+    pairs = [np.nonzero(crossed[two])[1].reshape(-1, 2), None]
+    saddle = ~two
+    joined = (fc[saddle] > 0) == s00[saddle]
+    pairs[1] = np.where(joined[:, None, None], [[0, 1], [2, 3]], [[0, 3], [1, 2]]).reshape(-1, 2)
+    seg_cells = np.concatenate([cells[two], np.repeat(cells[saddle], 2)])
+    seg_edges = np.concatenate(pairs)
+    a = edge_keys[seg_cells, seg_edges[:, 0]]
+    b = edge_keys[seg_cells, seg_edges[:, 1]]
+    points = dict(zip(edge_keys[crossed].tolist(), zip(px[crossed].tolist(), py[crossed].tolist())))
+
+    # Join the segments into polylines; every crossing belongs to at most two segments
+    neighbours = {}
+    for key_a, key_b in zip(a.tolist(), b.tolist()):
+        neighbours.setdefault(key_a, []).append(key_b)
+        neighbours.setdefault(key_b, []).append(key_a)
+    visited = set()
+    lines = []
+    ends = [key for key, linked in neighbours.items() if len(linked) == 1]
+    for start in ends + list(neighbours):  # open curves first, then closed loops
+        if start in visited:
+            continue
+        chain = [start]
+        visited.add(start)
+        current = start
+        while True:
+            following = [key for key in neighbours[current] if key not in visited]
+            if not following:
+                if len(chain) > 2 and start in neighbours[current]:
+                    chain.append(start)  # close the loop
+                break
+            current = following[0]
+            visited.add(current)
+            chain.append(current)
+        lines.append(np.array([points[key] for key in chain]))
+    return lines
+
+# Zero-level curve of an implicit function f(x, y) on one viewport: the lambdified f,
+# the traced curve as a list of (N, 2) arrays and how many times f was evaluated
+ImplicitContour = namedtuple("ImplicitContour", ["func", "segments", "evaluations"])
+
+contour_cache = LRUCache(maxsize=512, maxbytes=64 * MB)  # (function, viewport, ..., parameter values) -> ImplicitContour
+implicit_function_cache = LRUCache(maxsize=64)  # python source -> (NumPy function, parameter names)
+
+def implicit_function(user_func):
+    """Returns (func, names): user_func lambdified by SymPy to a NumPy function
+    func(x, y, *values) of x, y and the values of its free parameters, called names."""
+    return implicit_function_cache.get_or_compute(user_func, lambda: _implicit_function(user_func))
+
+def _implicit_function(user_func):
+    import sympy as sp
+
+    names = free_parameters(user_func, ('x', 'y'))
+    symbols = sp.symbols(('x', 'y') + names)
+    namespace = dict(zip(('x', 'y') + names, symbols), lib=sp, E=sp.E, pi=sp.pi)
+    return sp.lambdify(symbols, eval(compile_source(user_func), namespace)), names
+
+def _parameter_values(names, parameters):
+    """The values of the named parameters as a tuple, for cache keys."""
+    return tuple(float(_parameter(parameters, name)) for name in names)
+
+@timed()
+def implicit_contour(user_func, xlower, xupper, ylower, yupper, base_cells=64, max_depth=5, parameters=None):
+    """Returns the cached ImplicitContour of user_func(x, y) = 0 over the given viewport,
+    tracing it with trace_implicit_curve only when the expression, the viewport or the
+    values of its free parameters (from the dict parameters) changed."""
+    values = _parameter_values(free_parameters(user_func, ('x', 'y')), parameters)
+    key = (user_func, float(xlower), float(xupper), float(ylower), float(yupper), base_cells, max_depth, values)
+    return contour_cache.get_or_compute(
+        key, lambda: _implicit_contour(user_func, xlower, xupper, ylower, yupper, base_cells, max_depth, values))
+
+def _implicit_contour(user_func, xlower, xupper, ylower, yupper, base_cells, max_depth, values=()):
+    function, _ = implicit_function(user_func)
+    func = (lambda x, y: function(x, y, *values)) if values else function
+
+    evaluations = 0
+    def counted(x, y):
+        nonlocal evaluations
+        evaluations += np.size(x)
+        return func(x, y)
+
+    segments = trace_implicit_curve(counted, xlower, xupper, ylower, yupper, base_cells, max_depth)
+    return ImplicitContour(func, segments, evaluations)
+
+region_cache = LRUCache(maxsize=256, maxbytes=64 * MB)  # (function, relation, viewport, width, height) -> bit-packed mask
+
+REGION_TILE_PIXELS = 1 << 19  # pixels evaluated at once, so print-size masks need little extra memory
+REGION_OPACITY = 0.3
+# Relations of an implicit function's region to zero; "=" draws only the curve
+REGION_RELATIONS = {"<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal}
+
+@timed()
+def inequality_mask(user_func, relation, xlower, xupper, ylower, yupper, width, height, parameters=None):
+    """Returns a (height, width) boolean image of where user_func(x, y) < 0 (relation "<"),
+    <= 0 ("<="), > 0 (">") or >= 0 (">=") at the centres of the pixels of the viewport, row 0
+    at ylower, for the values of its free parameters in the dict parameters.
+    The mask is cached bit-packed and evaluated a few hundred thousand pixels at a time."""
+    values = _parameter_values(free_parameters(user_func, ('x', 'y')), parameters)
+    key = (user_func, relation, float(xlower), float(xupper), float(ylower), float(yupper), width, height, values)
+    packed = region_cache.get_or_compute(
+        key, lambda: np.packbits(_inequality_mask(user_func, relation, xlower, xupper, ylower, yupper,
+                                                  width, height, parameters)))
+    return np.unpackbits(packed, count=width * height).reshape(height, width).view(bool)
+
+def _inequality_mask(user_func, relation, xlower, xupper, ylower, yupper, width, height, parameters=None):
+    # The lambdified function comes with the contour, which is drawn along with the region
+    func = implicit_contour(user_func, xlower, xupper, ylower, yupper, parameters=parameters).func
+    xs = xlower + (np.arange(width) + 0.5) * ((xupper - xlower) / width)
+    ys = ylower + (np.arange(height) + 0.5) * ((yupper - ylower) / height)
+    mask = np.empty((height, width), dtype=bool)
+    rows = max(REGION_TILE_PIXELS // width, 1)
+    for start in range(0, height, rows):
+        x, y = np.meshgrid(xs, ys[start:start + rows])
+        with np.errstate(all='ignore'):
+            values = np.broadcast_to(np.asarray(func(x, y), dtype=float), x.shape)
+            mask[start:start + rows] = REGION_RELATIONS[relation](values, 0)  # nan is in no region
+    return mask
+
+@timed()
+def region_image(regions, xlower, xupper, ylower, yupper, width, height, parameters=None):
+    """Composites the inequality regions of implicit functions (dicts with "function",
+    "relation" and "color"; later ones on top) into one (height, width, 4) RGBA uint8 image,
+    row 0 at ylower. parameters holds the values of their free parameters."""
+    # Every pixel gets a code saying which regions cover it, and the colour for each of the
+    # 2**len(regions) codes is blended once
+    code = np.zeros((height, width), dtype=np.uint8)
+    for bit, region in enumerate(regions):
+        code |= inequality_mask(region["function"], region["relation"], xlower, xupper, ylower, yupper,
+                                width, height, parameters).view(np.uint8) << bit
+    colors = np.zeros((2 ** len(regions), 4))  # premultiplied RGBA
+    for bit, region in enumerate(regions):
+        r, g, b, a = to_rgba(region["color"], REGION_OPACITY)
+        covered = (np.arange(len(colors)) >> bit) & 1 == 1
+        colors[covered] = np.array([r * a, g * a, b * a, a]) + colors[covered] * (1 - a)
+    alpha = colors[:, 3:]
+    colors[:, :3] = np.divide(colors[:, :3], alpha, out=np.zeros_like(colors[:, :3]), where=alpha > 0)
+    return np.round(colors * 255).astype(np.uint8)[code]
+
+def prepare_implicit(user_func, relation, xlower, xupper, ylower, yupper, region_size):
+    """Traces the contour of an implicit function and, for a relation other than "=",
+    evaluates its region at region_size = (width, height) pixels, so render_scene finds both
+    in the caches. Returns the ImplicitContour."""
+    contour = implicit_contour(user_func, xlower, xupper, ylower, yupper)
+    if relation != "=":
+        inequality_mask(user_func, relation, xlower, xupper, ylower, yupper, *region_size)
+    return contour
+
+def sample_curve(curve, parameters, xlower, xupper, ylower, yupper, pixel_size):
+    """Evaluates one of the "curves" of a scene (see render_scene) for the given values of its
+    free parameters. Returns (x, y) for explicit and parametric curves and the contour
+    segments for implicit ones, ready for set_curve_data."""
+    if curve["kind"] == "explicit":
+        return adaptive_sample(curve["function"], xlower, xupper, ylower, yupper, pixel_size,
+                               parameters=parameters)
+    if curve["kind"] == "parametric":
+        return adaptive_sample_parametric(*curve["function"], *curve["t_range"], xlower, xupper, ylower, yupper,
+                                          pixel_size, parameters=parameters)
+    return implicit_contour(curve["function"], xlower, xupper, ylower, yupper, parameters=parameters).segments
+
+def curve_artist(ax, curve, linewidth, animated=False):
+    """Adds an empty artist for a curve of a scene to ax: a Line2D, or a LineCollection for
+    implicit curves. Fill it with set_curve_data."""
+    if curve["kind"] == "implicit":
+        return ax.add_collection(LineCollection([], colors=[curve["color"]], linestyles=[curve["line_style"]],
+                                                linewidths=linewidth, zorder=curve["zorder"], animated=animated),
+                                 autolim=False)
+    line, = ax.plot([], [], color=curve["color"], linestyle=curve["line_style"], linewidth=linewidth,
+                    zorder=curve["zorder"], animated=animated)
+    return line
+
+def set_curve_data(artist, data):
+    """Gives an artist from curve_artist the result of sample_curve."""
+    if isinstance(artist, LineCollection):
+        artist.set_segments(data)
+    else:
+        artist.set_data(*data)
+
+EVALUATION_WORKERS = min(8, os.cpu_count() or 1)  # default size of the shared evaluation pool
+
+_evaluation_pools = {}
+_evaluation_pools_lock = threading.Lock()
+
+def evaluation_pool(workers=None):
+    """The process-wide thread pool with the given number of workers (EVALUATION_WORKERS by default)."""
+    workers = workers or EVALUATION_WORKERS
+    with _evaluation_pools_lock:
+        if workers not in _evaluation_pools:
+            _evaluation_pools[workers] = ThreadPoolExecutor(max_workers=workers,
+                                                            thread_name_prefix="graph-eval")
+        return _evaluation_pools[workers]
+
+def evaluate_items(jobs, workers=None):
+    """Runs jobs, a dict mapping an item name to a (function, args) pair, on the evaluation
+    pool and waits for all of them. NumPy releases the GIL in its ufuncs, so the curves of a
+    scene are sampled side by side and the wall time follows the slowest one.
+    Returns (results, seconds), dicts keyed like jobs; seconds is how long each item took
+    (near zero when it came from a cache). The first exception raised by a job is re-raised.
+    workers=1 runs the jobs one after another in this thread."""
+    if workers == 1 or len(jobs) <= 1:
+        done = {name: _timed(name, function, args) for name, (function, args) in jobs.items()}
+    else:
+        pool = evaluation_pool(workers)
+        # in_context: the spans of a job nest under the caller's span
+        futures = {name: pool.submit(in_context(_timed), name, function, args)
+                   for name, (function, args) in jobs.items()}
+        done = {name: future.result() for name, future in futures.items()}
+    return ({name: result for name, (result, _) in done.items()},
+            {name: seconds for name, (_, seconds) in done.items()})
+
+def _timed(name, function, args):
+    with span(name):
+        start = time.perf_counter()
+        result = function(*args)
+        return result, time.perf_counter() - start
+
+@timed()
+def scene_hash(scene):
+    """Returns a stable hex digest of a scene description made of dicts, lists, tuples,
+    strings, numbers and NumPy arrays (arrays are hashed by dtype, shape and contents)."""
+    digest = hashlib.blake2b(digest_size=16)
+
+    def feed(obj):
+        if isinstance(obj, dict):
+            digest.update(b'{')
+            for key in sorted(obj, key=str):
+                feed(key)
+                feed(obj[key])
+            digest.update(b'}')
+        elif isinstance(obj, (list, tuple)):
+            digest.update(b'[')
+            for item in obj:
+                feed(item)
+            digest.update(b']')
+        elif isinstance(obj, np.ndarray):
+            digest.update(f'array{obj.dtype}{obj.shape}'.encode())
+            digest.update(np.ascontiguousarray(obj).tobytes())
+        else:
+            if isinstance(obj, np.generic):
+                obj = obj.item()  # so np.float64(1.0) and 1.0 hash the same
+            digest.update(repr(obj).encode() + b';')
+
+    feed(scene)
+    return digest.hexdigest()
+
+render_cache = LRUCache(maxsize=256, maxbytes=128 * MB)  # (scene hash, format, dpi) -> encoded image
+
+# savefig options for each format render_scene_cached can produce
+IMAGE_FORMATS = {
+    "preview": {"format": "png", "dpi": 200, "bbox_inches": "tight"},  # what st.pyplot uses
+    "png": {"format": "png", "dpi": 300, "bbox_inches": "tight", "pad_inches": 0},
+    "svg": {"format": "svg"},
+    # Smaller SVG for documents: paths simplified to "tolerance" inches, coordinates rounded to
+    # "precision" decimals of a point and repeated styles written once (see encode_scene)
+    "svg-compact": {"format": "svg", "dpi": 300, "tolerance": 1 / 300, "precision": 2, "rasterize_dense": False},
+}
+
+VECTOR_DPI = 300  # resolution explicit curves are decimated to in SVG output, i.e. print
+DENSE_VERTICES = 2000  # lines and collections with more vertices than this are "dense", see rasterize_dense
+
+@timed()
+def render_scene(scene, dpi=None):
+    """Draws a scene description and returns (fig, ax).
+    A scene holds the create_graph arguments under "axes" and lists of "functions",
+    "implicit_functions", "parametric_functions", "points" and "areas", with colours
+    already resolved to matplotlib colours.
+    Functions with free parameters (e.g. a*lib.sin(b*x)) go in "curves" instead, dicts with
+    a "kind" ("explicit", "implicit" or "parametric"), the "function" (an (x, y) pair for
+    parametric ones, which also have a "t_range"), "color", "line_style" and "zorder" (and a
+    "relation" for implicit ones). They are evaluated here for the values in "parameters".
+    With dpi, explicit functions are decimated to the pixel columns of an image at that
+    resolution before they are drawn, and inequality regions (implicit functions with a
+    "relation" other than "=") are evaluated at that resolution."""
+    axes = scene["axes"]
+    xlower, xupper, ylower, yupper = axes["xlower"], axes["xupper"], axes["ylower"], axes["yupper"]
+    linewidth = axes["axis_weight"] * 1.3
+
+    fig, ax = create_graph(**axes)
+    ax.margins(x=0, y=0)  # Remove margins
+    fig.subplots_adjust(left=0, right=1, bottom=0, top=1, wspace=0, hspace=0)  # Remove all padding
+    ax.set_xlim(xlower, xupper)  # Force exact limits
+    ax.set_ylim(ylower, yupper)  # Force exact limits
+
+    for area in scene.get("areas", []):
+        ax.fill_between(area["x"], area["lower"], area["upper"],
+                        color=area["color"],
+                        alpha=area["opacity"],
+                        zorder=5)  # Above the tick labels
+
+    columns = int(axes["imagewidth"] * dpi) if dpi else None
+    for func_data in scene.get("functions", []):
+        x, y = func_data["x"], func_data["y"]
+        if columns:
+            x, y = decimate_minmax(x, y, xlower, xupper, columns)
+        ax.plot(x, y,
+                color=func_data["color"],
+                linestyle=func_data["line_style"],
+                linewidth=linewidth,
+                zorder=func_data["zorder"])
+
+    for point_data in scene.get("points", []):
+        if point_data["marker"] == "x":
+            markersize = axes["axis_weight"] * 6
+        else:  # circle
+            markersize = axes["axis_weight"] * 3
+        ax.plot(point_data["x"], point_data["y"],
+                marker=point_data["marker"],
+                color=point_data["color"],
+                markersize=markersize,
+                markeredgewidth=axes["axis_weight"],
+                linestyle='none',
+                zorder=point_data["zorder"])
+
+    pixels_per_inch = dpi or fig.dpi
+    parameters = scene.get("parameters")
+    curves = scene.get("curves", [])
+    regions = [implicit_data for implicit_data in scene.get("implicit_functions", []) + curves
+               if implicit_data.get("kind", "implicit") == "implicit" and implicit_data.get("relation", "=") != "="]
+    if regions:
+        # All regions, e.g. f < 0, as one image at the output resolution, beneath the curves
+        image = region_image(sorted(regions, key=lambda region: region["zorder"]),
+                             xlower, xupper, ylower, yupper,
+                             int(axes["imagewidth"] * pixels_per_inch), int(axes["imageheight"] * pixels_per_inch),
+                             parameters)
+        ax.imshow(image, extent=(xlower, xupper, ylower, yupper),  # 'none' keeps SVG at full resolution
+                  origin='lower', interpolation='none', aspect='auto', zorder=4)
+
+    for implicit_data in scene.get("implicit_functions", []):
+        # Traced only when the function or the viewport changed
+        contour = implicit_contour(implicit_data["function"], xlower, xupper, ylower, yupper)
+        ax.add_collection(LineCollection(contour.segments,
+                                         colors=[implicit_data["color"]],
+                                         linestyles=[implicit_data["line_style"]],
+                                         linewidths=linewidth,
+                                         zorder=implicit_data["zorder"]),
+                          autolim=False)
+
+    for param_data in scene.get("parametric_functions", []):
+        # NaN values break the line where the curve leaves the window
+        ax.plot(param_data["x"], param_data["y"],
+                color=param_data["color"],
+                linestyle=param_data["line_style"],
+                linewidth=linewidth,
+                zorder=param_data["zorder"])
+
+    curve_size = (axes["imagewidth"] * pixels_per_inch, axes["imageheight"] * pixels_per_inch)
+    for curve in curves:
+        data = sample_curve(curve, parameters, xlower, xupper, ylower, yupper, curve_size)
+        if columns and curve["kind"] == "explicit":
+            data = decimate_minmax(*data, xlower, xupper, columns)
+        set_curve_data(curve_artist(ax, curve, linewidth), data)
+
+    if not axes["white_background"]:
+        ax.set_facecolor('none')  # Transparent background
+        fig.patch.set_facecolor('none')  # Transparent figure background
+
+    return fig, ax
+
+def release_figure(fig):
+    """Frees what a figure from create_graph holds as soon as it is no longer needed.
+    Figures are not kept by pyplot, but their artists reference each other in cycles, so
+    only the garbage collector frees them, and a full collection can be dozens of
+    print-size pixel buffers away. Giving the figure a bare canvas frees the Agg canvas and
+    its pixel buffer right away; clearing it lets most artists go too."""
+    FigureCanvasBase(fig)
+    fig.clear()
+
+def simplify_figure(fig, tolerance):
+    """Simplifies the lines and collections of fig in place, so that no path strays more than
+    tolerance inches from where it was. matplotlib's SVG backend only simplifies long Line2D
+    paths, and writes implicit curves and filled areas with every vertex they were traced with."""
+    for ax in fig.axes:
+        to_display, to_data = ax.transData, ax.transData.inverted()
+
+        def simplify(path):
+            path = Path(path.vertices, path.codes)
+            path.simplify_threshold = tolerance * fig.dpi  # in display units
+            simplified = path.cleaned(to_display, remove_nans=True, simplify=True)
+            keep = simplified.codes != Path.STOP
+            return to_data.transform(simplified.vertices[keep]), simplified.codes[keep]
+
+        for line in ax.lines:
+            if len(line.get_xydata()) < 3:
+                continue  # points and grid lines
+            vertices, codes = simplify(line.get_path())
+            # Each moveto after the first is where the line was broken by a nan
+            vertices = np.insert(vertices, np.flatnonzero(codes == Path.MOVETO)[1:], np.nan, axis=0)
+            line.set_data(vertices[:, 0], vertices[:, 1])
+
+        for collection in ax.collections:
+            if isinstance(collection, LineCollection):
+                segments = []
+                for path in collection.get_paths():
+                    vertices, codes = simplify(path)
+                    segments.extend(np.split(vertices, np.flatnonzero(codes == Path.MOVETO)[1:]))
+                collection.set_segments(segments)
+            elif isinstance(collection, PolyCollection):  # areas
+                collection.set_verts_and_codes(*zip(*map(simplify, collection.get_paths())))
+
+def rasterize_dense(fig, max_vertices=DENSE_VERTICES):
+    """Marks the lines and collections of fig with more than max_vertices vertices as
+    rasterized, so vector output embeds them as an image at the dpi of savefig."""
+    for ax in fig.axes:
+        for artist in [*ax.lines, *ax.collections]:
+            paths = artist.get_paths() if hasattr(artist, "get_paths") else [artist.get_path()]
+            if sum(len(path.vertices) for path in paths) > max_vertices:
+                artist.set_rasterized(True)
+
+_SVG_COMMAND = re.compile(r'([MLQCZz])([^MLQCZz]*)')
+_SVG_NUMBER = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+_SVG_PATH = re.compile(r' d="([^"]*)"')
+_SVG_POSITION = re.compile(r' (x|y|width|height)="([^"]*)"')
+_SVG_TRANSLATE = re.compile(r'translate\(([^)]*)\)')
+_SVG_STYLE = re.compile(r' style="([^"]*)"')
+
+def _svg_number(units, precision):
+    """units / 10**precision as short as SVG allows, e.g. -50 -> -.5 with precision 2."""
+    text = f"{units / 10 ** precision:.{precision}f}"
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    text = text.replace("0.", ".", 1) if text.startswith(("0.", "-0.")) else text
+    return "0" if text in ("", "-0", "-") else text
+
+def _compact_path(d, precision):
+    """A path from matplotlib (absolute M, L, Q, C and z) with relative coordinates rounded to
+    precision decimals, segments that round to nothing dropped and repeated commands omitted."""
+    scale = 10 ** precision
+    parts = []
+    previous = None
+    x = y = start_x = start_y = 0
+    for command, numbers in _SVG_COMMAND.findall(d):
+        if command in "Zz":
+            parts.append("z")
+            previous, x, y = "z", start_x, start_y
+            continue
+        points = np.rint(np.array(_SVG_NUMBER.findall(numbers), dtype=float) * scale).astype(np.int64).tolist()
+        if command == "M":
+            steps, command = points, "M"
+            start_x, start_y = points[-2], points[-1]
+        else:
+            # Rounded first and differenced after, so the errors do not add up along the path
+            steps = [value - (y if i % 2 else x) for i, value in enumerate(points)]
+            if command == "L" and steps == [0, 0]:
+                continue
+            command = command.lower()
+        x, y = points[-2], points[-1]
+        text = "".join(number if number.startswith("-") else " " + number
+                       for number in (_svg_number(step, precision) for step in steps))
+        parts.append(text if command == previous != "M" else command + text.lstrip())
+        previous = command
+    return "".join(parts)
+
+def compact_svg(svg, precision=2):
+    """Shrinks an SVG written by matplotlib: coordinates rounded to precision decimals (of a
+    point), paths with relative coordinates, styles used more than once written once as
+    classes and the whitespace and comments between elements dropped."""
+    svg = _SVG_PATH.sub(lambda match: f' d="{_compact_path(match[1], precision)}"', svg)
+
+    def round_numbers(text):
+        return _SVG_NUMBER.sub(lambda match: _svg_number(round(float(match[0]) * 10 ** precision), precision), text)
+
+    svg = _SVG_POSITION.sub(lambda match: f' {match[1]}="{round_numbers(match[2])}"', svg)
+    svg = _SVG_TRANSLATE.sub(lambda match: f'translate({round_numbers(match[1])})', svg)
+
+    if "</style>" in svg:
+        shared = [style for style, count in Counter(_SVG_STYLE.findall(svg)).items() if count > 1]
+        classes = {style: f"s{i}" for i, style in enumerate(shared)}
+        svg = _SVG_STYLE.sub(lambda match: f' class="{classes[match[1]]}"' if match[1] in classes else match[0], svg)
+        css = "".join(f".{name}{{{style.replace(': ', ':').replace('; ', ';')}}}" for style, name in classes.items())
+        svg = svg.replace("</style>", css + "</style>", 1)
+
+    svg = re.sub(r'<!--.*?-->', '', svg, flags=re.DOTALL)
+    return re.sub(r'>\s+<', '><', svg)
+
+@timed()
+def encode_scene(scene, fmt="png", dpi=None, **overrides):
+    """Renders scene and returns it encoded in one of IMAGE_FORMATS (str for svg, bytes otherwise).
+    overrides replace options of the format, e.g. rasterize_dense=True for "svg-compact"
+    embeds dense layers (see rasterize_dense) as images."""
+    options = dict(IMAGE_FORMATS[fmt], **overrides)
+    if dpi is not None:
+        options["dpi"] = dpi
+    tolerance = options.pop("tolerance", None)
+    precision = options.pop("precision", None)
+    rasterize = options.pop("rasterize_dense", False)
+    fig, _ = render_scene(scene, options.get("dpi", VECTOR_DPI))
+    try:
+        if tolerance:
+            with span("simplify paths"):
+                simplify_figure(fig, tolerance)
+        if rasterize:
+            rasterize_dense(fig)
+        buffer = io.StringIO() if options["format"] == "svg" else io.BytesIO()
+        with span("savefig"):
+            fig.savefig(buffer, **options)
+        data = buffer.getvalue()
+    finally:
+        release_figure(fig)
+    if precision is not None:
+        with span("compact svg"):
+            data = compact_svg(data, precision)
+    return data
+
+def render_scene_cached(scene, fmt="preview", dpi=None, scene_key=None):
+    """Same as encode_scene, but images are cached under scene_hash(scene), so an unchanged
+    scene never reaches matplotlib. Pass scene_key when the hash is already known."""
+    if scene_key is None:
+        scene_key = scene_hash(scene)
+    return render_cache.get_or_compute((scene_key, fmt, dpi), lambda: encode_scene(scene, fmt, dpi))
+
+tick_label_cache = LRUCache(maxsize=1024)  # tick value -> LaTeX label
+
+def tick_label(value, pos=None):
+    """Format a number as a LaTeX expression, e.g. 1.5707963 -> $\\dfrac{\\pi}{2}$.
+    Memoized for the whole process; usable as a FuncFormatter."""
+    value = float(value)
+    return tick_label_cache.get_or_compute(value, lambda: _tick_label(value))
+
+@timed("format tick label")
+def _tick_label(value):
+    if value.is_integer() and abs(value) < 1e15:
+        return f'${int(value)}$'  # what SymPy gives as well, without importing it
+
+    import sympy as sp
+
+    sym_expr = sp.nsimplify(value, [sp.pi])
+    latex_str = sp.latex(sym_expr)
+    latex_str = latex_str.replace(r'\frac', r'\dfrac')
+    return f'${latex_str}$'
+
+# matplotlib caches parsed mathtext per renderer, i.e. per figure, so every rerun parsed all
+# tick labels again. Share one cache across figures, keyed by label, dpi and font (size).
+mathtext_cache = LRUCache(maxsize=1024)
+
+# The arguments of the private MathTextParser._parse_cached the shared cache was written for
+MATHTEXT_PARSE_PARAMETERS = ("self", "s", "dpi", "prop", "antialiased", "load_glyph_flags")
+_mathtext_lock = threading.Lock()
+_mathtext_checked = False
+
+def install_mathtext_cache():
+    """Makes matplotlib parse mathtext through mathtext_cache. Called by create_graph; does
+    nothing after the first call, or when MathTextParser._parse_cached is not the method
+    this was written for (matplotlib keeps its per-figure cache then)."""
+    global _mathtext_checked
+    with _mathtext_lock:
+        if _mathtext_checked:
+            return
+        _mathtext_checked = True
+        uncached = getattr(getattr(MathTextParser, "_parse_cached", None), "__wrapped__", None)
+        try:
+            parameters = tuple(inspect.signature(uncached).parameters) if uncached else ()
+        except (TypeError, ValueError):
+            parameters = ()
+        if parameters != MATHTEXT_PARSE_PARAMETERS:
+            return  # matplotlib internals changed
+
+        def shared_parse_cached(self, *args, **kwargs):
+            key = (getattr(self, "_output_type", None), args, tuple(sorted(kwargs.items())))
+            return mathtext_cache.get_or_compute(key, lambda: uncached(self, *args, **kwargs))
+
+        MathTextParser._parse_cached = shared_parse_cached
+
+@timed()
 def create_graph(xlower, xupper, ylower, yupper, xstep, ystep, gridstyle,
     xminordivisor, yminordivisor, imagewidth, imageheight,
     xuserlower, xuserupper, yuserlower, yuserupper,
     showvalues, axis_weight, label_size, white_background, x=None, skip_static_plots=False):
-    """Create and save a mathematical graph with the specified parameters."""
+    """Create and save a mathematical graph with the specified parameters.
+    The figure has an Agg canvas and is not registered with pyplot; pass it to
+    release_figure when done with it."""
+    install_mathtext_cache()
 
     #------define some nested functions---------
                     
@@ -134,22 +1508,17 @@ def create_graph(xlower, xupper, ylower, yupper, xstep, ystep, gridstyle,
         elif style == 'Major':
             ax.grid(True, which='major', color='#666666', linestyle='-', alpha=0.5, linewidth=axis_weight*0.7)
         elif style == 'Minor':
-            ax.xaxis.set_minor_locator(plt.MultipleLocator(xstep/xminordivisor))
-            ax.yaxis.set_minor_locator(plt.MultipleLocator(ystep/yminordivisor))
+            ax.xaxis.set_minor_locator(MultipleLocator(xstep/xminordivisor))
+            ax.yaxis.set_minor_locator(MultipleLocator(ystep/yminordivisor))
             ax.grid(True, which='major', color='#666666', linestyle='-', alpha=0.5, linewidth=axis_weight*0.7)
             ax.grid(True, which='minor', color='#999999', linestyle='-', alpha=0.2, linewidth=axis_weight*0.7)
             ax.tick_params(which='minor', length=0)
 
-    def sympy_formatter(x, pos):
-        """Format a number as a LaTeX expression."""
-        sym_expr = nsimplify(x, [pi])
-        latex_str = latex(sym_expr)
-        latex_str = latex_str.replace(r'\frac', r'\dfrac')
-        return f'${latex_str}$'
-
     #------create the graph---------
                     
-    fig, ax = plt.subplots(figsize=(imagewidth, imageheight))
+    fig = Figure(figsize=(imagewidth, imageheight))
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
 
     if not skip_static_plots:
         i = 1
@@ -180,8 +1549,8 @@ def create_graph(xlower, xupper, ylower, yupper, xstep, ystep, gridstyle,
     set_grid_style(gridstyle)
 
     if showvalues:
-        ax.xaxis.set_major_formatter(FuncFormatter(sympy_formatter))
-        ax.yaxis.set_major_formatter(FuncFormatter(sympy_formatter))
+        ax.xaxis.set_major_formatter(FuncFormatter(tick_label))
+        ax.yaxis.set_major_formatter(FuncFormatter(tick_label))
         ax.tick_params(axis='both', 
                        labelsize=label_size, 
                        labelfontfamily='sans-serif', 
@@ -195,8 +1564,11 @@ def create_graph(xlower, xupper, ylower, yupper, xstep, ystep, gridstyle,
                 label.set_bbox(None)  # No background box
         yticks = ax.get_yticks()
         xticks = ax.get_xticks()
-        ax.set_yticks(yticks[yticks != 0])
-        ax.set_xticks(xticks[xticks != 0])
+        # Labels for the visible ticks are worked out once here instead of on every draw
+        yticks = yticks[yticks != 0]
+        xticks = xticks[xticks != 0]
+        ax.set_yticks(yticks, labels=[tick_label(value) for value in yticks])
+        ax.set_xticks(xticks, labels=[tick_label(value) for value in xticks])
     else:
         ax.set_xticklabels([])
         ax.set_yticklabels([])
@@ -206,34 +1578,168 @@ def create_graph(xlower, xupper, ylower, yupper, xstep, ystep, gridstyle,
 
     return fig, ax 
 
-def get_y_values_for_curve(x_fill, curve_points_x, curve_points_y, take_max=True):
+def densify_polyline(x, y, max_step):
+    """Inserts points along each segment of a polyline so that consecutive x values are at
+    most max_step apart, e.g. before get_y_values_for_curve on an adaptively sampled curve.
+    Segments touching a nan break are left alone."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if len(x) < 2:
+        return x, y
+    dx = np.abs(np.diff(x))
+    counts = np.where(np.isfinite(dx) & np.isfinite(np.diff(y)), np.ceil(dx / max_step), 1)
+    counts = np.maximum(counts, 1).astype(int)
+    seg = np.repeat(np.arange(len(dx)), counts)  # segment each new point lies on
+    frac = (np.arange(len(seg)) - np.repeat(np.cumsum(counts) - counts, counts)) / counts[seg]
+    with np.errstate(invalid='ignore'):
+        xs = np.where(frac == 0, x[seg], x[seg] + frac * (x[seg + 1] - x[seg]))
+        ys = np.where(frac == 0, y[seg], y[seg] + frac * (y[seg + 1] - y[seg]))
+    return np.append(xs, x[-1]), np.append(ys, y[-1])
+
+def get_y_values_for_curve(x_fill, curve_points_x, curve_points_y, take_max=True, tolerance=None):
     """
     Get y values for a curve that might have multiple y values per x.
     
     Args:
-        x_fill: x values to interpolate at
+        x_fill: x values to interpolate at (sorted)
         curve_points_x: x coordinates of the curve points
         curve_points_y: y coordinates of the curve points
         take_max: if True, take maximum y value for each x, otherwise take minimum
+        tolerance: curve points within this x distance of an x_fill value count as matches.
+            Should scale with the viewport; defaults to 0.1% of the x_fill range.
     
     Returns:
-        Array of y values corresponding to x_fill points
+        Array of y values corresponding to x_fill points (nan where no curve point matches)
     """
-    # Sort x and y values to ensure proper interpolation
-    sort_idx = np.argsort(curve_points_x)
-    x_sorted = curve_points_x[sort_idx]
-    y_sorted = curve_points_y[sort_idx]
-    
-    # For each x in x_fill, find the appropriate y value
-    y_values = []
-    tolerance = 0.01
-    
-    for x in x_fill:
-        # Find all y values for this x (within tolerance)
-        matching_y = y_sorted[np.abs(x_sorted - x) < tolerance]
-        if len(matching_y) > 0:
-            y_values.append(np.max(matching_y) if take_max else np.min(matching_y))
-        else:
-            y_values.append(np.nan)
-    
-    return np.array(y_values) 
+    x_fill = np.asarray(x_fill, dtype=float)
+    curve_points_x = np.asarray(curve_points_x, dtype=float)
+    curve_points_y = np.asarray(curve_points_y, dtype=float)
+    if tolerance is None:
+        tolerance = 0.001 * (x_fill.max() - x_fill.min()) if len(x_fill) else 0.01
+
+    # Sort x and y values to ensure proper interpolation (points without an x can never match)
+    has_x = ~np.isnan(curve_points_x)
+    sort_idx = np.argsort(curve_points_x[has_x], kind='stable')
+    x_sorted = curve_points_x[has_x][sort_idx]
+    y_sorted = curve_points_y[has_x][sort_idx]
+
+    y_values = np.full(len(x_fill), np.nan)
+    if len(x_sorted) == 0 or len(x_fill) == 0:
+        return y_values
+
+    # Window of curve points with |x_sorted - x| < tolerance for every x, as [start, stop)
+    start = np.searchsorted(x_sorted, x_fill - tolerance, side='right')
+    stop = np.searchsorted(x_sorted, x_fill + tolerance, side='left')
+
+    # reduceat over interleaved (start, stop) pairs reduces every window in one pass;
+    # the extra element keeps stop == len(x_sorted) a valid index
+    reduce = np.maximum if take_max else np.minimum
+    padded = np.append(y_sorted, np.nan)
+    reduced = reduce.reduceat(padded, np.column_stack([start, stop]).ravel())[::2]
+
+    matched = stop > start
+    y_values[matched] = reduced[matched]
+    return y_values
+
+# One side of a filled area: a constant, an explicit function (its cached samples plus the
+# expression, for the few points that are off screen) or a list of polylines
+# (implicit and parametric curves)
+Boundary = namedtuple("Boundary", ["value", "x", "y", "function", "polylines"])
+
+# A fill between two boundaries: the polygon as fill_between arrays (nan where either side
+# is undefined, with the crossing points of the two sides included) and its area
+FilledArea = namedtuple("FilledArea", ["x", "lower", "upper", "area"])
+
+def constant_boundary(value):
+    return Boundary(float(value), None, None, None, None)
+
+def explicit_boundary(user_func, xlower, xupper, ylower, yupper, pixel_size=(1000, 800)):
+    """Boundary along y = user_func(x), using the samples the plot uses."""
+    x, y = sampled_function(user_func, xlower, xupper, ylower, yupper, pixel_size)
+    return Boundary(None, x, y, user_func, None)
+
+def curve_boundary(polylines):
+    """Boundary along one or more polylines given as (x, y) pairs or (N, 2) arrays;
+    nan breaks inside a polyline are allowed."""
+    polylines = [(p[:, 0], p[:, 1]) if isinstance(p, np.ndarray) else p for p in polylines]
+    return Boundary(None, None, None, None, polylines)
+
+@timed()
+def area_between(upper, lower, x_start, x_end, ylower, yupper):
+    """Fills between two Boundary objects over [x_start, x_end] and measures the filled area.
+
+    The fill is built on the x values the boundaries were sampled at, plus the points where
+    the two sides cross, so for the polylines that are drawn it is exact. Where a curve has
+    several y values at one x, upper uses the highest and lower the lowest one.
+    Explicit functions are clamped to [ylower, yupper], so the area is the one inside the
+    plotting window, and nothing is filled where either side is undefined or at a pole.
+    Returns a FilledArea."""
+    x_start, x_end = sorted((float(x_start), float(x_end)))
+    grid = np.unique(np.concatenate([[x_start, x_end], _boundary_grid(upper, x_start, x_end),
+                                     _boundary_grid(lower, x_start, x_end)]))
+    grid = grid[(grid >= x_start) & (grid <= x_end)]
+
+    top = _boundary_values(upper, grid, True, ylower, yupper)
+    bottom = _boundary_values(lower, grid, False, ylower, yupper)
+
+    # Add the points where the sides cross, so every segment of the fill has one orientation
+    difference = top - bottom
+    d0, d1 = difference[:-1], difference[1:]
+    with np.errstate(invalid='ignore'):
+        cross = np.flatnonzero(d0 * d1 < 0)
+    s = d0[cross] / (d0[cross] - d1[cross])
+    x = np.insert(grid, cross + 1, grid[cross] + s * (grid[cross + 1] - grid[cross]))
+    top = np.insert(top, cross + 1, top[cross] + s * (top[cross + 1] - top[cross]))
+    bottom = np.insert(bottom, cross + 1, bottom[cross] + s * (bottom[cross + 1] - bottom[cross]))
+
+    # Trapezoids of |top - bottom|, skipping segments with an undefined end
+    gap = np.abs(top - bottom)
+    area = np.nansum((gap[:-1] + gap[1:]) / 2 * np.diff(x))
+    return FilledArea(x, bottom, top, float(area))
+
+def _boundary_grid(boundary, x_start, x_end):
+    """The x values where the boundary has a vertex: its samples, and for explicit functions
+    the poles together with the floats either side of them."""
+    if boundary.x is not None:
+        poles = _breaks(boundary.function, x_start, x_end)
+        return np.concatenate([boundary.x, poles, np.nextafter(poles, -np.inf), np.nextafter(poles, np.inf)])
+    if boundary.polylines is not None:
+        return np.concatenate([np.empty(0)] + [x[~np.isnan(x)] for x, _ in boundary.polylines])
+    return np.empty(0)
+
+def _boundary_values(boundary, grid, take_max, ylower, yupper):
+    """The boundary's y value at every x in grid (nan where it is undefined)."""
+    if boundary.value is not None:
+        return np.full(len(grid), boundary.value)
+    if boundary.polylines is not None:
+        return _polyline_envelope(grid, boundary.polylines, take_max)
+    values = np.interp(grid, boundary.x, boundary.y, left=np.nan, right=np.nan)
+    # The samples are nan where the curve is off screen; only those few points are evaluated
+    missing = np.isnan(values)
+    if missing.any():
+        values[missing] = np.clip(_eval_raw(boundary.function, grid[missing]), ylower, yupper)
+        values[np.isin(grid, _breaks(boundary.function, grid[0], grid[-1]))] = np.nan
+    return values
+
+def _polyline_envelope(grid, polylines, take_max):
+    """Highest (or lowest) y of the polylines at every x in grid, interpolating along each
+    segment that spans that x; nan where no segment does."""
+    values = np.full(len(grid), np.nan)
+    reduce = np.fmax if take_max else np.fmin  # fmax/fmin skip the initial nan
+    for x, y in polylines:
+        x0, x1, y0, y1 = x[:-1], x[1:], y[:-1], y[1:]
+        defined = ~(np.isnan(x0) | np.isnan(x1) | np.isnan(y0) | np.isnan(y1))
+        x0, x1, y0, y1 = x0[defined], x1[defined], y0[defined], y1[defined]
+        # Grid points within each segment's x extent
+        start = np.searchsorted(grid, np.minimum(x0, x1), side='left')
+        stop = np.searchsorted(grid, np.maximum(x0, x1), side='right')
+        counts = stop - start
+        segment = np.repeat(np.arange(len(x0)), counts)
+        index = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + start[segment]
+        dx = (x1 - x0)[segment]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s = np.where(dx != 0, (grid[index] - x0[segment]) / dx, 0)
+        reduce.at(values, index, y0[segment] + s * (y1 - y0)[segment])
+        vertical = dx == 0  # both ends of a vertical segment count
+        reduce.at(values, index[vertical], y1[segment][vertical])
+    return values
@@ -1,30 +1,31 @@
 import numpy as np
-from matplotlib.animation import FuncAnimation
-import matplotlib.pyplot as plt
 from matplotlib.ticker import FuncFormatter
 import sympy as sp
 from sympy import nsimplify, pi, E, latex
 import streamlit as st
-import io
 from numpy import log, log10 
 
-from graph_utils import create_graph, eval_function, latex_to_python, get_y_values_for_curve
+from graph_utils import (latex_to_python, sampled_function, sampled_parametric, sample_cache,
+                         state_nbytes, implicit_contour, area_between, constant_boundary,
+                         explicit_boundary, curve_boundary, prepare_implicit, evaluate_items,
+                         scene_hash, render_scene_cached, free_parameters, bind_parameters,
+                         IMAGE_FORMATS, MY_COLORS)
+from sweep import export_sweep, render_frame_cached, ANIMATION_FORMATS
+from timing import span, start_trace, stop_trace
+from vector_preview import vector_preview, PREVIEW_JS
 
 sp.arcsin = sp.asin
 sp.arccos = sp.acos
 sp.arctan = sp.atan
 
-MY_COLORS = {
-    'blue': '#82DCF2',
-    'red': '#EF665F',
-    'green': '#8FE384',
-    'yellow': '#FFC753',
-    'orange': '#FF8A56',
-    'pink': '#F688C9',
-    'grey': '#4C5B64'
-}
-
 PI = 3.1415927
+PNG_DPI = 300  # resolution of the PNG download, curves are sampled to be exact at this resolution
+EVALUATION_WORKERS = None  # threads sampling the plotted items, None for one per CPU (up to 8)
+ANIMATION_WORKERS = None  # processes rendering the frames of an animation, None for one per CPU
+ANIMATION_FPS = 20
+
+# Draws the JSON of vector_preview as an SVG in the browser
+vector_component = st.components.v2.component("vector_preview", js=PREVIEW_JS)
 
 
 #-------PAGE CONFIG----------------
@@ -34,6 +35,10 @@ st.set_page_config(
     layout="wide"  # Enable wide layout
 )
 
+# With the timing panel switched on, the stages of this rerun are collected for it
+stop_trace()  # a rerun interrupted by a widget change never finished its trace
+rerun_trace = start_trace() if st.session_state.get("show_timings") else None
+
 
 #-------SIDEBAR--------------------
 
@@ -108,41 +113,14 @@ with st.sidebar:
 
     st.write("")  # Adds vertical space
     white_background = st.toggle("White background", value=True)
+    st.toggle("Timing panel", key="show_timings", help="Show where the time of each rerun goes")
+    st.toggle("Vector preview", key="vector_preview",
+              help="Draw the preview in the browser from path data instead of as an image. "
+                   "Downloads are still rendered by matplotlib.")
 
-
-#-------INITIAL PLOT-------------------------
-
-x_init = np.linspace(xlower, xupper, 100000)
-y_init = np.zeros_like(x_init)  # Create corresponding y values
-
-fig, ax = create_graph(
-    xlower=xlower,
-    xupper=xupper,
-    ylower=ylower,
-    yupper=yupper,
-    xstep=xstep,
-    ystep=ystep,
-    gridstyle=gridstyle,
-    xminordivisor=xminordivisor,
-    yminordivisor=yminordivisor,
-    imagewidth=imagewidth,
-    imageheight=imageheight,
-    xuserlower=xuserlower,
-    xuserupper=xuserupper,
-    yuserlower=yuserlower,
-    yuserupper=yuserupper,
-    showvalues=showvalues,
-    axis_weight=axis_weight,
-    label_size=label_size,
-    white_background=white_background,
-    skip_static_plots=False  # or True if you want to skip plotting static data
-)
-
-ax.plot(x_init, y_init, alpha=0)  # Plot invisible points
-ax.margins(x=0, y=0)  # Remove margins
-fig.subplots_adjust(left=0, right=1, bottom=0, top=1, wspace=0, hspace=0)  # Remove all padding
-ax.set_xlim(xlower, xupper)  # Force exact limits
-ax.set_ylim(ylower, yupper)  # Force exact limits
+# Size of the plotting window in PNG pixels, used to decide how finely curves are sampled.
+# Session state only holds the expressions; samples come from the shared sample cache.
+pixel_size = (imagewidth * PNG_DPI, imageheight * PNG_DPI)
 
 
 #-------ADD FUNCTIONS-------------------------
@@ -171,6 +149,8 @@ if "plotted_parametric_functions" not in st.session_state:
 if "plot_counter" not in st.session_state:
     st.session_state.plot_counter = 0
 
+area_fills = []  # areas filled on this rerun
+
 for i in range(8):  # Changed from range(5)
     if f"point_color_{i}" not in st.session_state:
         st.session_state[f"point_color_{i}"] = "blue"
@@ -188,6 +168,7 @@ with master_col1:
         svg_placeholder = st.empty()
     with download_columns[2]:
         png_placeholder = st.empty()
+    parameter_container = st.container()  # sliders for the free parameters of the plotted functions
 
 with master_col2:
     tab1, tab2, tab3, tab4, tab5 = st.tabs(["Explicit functions", "Implicit functions", "Parametric functions", "Points", "Areas"])
@@ -235,13 +216,8 @@ with master_col2:
         with col4:
             if st.button("Plot", key=f"latex_plot_1"):
                 if latex_input.strip() and python_str:
-                    x = np.linspace(xlower, xupper, 100000)
-                    y = eval_function(python_str, x, np, ylower, yupper)
-                    
                     st.session_state.plot_counter += 1
                     func_data = {
-                        "x": x,
-                        "y": y,
                         "function": python_str,
                         "color": color_choice,
                         "line_style": line_style,
@@ -290,13 +266,8 @@ with master_col2:
             with col4:
                 if st.button("Plot", key=f"latex_plot_{i}"):
                     if latex_input_i.strip() and python_str_i:
-                        x = np.linspace(xlower, xupper, 100000)
-                        y = eval_function(python_str_i, x, np, ylower, yupper)
-                        
                         st.session_state.plot_counter += 1
                         func_data = {
-                            "x": x,
-                            "y": y,
                             "function": python_str_i,
                             "color": color_choice_i,
                             "line_style": line_style_i,
@@ -315,7 +286,7 @@ with master_col2:
         
         # Create up to 5 implicit function input rows
         for i in range(5):
-            col1, col2, col3, col4 = st.columns([3, 1, 1, 1], vertical_alignment="bottom")
+            col1, col2, col3, col4, col5 = st.columns([3, 1, 1, 1, 1], vertical_alignment="bottom")
             
             with col1:
                 default_value = r"x^2 + y^2 - 1" if i == 0 else ""
@@ -344,17 +315,26 @@ with master_col2:
                     "dotted": ":"
                 }[line_style_choice]
             
+            with col4:
+                relation_choice = st.selectbox("Relation",
+                                               ("= 0", "< 0", "≤ 0", "> 0", "≥ 0"),
+                                               key=f"implicit_relation_{i}",
+                                               index=0,
+                                               label_visibility="collapsed")
+            
             # Do LaTeX conversion here so python_str is available for plot button
             python_str = None
             if latex_input.strip():
                 python_str, _ = latex_to_python(latex_input)
             
-            with col4:
+            with col5:
                 if st.button("Plot", key=f"plot_implicit_{i}"):
                     if latex_input.strip() and python_str:
                         st.session_state.plot_counter += 1
                         implicit_data = {
                             "function": python_str,
+                            "relation": {"= 0": "=", "< 0": "<", "≤ 0": "<=",
+                                         "> 0": ">", "≥ 0": ">="}[relation_choice],
                             "color": color_choice,
                             "line_style": line_style,
                             "zorder": 10 + st.session_state.plot_counter  # Base zorder of 10 for all functions
@@ -365,7 +345,7 @@ with master_col2:
                         else:
                             st.session_state.plotted_implicit_functions.append(implicit_data)
 
-        st.caption("Entering $f(x,y)$ will plot the curve $f(x,y) = 0$.\n\nFor example, $x^2 + y^2 - 1$ plots the unit circle.")
+        st.caption("Entering $f(x,y)$ will plot the curve $f(x,y) = 0$.\n\nFor example, $x^2 + y^2 - 1$ plots the unit circle.\n\nChoose $< 0$ or $> 0$ to also shade the region where $f(x,y)$ is negative or positive.")
 
     with tab3:
         st.subheader("Plot parametric functions", divider="gray")
@@ -430,18 +410,10 @@ with master_col2:
                             t_start = float(eval(t_start_python.replace("π", str(PI))))
                             t_end = float(eval(t_end_python.replace("π", str(PI))))
                             
-                            # Create t values
-                            t = np.linspace(t_start, t_end, 1000)
-                            
-                            # Evaluate x(t) and y(t)
-                            x = eval_function(x_python, t, np, xlower, xupper, xlower, xupper, param_var='t')
-                            y = eval_function(y_python, t, np, ylower, yupper, xlower, xupper, param_var='t')
-                            
                             st.session_state.plot_counter += 1
                             param_data = {
-                                "x": x,
-                                "y": y,
                                 "function": (x_python, y_python),
+                                "t_range": (t_start, t_end),
                                 "color": color_choice,
                                 "line_style": line_style,
                                 "zorder": 10 + st.session_state.plot_counter
@@ -544,159 +516,54 @@ with master_col2:
                                       key="area_opacity",
                                       label_visibility="collapsed")
         with col7:
-            if st.button("Fill", key="area_fill"):
-                if first_func_idx:
-                    try:
-                        # Get x values for the fill
-                        x_fill = np.linspace(x_start, x_end, 1000)
-                        
-                        # Initialize y arrays
-                        upper_y = None
-                        lower_y = None
-                        
-                        # Get upper function data
-                        if first_func_idx == "Top":
-                            # Use the upper y value plus a small buffer
-                            upper_y = np.full_like(x_fill, yupper + 0.025 * ydifference)
-                        elif first_func_idx.startswith("Explicit"):
-                            idx = int(first_func_idx.split()[1]) - 1
-                            upper_y = eval_function(st.session_state.plotted_functions[idx]["function"], x_fill, np, ylower, yupper)
-                        elif first_func_idx.startswith("Implicit"):
-                            idx = int(first_func_idx.split()[1]) - 1
-                            implicit_data = st.session_state.plotted_implicit_functions[idx]
-                            
-                            try:
-                                # Create grid and evaluate implicit function
-                                x = np.linspace(xlower, xupper, 1000)
-                                y = np.linspace(ylower, yupper, 1000)
-                                X, Y = np.meshgrid(x, y)
-                                
-                                x_sym, y_sym = sp.symbols('x y')
-                                expr = eval(implicit_data["function"], {"x": x_sym, "y": y_sym, "lib": sp})
-                                f = sp.lambdify((x_sym, y_sym), expr)
-                                Z = f(X, Y)
-                                
-                                # Get contour points
-                                temp_fig, temp_ax = plt.subplots()
-                                cs = temp_ax.contour(X, Y, Z, levels=[0])
-                                segs = cs.allsegs[0]
-                                plt.close(temp_fig)
-                                
-                                if len(segs) > 0:
-                                    # Combine points from all segments
-                                    x_points = []
-                                    y_points = []
-                                    for seg in segs:
-                                        x_points.extend(seg[:, 0])
-                                        y_points.extend(seg[:, 1])
-                                    
-                                    upper_y = get_y_values_for_curve(x_fill, np.array(x_points), np.array(y_points), take_max=True)
-                                else:
-                                    upper_y = np.zeros_like(x_fill)
-                            
-                            except Exception as e:
-                                upper_y = np.zeros_like(x_fill)
-                        elif first_func_idx.startswith("Parametric"):
-                            try:
-                                idx = int(first_func_idx.split()[1]) - 1
-                                if idx < len(st.session_state.plotted_parametric_functions):
-                                    param_data = st.session_state.plotted_parametric_functions[idx]
-                                    if param_data is not None:
-                                        x = param_data["x"]
-                                        y = param_data["y"]
-                                        upper_y = get_y_values_for_curve(x_fill, x, y, take_max=True)
-                                    else:
-                                        upper_y = np.zeros_like(x_fill)
-                                else:
-                                    upper_y = np.zeros_like(x_fill)
-                            except Exception as e:
-                                upper_y = np.zeros_like(x_fill)
-                        
-                        # Get lower function data
-                        if second_func_idx == "Bottom":
-                            # Use the lower y value minus a small buffer
-                            lower_y = np.full_like(x_fill, ylower - 0.025 * ydifference)
-                        elif second_func_idx == "x-axis":
-                            lower_y = np.zeros_like(x_fill)
-                        elif second_func_idx.startswith("Explicit"):
-                            idx = int(second_func_idx.split()[1]) - 1
-                            lower_y = eval_function(st.session_state.plotted_functions[idx]["function"], x_fill, np, ylower, yupper)
-                        elif second_func_idx.startswith("Parametric"):
-                            try:
-                                idx = int(second_func_idx.split()[1]) - 1
-                                if idx < len(st.session_state.plotted_parametric_functions):
-                                    param_data = st.session_state.plotted_parametric_functions[idx]
-                                    if param_data is not None:
-                                        # Unpack the tuple returned by eval_function
-                                        x_coords, y_coords = param_data["x"], param_data["y"]
-                                        # Only plot where neither x nor y is NaN
-                                        valid_mask = ~(np.isnan(x_coords) | np.isnan(y_coords))
-                                        ax.plot(x_coords[valid_mask], y_coords[valid_mask],
-                                               color=MY_COLORS[param_data["color"]],
-                                               linestyle=param_data["line_style"],
-                                               linewidth=axis_weight * 1.3,
-                                               zorder=param_data["zorder"])
-                                    else:
-                                        lower_y = np.zeros_like(x_fill)
-                                else:
-                                    lower_y = np.zeros_like(x_fill)
-                            except Exception as e:
-                                lower_y = np.zeros_like(x_fill)
-                        elif second_func_idx.startswith("Implicit"):
-                            idx = int(second_func_idx.split()[1]) - 1
-                            implicit_data = st.session_state.plotted_implicit_functions[idx]
-                            
-                            try:
-                                # Create grid and evaluate implicit function
-                                x = np.linspace(xlower, xupper, 1000)
-                                y = np.linspace(ylower, yupper, 1000)
-                                X, Y = np.meshgrid(x, y)
-                                
-                                x_sym, y_sym = sp.symbols('x y')
-                                expr = eval(implicit_data["function"], {"x": x_sym, "y": y_sym, "lib": sp})
-                                f = sp.lambdify((x_sym, y_sym), expr)
-                                Z = f(X, Y)
-                                
-                                # Get contour points
-                                temp_fig, temp_ax = plt.subplots()
-                                cs = temp_ax.contour(X, Y, Z, levels=[0])
-                                segs = cs.allsegs[0]
-                                plt.close(temp_fig)
-                                
-                                if len(segs) > 0:
-                                    # Combine points from all segments
-                                    x_points = []
-                                    y_points = []
-                                    for seg in segs:
-                                        x_points.extend(seg[:, 0])
-                                        y_points.extend(seg[:, 1])
-                                    
-                                    lower_y = get_y_values_for_curve(x_fill, np.array(x_points), np.array(y_points), take_max=False)
-                                else:
-                                    lower_y = np.zeros_like(x_fill)
-                            
-                            except Exception as e:
-                                lower_y = np.zeros_like(x_fill)
-                            
-                        # Check if we have valid data
-                        if upper_y is not None and lower_y is not None:
-                            # Remove any NaN values before filling
-                            valid_mask = ~(np.isnan(upper_y) | np.isnan(lower_y))
-                            
-                            if np.any(valid_mask):
-                                ax.fill_between(x_fill[valid_mask], 
-                                              lower_y[valid_mask], 
-                                              upper_y[valid_mask],
-                                              color=MY_COLORS[fill_color],
-                                              alpha=opacity,
-                                              zorder=5)  # Changed from 1 to 5 to appear above tick labels
-                            else:
-                                st.error("No valid points found for filling")
-                        else:
-                            st.error("Could not compute function values")
-                            
-                    except Exception as e:
-                        st.error(f"Error filling area: {str(e)}")
+            fill_clicked = st.button("Fill", key="area_fill")
+
+        def bound(function):
+            """function with its free parameters replaced by the values of their sliders."""
+            if isinstance(function, tuple):
+                return tuple(bound(f) for f in function)
+            names = free_parameters(function, ('x', 'y', 't'))
+            return bind_parameters(function, {name: st.session_state.get(f"parameter_{name}", 1.0) for name in names})
+
+        def area_boundary(choice):
+            """The Boundary for an Outer/Inner choice, built from the samples the plot uses."""
+            if choice == "Top":
+                return constant_boundary(yupper + 0.025 * ydifference)  # a small buffer above the window
+            if choice == "Bottom":
+                return constant_boundary(ylower - 0.025 * ydifference)
+            if choice == "x-axis":
+                return constant_boundary(0)
+            kind, number = choice.split()
+            idx = int(number) - 1
+            if kind == "Explicit":
+                return explicit_boundary(bound(st.session_state.plotted_functions[idx]["function"]),
+                                         xlower, xupper, ylower, yupper, pixel_size)
+            if kind == "Implicit":
+                implicit_data = st.session_state.plotted_implicit_functions[idx]
+                return curve_boundary(implicit_contour(bound(implicit_data["function"]),
+                                                       xlower, xupper, ylower, yupper).segments)
+            param_data = st.session_state.plotted_parametric_functions[idx]
+            return curve_boundary([sampled_parametric(*bound(param_data["function"]), *param_data["t_range"],
+                                                      xlower, xupper, ylower, yupper, pixel_size)])
+
+        if fill_clicked and first_func_idx:
+            try:
+                filled = area_between(area_boundary(first_func_idx), area_boundary(second_func_idx),
+                                      x_start, x_end, ylower - 0.025 * ydifference, yupper + 0.025 * ydifference)
+                if np.any(~np.isnan(filled.upper - filled.lower)):
+                    # Drawn with the rest of the scene below
+                    area_fills.append({
+                        "x": filled.x,
+                        "lower": filled.lower,
+                        "upper": filled.upper,
+                        "color": fill_color,
+                        "opacity": opacity
+                    })
+                    st.write(f"Area $\\approx {filled.area:.6g}$")
+                else:
+                    st.error("No valid points found for filling")
+            except Exception as e:
+                st.error(f"Error filling area: {str(e)}")
 
         st.caption("""
         If a curve has multiple y-values at an x-coordinate:\n
@@ -705,113 +572,257 @@ with master_col2:
         """)
 
 
+#-------BUILD SCENE-------------------------
+
+# Plotted items get their zorder the first time they are drawn
 for func_data in st.session_state.plotted_functions:
     if "zorder" not in func_data:
         st.session_state.plot_counter += 1
         func_data["zorder"] = st.session_state.plot_counter
-    
-    ax.plot(
-        func_data["x"],
-        func_data["y"],
-        color=MY_COLORS[func_data["color"]],
-        linestyle=func_data["line_style"],
-        linewidth=axis_weight * 1.3,
-        zorder=func_data["zorder"])
 
 for point_data in st.session_state.plotted_points:
     if "zorder" not in point_data:
         st.session_state.plot_counter += 1
         point_data["zorder"] = 1000 + st.session_state.plot_counter  # Much higher base zorder for points
-        
-    if point_data["marker"] == "x":
-        markersize = axis_weight * 6
-        markeredgewidth = axis_weight
-    else:  # circle
-        markersize = axis_weight * 3
-        markeredgewidth = axis_weight
-    
-    ax.plot(point_data["x"], 
-           point_data["y"], 
-           marker=point_data["marker"],
-           color=MY_COLORS[point_data["color"]], 
-           markersize=markersize,
-           markeredgewidth=markeredgewidth,
-           linestyle='none',
-           zorder=point_data["zorder"])
-
-# Plot all stored implicit functions
-for implicit_data in st.session_state.plotted_implicit_functions:
-    if implicit_data and implicit_data["function"].strip():
-        if "zorder" not in implicit_data:
-            st.session_state.plot_counter += 1
-            implicit_data["zorder"] = st.session_state.plot_counter
-            
-        x = np.linspace(xlower, xupper, 1000)
-        y = np.linspace(ylower, yupper, 1000)
-        X, Y = np.meshgrid(x, y)
-        
-        # Evaluate the expression
-        x_sym, y_sym = sp.symbols('x y')
-        expr = eval(implicit_data["function"], {
-            "x": x_sym, 
-            "y": y_sym, 
-            "lib": sp  # This is what users expect to use
-        })
-        
-        # Convert to numpy function and plot
-        f = sp.lambdify((x_sym, y_sym), expr)
-        Z = f(X, Y)
-        
-        ax.contour(X, Y, Z, levels=[0], 
-                  colors=[MY_COLORS[implicit_data["color"]]],
-                  linestyles=[implicit_data["line_style"]],
-                  linewidths=axis_weight * 1.3,
-                  zorder=implicit_data["zorder"])
 
+for implicit_data in st.session_state.plotted_implicit_functions:
+    if implicit_data and "zorder" not in implicit_data:
+        st.session_state.plot_counter += 1
+        implicit_data["zorder"] = st.session_state.plot_counter
+
+def parameters_of(function, variables):
+    """The free parameters of a function (or of both functions of a parametric curve)."""
+    if isinstance(function, tuple):
+        return tuple(name for f in function for name in free_parameters(f, variables))
+    return free_parameters(function, variables)
+
+# Functions with free parameters, e.g. a\sin(bx), get a slider per parameter. They are drawn
+# as the "curves" of the scene, which only redraws them when a slider moves.
+def curve(kind, item, **extra):
+    return {"kind": kind, "function": item["function"], "color": MY_COLORS[item["color"]],
+            "line_style": item["line_style"], "zorder": item["zorder"], **extra}
+
+explicit_functions = []
+implicit_functions = []
+parametric_functions = []
+curves = []
+parameter_names = set()
+for func_data in st.session_state.plotted_functions:
+    if names := parameters_of(func_data["function"], ('x',)):
+        curves.append(curve("explicit", func_data))
+        parameter_names.update(names)
+    else:
+        explicit_functions.append(func_data)
+for implicit_data in st.session_state.plotted_implicit_functions:
+    if not (implicit_data and implicit_data["function"].strip()):
+        continue
+    if names := parameters_of(implicit_data["function"], ('x', 'y')):
+        curves.append(curve("implicit", implicit_data, relation=implicit_data["relation"]))
+        parameter_names.update(names)
+    else:
+        implicit_functions.append(implicit_data)
 for param_data in st.session_state.plotted_parametric_functions:
-    if param_data:
-        # Filter out NaN values before plotting
-        valid_mask = ~(np.isnan(param_data["x"]) | np.isnan(param_data["y"]))
-        ax.plot(
-            param_data["x"][valid_mask],
-            param_data["y"][valid_mask],
-            color=MY_COLORS[param_data["color"]],
-            linestyle=param_data["line_style"],
-            linewidth=axis_weight * 1.3,
-            zorder=param_data["zorder"])
+    if not param_data:
+        continue
+    if names := parameters_of(param_data["function"], ('t',)):
+        curves.append(curve("parametric", param_data, t_range=param_data["t_range"]))
+        parameter_names.update(names)
+    else:
+        parametric_functions.append(param_data)
+
+parameters = {}
+if parameter_names:
+    with parameter_container:
+        st.write("**Parameters**")
+        slider_columns = st.columns(min(len(parameter_names), 3))
+        for i, name in enumerate(sorted(parameter_names)):
+            with slider_columns[i % len(slider_columns)]:
+                parameters[name] = st.slider(f"${name}$", min_value=-10.0, max_value=10.0, value=1.0, step=0.1,
+                                             key=f"parameter_{name}")
+
+# Curves are sampled for the current viewport, or taken from the shared cache if already sampled.
+# Every item is a separate job, so they are evaluated side by side.
+preview_dpi = IMAGE_FORMATS["preview"]["dpi"]
+jobs = {}
+for i, func_data in enumerate(explicit_functions):
+    jobs[f"Explicit {i+1}"] = (sampled_function, (func_data["function"], xlower, xupper, ylower, yupper, pixel_size))
+for i, implicit_data in enumerate(implicit_functions):
+    jobs[f"Implicit {i+1}"] = (prepare_implicit, (implicit_data["function"], implicit_data["relation"],
+                                                  xlower, xupper, ylower, yupper,
+                                                  (int(imagewidth * preview_dpi), int(imageheight * preview_dpi))))
+for i, param_data in enumerate(parametric_functions):
+    jobs[f"Parametric {i+1}"] = (sampled_parametric, (*param_data["function"], *param_data["t_range"],
+                                                      xlower, xupper, ylower, yupper, pixel_size))
+with span("evaluate items"):
+    item_results, item_seconds = evaluate_items(jobs, EVALUATION_WORKERS)
+function_samples = [item_results[f"Explicit {i+1}"] for i in range(len(explicit_functions))]
+parametric_samples = [item_results[f"Parametric {i+1}"] for i in range(len(parametric_functions))]
+
+# Everything that affects the picture, with colours resolved; rendered images are cached under its hash
+scene = {
+    "axes": {
+        "xlower": xlower,
+        "xupper": xupper,
+        "ylower": ylower,
+        "yupper": yupper,
+        "xstep": xstep,
+        "ystep": ystep,
+        "gridstyle": gridstyle,
+        "xminordivisor": xminordivisor,
+        "yminordivisor": yminordivisor,
+        "imagewidth": imagewidth,
+        "imageheight": imageheight,
+        "xuserlower": xuserlower,
+        "xuserupper": xuserupper,
+        "yuserlower": yuserlower,
+        "yuserupper": yuserupper,
+        "showvalues": showvalues,
+        "axis_weight": axis_weight,
+        "label_size": label_size,
+        "white_background": white_background,
+    },
+    "functions": [
+        {"x": x, "y": y, "color": MY_COLORS[func_data["color"]],
+         "line_style": func_data["line_style"], "zorder": func_data["zorder"]}
+        for func_data, (x, y) in zip(explicit_functions, function_samples)
+    ],
+    "implicit_functions": [
+        {"function": implicit_data["function"], "relation": implicit_data["relation"],
+         "color": MY_COLORS[implicit_data["color"]],
+         "line_style": implicit_data["line_style"], "zorder": implicit_data["zorder"]}
+        for implicit_data in implicit_functions
+    ],
+    "parametric_functions": [
+        {"x": x, "y": y, "color": MY_COLORS[param_data["color"]],
+         "line_style": param_data["line_style"], "zorder": param_data["zorder"]}
+        for param_data, (x, y) in zip(parametric_functions, parametric_samples)
+    ],
+    "points": [
+        {"x": point_data["x"], "y": point_data["y"], "marker": point_data["marker"],
+         "color": MY_COLORS[point_data["color"]], "zorder": point_data["zorder"]}
+        for point_data in st.session_state.plotted_points
+    ],
+    "areas": [
+        {"x": area["x"], "lower": area["lower"], "upper": area["upper"],
+         "color": MY_COLORS[area["color"]], "opacity": area["opacity"]}
+        for area in area_fills
+    ],
+    "curves": curves,
+    "parameters": parameters,
+}
+scene_key = scene_hash(scene)
+
+# An unchanged scene comes straight from the cache without going through matplotlib,
+# and while a parameter slider moves only the curves with parameters are redrawn
+with span("preview"):
+    if st.session_state.get("vector_preview"):
+        with plot_placeholder:
+            vector_component(data=vector_preview(scene, scene_key=scene_key), key="vector_preview_plot")
+    else:
+        if curves:
+            preview = render_frame_cached(scene, preview_dpi, scene_key=scene_key)
+        else:
+            preview = render_scene_cached(scene, "preview", scene_key=scene_key)
+        plot_placeholder.image(preview, width="stretch")
 
-if not white_background:
-    ax.set_facecolor('none')  # Transparent background
-    fig.patch.set_facecolor('none')  # Transparent figure background
+cache_info = sample_cache.info()
+st.sidebar.caption(f"Session state: {state_nbytes(st.session_state.to_dict()) / 1024:.1f} kB · "
+                   f"shared curve cache: {cache_info['size']} curves, {cache_info['nbytes'] / 1024 ** 2:.1f} MB, "
+                   f"{cache_info['hits'] / max(cache_info['hits'] + cache_info['misses'], 1):.0%} hits")
 
-plot_placeholder.pyplot(fig)
+if item_seconds:
+    with st.sidebar.expander("Evaluation times"):
+        for name, seconds in item_seconds.items():
+            st.caption(f"{name}: {seconds * 1000:.1f} ms")
 
 
 #-------SAVE IMAGES-------------------------
 
-svg_buffer = io.StringIO()
-fig.savefig(svg_buffer, format="svg")
-svg_data = svg_buffer.getvalue()
-svg_buffer.close()
-
+# The files are only rendered when a download button is clicked
 svg_placeholder.download_button(
     label="Download SVG",
-    data=svg_data,
+    data=lambda: render_scene_cached(scene, "svg-compact", scene_key=scene_key),
     file_name="figure1.svg",
     mime="image/svg+xml",
+    on_click="ignore",
 )
 
-png_buffer = io.BytesIO()
-fig.savefig(png_buffer, format="png", dpi=300, bbox_inches="tight", pad_inches=0)
-png_buffer.seek(0)
-png_data = png_buffer.getvalue()
-png_buffer.close()
-
 png_placeholder.download_button(
     label = "Download PNG", 
-    data=png_data, 
+    data=lambda: render_scene_cached(scene, "png", dpi=PNG_DPI, scene_key=scene_key), 
     file_name="figure1.png", 
-    mime="image/png")
+    mime="image/png",
+    on_click="ignore")
+
+
+#-------ANIMATE PARAMETERS-------------------------
+
+if parameter_names:
+    with parameter_container.expander("Animate"):
+        col1, col2, col3, col4, col5 = st.columns([1.5, 1, 1, 1, 1], vertical_alignment="bottom")
+        with col1:
+            animate_name = st.selectbox("Parameter", sorted(parameter_names), key="animate_parameter")
+        with col2:
+            animate_start = st.number_input("From", value=0.0, key="animate_start")
+        with col3:
+            animate_stop = st.number_input("To", value=5.0, key="animate_stop")
+        with col4:
+            animate_frames = st.number_input("Frames", min_value=2, max_value=600, value=60, key="animate_frames")
+        with col5:
+            animate_format = st.segmented_control("Format", options=list(ANIMATION_FORMATS), default="gif",
+                                                  key="animate_format") or "gif"
+        if st.button("Animate", key="animate"):
+            try:
+                with st.spinner(f"Rendering {animate_frames} frames"):
+                    animation = export_sweep(scene, animate_name, animate_start, animate_stop, animate_frames,
+                                             ANIMATION_FPS, animate_format, workers=ANIMATION_WORKERS)
+                if animate_format == "gif":
+                    st.image(animation)
+                else:
+                    st.video(animation, format=ANIMATION_FORMATS[animate_format], loop=True)
+                st.download_button(label=f"Download {animate_format.upper()}", data=animation,
+                                   file_name=f"figure1.{animate_format}", mime=ANIMATION_FORMATS[animate_format],
+                                   on_click="ignore")
+            except Exception as e:
+                st.error(f"Error animating {animate_name}: {str(e)}")
+
+
+#-------TIMING PANEL-------------------------
+
+def flame_chart(records):
+    """Spans of one rerun as a flame chart: one bar per span from its start to its end,
+    nested spans below their parent and spans of other threads side by side."""
+    import altair as alt  # only needed with the panel switched on
+
+    rows = [{"name": record["name"], "path": record["path"], "depth": record["depth"],
+             "thread": record["thread"], "start": record["start"] * 1000,
+             "end": (record["start"] + record["seconds"]) * 1000,
+             "ms": round(record["seconds"] * 1000, 2)}
+            for record in records if record["start"] is not None]
+    bars = alt.Chart(alt.Data(values=rows)).mark_bar(stroke="white").encode(
+        x=alt.X("start:Q", title="ms"),
+        x2="end:Q",
+        y=alt.Y("depth:O", title=None, axis=None),
+        yOffset="thread:N",
+        color=alt.Color("name:N", legend=None),
+        tooltip=["path:N", "ms:Q", "thread:N"],
+    )
+    labels = bars.mark_text(align="left", dx=3, color="black").encode(text="name:N", color=alt.value("black"))
+    return (bars + labels).properties(height=40 * (max(row["depth"] for row in rows) + 1))
+
+if rerun_trace is not None:
+    records = rerun_trace.finish()
+    with st.expander(f"Timings: {rerun_trace.seconds * 1000:.0f} ms this rerun"):
+        st.altair_chart(flame_chart(records), width="stretch")
+        # Total per stage, slowest first
+        totals = {}
+        for record in records:
+            total = totals.setdefault(record["name"], {"stage": record["name"], "calls": 0, "ms": 0.0})
+            total["calls"] += 1
+            total["ms"] += record["seconds"] * 1000
+            if "memory" in record:
+                total["memory kB"] = total.get("memory kB", 0) + record["memory"] / 1024
+        st.dataframe(sorted(totals.values(), key=lambda total: -total["ms"]), hide_index=True)
 
 
 #-------unused-------
@@ -0,0 +1,206 @@
+"""Parameter sweeps: redrawing the curves of a scene whose functions have free parameters,
+e.g. a\\sin(bx), for many values of those parameters.
+
+Rebuilding the figure with render_scene for every value redraws the axes, grid, tick
+labels and static items each time. SweepRenderer draws all of that once, keeps the
+rendered background and, per frame, only evaluates the curves (the scene's "curves", see
+render_scene), hands the new data to their artists and blits them onto the background.
+matplotlib's FuncAnimation.save redraws the whole figure for every frame, so frames are
+blitted on an Agg canvas here and encoded separately.
+
+render_frames spreads the frames of an animation across a process pool, each worker with
+its own SweepRenderer, and encode_gif / encode_mp4 turn them into an animation:
+
+    data = export_sweep(scene, "a", 0.5, 3, frames=60, fmt="gif")
+"""
+import io
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+import numpy as np
+from matplotlib.colors import to_rgba
+
+from graph_utils import (LRUCache, IMAGE_FORMATS, render_scene, region_image, sample_curve, curve_artist,
+                         set_curve_data, scene_hash, evaluate_items, render_cache, release_figure)
+from timing import span, timed
+
+ANIMATION_DPI = 100  # resolution of exported animations
+ANIMATION_FORMATS = {"gif": "image/gif", "mp4": "video/mp4"}
+
+
+class SweepRenderer:
+    """Renders a scene at a fixed dpi for changing values of the parameters of its "curves".
+    Frames are cropped like the preview (bbox_inches="tight"). Safe to share between threads,
+    frames are blitted one at a time."""
+
+    def __init__(self, scene, dpi=ANIMATION_DPI):
+        axes = scene["axes"]
+        self.viewport = (axes["xlower"], axes["xupper"], axes["ylower"], axes["yupper"])
+        self.pixel_size = (axes["imagewidth"] * dpi, axes["imageheight"] * dpi)
+        self.defaults = dict(scene.get("parameters") or {})
+        self.curves = scene.get("curves", [])
+        self.regions = sorted((curve for curve in self.curves
+                               if curve["kind"] == "implicit" and curve.get("relation", "=") != "="),
+                              key=lambda region: region["zorder"])
+
+        # Everything but the curves, drawn once
+        self.fig, self.ax = render_scene(dict(scene, curves=[]), dpi)
+        self.fig.set_dpi(dpi)
+        linewidth = axes["axis_weight"] * 1.3
+        self.artists = [curve_artist(self.ax, curve, linewidth, animated=True) for curve in self.curves]
+        self.region = None
+        if self.regions:
+            # Beneath the curves, like the regions of render_scene (but above its static ones)
+            self.region = self.ax.imshow(np.zeros((1, 1, 4), dtype=np.uint8), extent=self.viewport,
+                                         origin='lower', interpolation='none', aspect='auto', zorder=4,
+                                         animated=True)
+        self.order = sorted(self.artists + ([self.region] if self.region else []), key=lambda artist: artist.get_zorder())
+
+        canvas = self.fig.canvas
+        canvas.draw()
+        self.background = canvas.copy_from_bbox(self.fig.bbox)
+        # The pixels savefig(bbox_inches="tight") would keep: the tight box, rows counted from
+        # the top, cropped from the canvas and padded with the figure colour where it sticks out
+        width, height = canvas.get_width_height()
+        pad = IMAGE_FORMATS["preview"].get("pad_inches", matplotlib.rcParams["savefig.pad_inches"])
+        box = self.fig.get_tightbbox(canvas.get_renderer()).padded(pad).transformed(self.fig.dpi_scale_trans)
+        top, bottom, left, right = (round(height - box.y1), round(height - box.y0), round(box.x0), round(box.x1))
+        self.crop = (slice(max(top, 0), min(bottom, height)), slice(max(left, 0), min(right, width)))
+        self.padding = ((max(-top, 0), max(bottom - height, 0)), (max(-left, 0), max(right - width, 0)), (0, 0))
+        # One RGBA pixel as a uint32, which fills an image much faster than broadcasting 4 bytes
+        self.facecolor = np.round(np.array(to_rgba(self.fig.get_facecolor())) * 255).astype(np.uint8).view(np.uint32)[0]
+        self._lock = threading.Lock()
+        # Once dropped from sweep_cache and done drawing, the canvas goes right away
+        weakref.finalize(self, release_figure, self.fig)
+
+    @timed("sweep frame")
+    def frame(self, parameters=None):
+        """The frame for the given parameter values (missing ones fall back to the scene's
+        "parameters") as a (height, width, 4) RGBA uint8 array."""
+        parameters = dict(self.defaults, **(parameters or {}))
+        jobs = {f"Curve {i+1}": (sample_curve, (curve, parameters, *self.viewport, self.pixel_size))
+                for i, curve in enumerate(self.curves)}
+        if self.regions:
+            width, height = self.fig.canvas.get_width_height()
+            jobs["Regions"] = (region_image, (self.regions, *self.viewport, width, height, parameters))
+        with span("evaluate curves"):
+            data, _ = evaluate_items(jobs)
+
+        with self._lock, span("blit"):
+            canvas = self.fig.canvas
+            canvas.restore_region(self.background)
+            for i, artist in enumerate(self.artists):
+                set_curve_data(artist, data[f"Curve {i+1}"])
+            if self.region:
+                self.region.set_data(data["Regions"])
+            for artist in self.order:
+                self.fig.draw_artist(artist)
+            image = np.asarray(canvas.buffer_rgba())[self.crop]
+            (top, bottom), (left, right), _ = self.padding
+            frame = np.empty((image.shape[0] + top + bottom, image.shape[1] + left + right, 4), dtype=np.uint8)
+            frame.view(np.uint32)[...] = self.facecolor
+            frame[top:top + image.shape[0], left:left + image.shape[1]] = image
+            return frame
+
+    def png(self, parameters=None, opaque=False):
+        """The frame for the given parameter values encoded as PNG. opaque=True puts it on
+        white, for formats without transparency."""
+        from PIL import Image  # comes with matplotlib
+
+        image = Image.fromarray(self.frame(parameters), "RGBA")
+        if opaque:
+            image = Image.alpha_composite(Image.new("RGBA", image.size, "white"), image).convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, format="png", compress_level=1)  # fast, frames are short-lived
+        return buffer.getvalue()
+
+
+# The background of a renderer is as big as an image of the scene, so only a few are kept
+sweep_cache = LRUCache(maxsize=4)  # (hash of the scene without its parameter values, dpi) -> SweepRenderer
+
+def sweep_renderer(scene, dpi=ANIMATION_DPI):
+    """The SweepRenderer of a scene, shared while only the values of its parameters change,
+    e.g. while a parameter slider is dragged."""
+    key = (scene_hash(dict(scene, parameters=None)), dpi)
+    return sweep_cache.get_or_compute(key, lambda: SweepRenderer(scene, dpi))
+
+def render_frame_cached(scene, dpi, scene_key=None):
+    """A PNG of the scene for the values in its "parameters", from its SweepRenderer, cached
+    in render_cache under scene_hash(scene) like render_scene_cached."""
+    if scene_key is None:
+        scene_key = scene_hash(scene)
+    return render_cache.get_or_compute((scene_key, "sweep", dpi), lambda: sweep_renderer(scene, dpi).png())
+
+
+_worker_renderer = None  # the SweepRenderer of a worker process of render_frames
+
+def _start_worker(scene, dpi):
+    global _worker_renderer
+    _worker_renderer = SweepRenderer(scene, dpi)
+
+def _render_frame(parameters):
+    return _worker_renderer.png(parameters, opaque=True)
+
+def render_frames(scene, frames, dpi=ANIMATION_DPI, workers=None):
+    """Renders one opaque PNG for each dict of parameter values in frames, in order.
+    The frames are spread across a pool of worker processes (one per CPU by default), each
+    of which sets up its SweepRenderer once; workers=1 renders them in this process."""
+    workers = min(workers or os.cpu_count() or 1, len(frames))
+    if workers <= 1:
+        renderer = sweep_renderer(scene, dpi)
+        return [renderer.png(parameters, opaque=True) for parameters in frames]
+    # The app runs threads, which fork() does not go well with
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_start_worker, initargs=(scene, dpi)) as executor:
+        return list(executor.map(_render_frame, frames, chunksize=max(len(frames) // (4 * workers), 1)))
+
+
+def encode_gif(frames, fps=20):
+    """Encodes PNG frames as a looping GIF."""
+    from PIL import Image
+
+    # Plots have few colours, so the fast octree palette is as good as median cut at a quarter of the time
+    images = [Image.open(io.BytesIO(frame)).convert("RGB").quantize(method=Image.Quantize.FASTOCTREE)
+              for frame in frames]
+    buffer = io.BytesIO()
+    images[0].save(buffer, format="gif", save_all=True, append_images=images[1:],
+                   duration=round(1000 / fps), loop=0)
+    return buffer.getvalue()
+
+def encode_mp4(frames, fps=20):
+    """Encodes PNG frames as an H.264 MP4 with ffmpeg (matplotlib's animation.ffmpeg_path)."""
+    ffmpeg = shutil.which(matplotlib.rcParams["animation.ffmpeg_path"])
+    if ffmpeg is None:
+        raise RuntimeError("MP4 export needs ffmpeg, which was not found; export a GIF instead")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "sweep.mp4")
+        # yuv420p (what browsers play) needs an even width and height
+        subprocess.run([ffmpeg, "-y", "-loglevel", "error", "-f", "image2pipe", "-framerate", str(fps),
+                        "-c:v", "png", "-i", "-", "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2:color=white",
+                        "-c:v", "libx264", "-pix_fmt", "yuv420p", "-movflags", "+faststart", path],
+                       input=b"".join(frames), check=True, capture_output=True)
+        with open(path, "rb") as file:
+            return file.read()
+
+ENCODERS = {"gif": encode_gif, "mp4": encode_mp4}
+
+
+@timed()
+def export_sweep(scene, name, start, stop, frames=60, fps=20, fmt="gif", dpi=ANIMATION_DPI, workers=None):
+    """Animates the scene with parameter name going from start to stop in frames steps (the
+    other parameters keep their values from the scene) and returns it encoded as "gif" or "mp4"."""
+    values = [dict(scene.get("parameters") or {}, **{name: float(value)})
+              for value in np.linspace(start, stop, frames)]
+    with span("render frames"):
+        pngs = render_frames(scene, values, dpi, workers)
+    with span("encode"):
+        return ENCODERS[fmt](pngs, fps)
@@ -0,0 +1,8 @@
+import os
+import sys
+
+import matplotlib
+matplotlib.use("Agg")
+
+# The modules live at the top of the repository, next to graphs.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
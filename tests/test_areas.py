@@ -0,0 +1,78 @@
+"""area_between against areas known in closed form."""
+import numpy as np
+import pytest
+
+import graph_utils as gu
+from test_fill import per_point_y_values
+
+VIEWPORT = (-2.25, 8.25, -2.25, 8.25)
+PIXEL_SIZE = (3000, 2400)
+CIRCLE = "x**2 + y**2 - 1"
+
+
+def explicit(function):
+    return gu.explicit_boundary(function, *VIEWPORT, PIXEL_SIZE)
+
+
+@pytest.mark.parametrize("upper, lower, x_start, x_end, expected", [
+    (gu.constant_boundary(3), gu.constant_boundary(1), 0, 2, 4.0),
+    ("lib.sin(x)", gu.constant_boundary(0), 0, np.pi, 2.0),
+    ("x**2", gu.constant_boundary(0), 0, 2, 8 / 3),
+    # The sides cross at pi/4 and 5pi/4: the area counts both lobes
+    ("lib.sin(x)", "lib.cos(x)", 0, 2 * np.pi, 4 * np.sqrt(2)),
+    # Either order of the sides and of the ends gives the same area
+    (gu.constant_boundary(0), "lib.sin(x)", np.pi, 0, 2.0),
+])
+def test_explicit_areas(upper, lower, x_start, x_end, expected):
+    upper, lower = (explicit(side) if isinstance(side, str) else side for side in (upper, lower))
+    filled = gu.area_between(upper, lower, x_start, x_end, VIEWPORT[2], VIEWPORT[3])
+    # Exact for the drawn polylines, which are within a quarter pixel of the curves
+    assert filled.area == pytest.approx(expected, rel=1e-4)
+
+
+def test_unit_circle_from_its_implicit_contour():
+    contour = gu.implicit_contour(CIRCLE, *VIEWPORT)
+    circle = gu.curve_boundary(contour.segments)
+    filled = gu.area_between(circle, circle, -1, 1, VIEWPORT[2], VIEWPORT[3])
+    # The traced polygon is inscribed in the circle, a fraction of a pixel inside it
+    assert filled.area == pytest.approx(np.pi, rel=1e-3)
+    assert filled.area < np.pi
+
+
+def test_unit_circle_from_a_parametric_curve():
+    x, y = gu.sampled_parametric("lib.cos(t)", "lib.sin(t)", -np.pi, np.pi, *VIEWPORT, PIXEL_SIZE)
+    circle = gu.curve_boundary([(x, y)])
+    filled = gu.area_between(circle, circle, -1, 1, VIEWPORT[2], VIEWPORT[3])
+    assert filled.area == pytest.approx(np.pi, rel=1e-4)
+
+
+def test_area_between_curve_and_function():
+    # As the lower side the circle counts with its lowest points: from y = 2 down to the
+    # lower half of the circle, 4 + pi/2
+    circle = gu.curve_boundary(gu.implicit_contour(CIRCLE, *VIEWPORT).segments)
+    filled = gu.area_between(gu.constant_boundary(2), circle, -1, 1, VIEWPORT[2], VIEWPORT[3])
+    assert filled.area == pytest.approx(4 + np.pi / 2, rel=1e-3)
+
+
+def test_closer_than_the_per_point_fill():
+    # The app used to fill on 1000 x values with the loop above and sum trapezoids
+    contour = gu.implicit_contour(CIRCLE, *VIEWPORT)
+    points = np.concatenate(contour.segments)
+    x_fill = np.linspace(-1, 1, 1000)
+    top = per_point_y_values(x_fill, points[:, 0], points[:, 1], True)
+    bottom = per_point_y_values(x_fill, points[:, 0], points[:, 1], False)
+    gap = top - bottom
+    old = np.nansum((gap[:-1] + gap[1:]) / 2 * np.diff(x_fill))
+
+    circle = gu.curve_boundary(contour.segments)
+    new = gu.area_between(circle, circle, -1, 1, VIEWPORT[2], VIEWPORT[3]).area
+    assert new == pytest.approx(old, rel=1e-2)
+    assert abs(new - np.pi) < abs(old - np.pi)
+
+
+def test_nothing_is_filled_across_a_pole():
+    filled = gu.area_between(explicit("1/x"), gu.constant_boundary(0), -1, 1, VIEWPORT[2], VIEWPORT[3])
+    assert np.isnan(filled.upper[filled.x == 0]).all()
+    # Next to the pole the function is clamped to the window, so the area is the one inside
+    # it: 1 + ln(8.25) on the right (clamped to 8.25 below x = 1/8.25) and 1 + ln(2.25) on the left
+    assert filled.area == pytest.approx(2 + np.log(8.25) + np.log(2.25), rel=1e-4)
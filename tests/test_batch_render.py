@@ -0,0 +1,35 @@
+"""Spec validation in batch_render: names stay inside the output directory, free
+parameters need values and relations are known."""
+import os
+
+import batch_render
+
+
+def test_name_with_a_path_is_rejected(tmp_path):
+    output = tmp_path / "out"
+    name, path, _, error = batch_render.render_spec({"name": "../escape", "functions": [{"latex": "x"}]},
+                                                    str(output))
+    assert path is None and "not a plain file name" in error
+    assert not (tmp_path / "escape.svg").exists()
+
+
+def test_parameters_are_filled_in(tmp_path):
+    spec = {"name": "wave", "functions": [{"latex": "a\\sin(bx)"}],
+            "implicit_functions": [{"latex": "x^2+y^2-c"}], "parameters": {"a": 2, "b": 0.5, "c": 4}}
+    _, path, _, error = batch_render.render_spec(spec, str(tmp_path))
+    assert error is None and os.path.exists(path)
+
+
+def test_missing_parameter_is_reported(tmp_path):
+    _, path, _, error = batch_render.render_spec({"name": "wave", "functions": [{"latex": "a\\sin(x)"}]},
+                                                 str(tmp_path))
+    assert path is None and error.startswith("ValueError") and "no value for a" in error
+
+
+def test_relations(tmp_path):
+    spec = {"name": "disc", "implicit_functions": [{"latex": "x^2+y^2-1", "relation": "<="}]}
+    _, path, _, error = batch_render.render_spec(spec, str(tmp_path))
+    assert error is None and os.path.exists(path)
+    spec["implicit_functions"][0]["relation"] = "=<"
+    _, path, _, error = batch_render.render_spec(spec, str(tmp_path))
+    assert path is None and "unknown relation '=<'" in error
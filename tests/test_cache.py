@@ -0,0 +1,127 @@
+"""LRUCache: eviction by count and by bytes, and one computation per missed key however
+many threads miss it at once."""
+import threading
+import time
+
+import graph_utils as gu
+
+
+def sized_cache(maxsize=256, maxbytes=100):
+    return gu.LRUCache(maxsize=maxsize, maxbytes=maxbytes, sizeof=len)
+
+
+def test_least_recently_used_entries_are_evicted_over_the_byte_budget():
+    cache = sized_cache()
+    cache.put("a", b"a" * 40)
+    cache.put("b", b"b" * 40)
+    assert cache.get("a") is not None  # a is now more recent than b
+    cache.put("c", b"c" * 40)
+    assert "b" not in cache._data and cache.get("a") and cache.get("c")
+    assert cache.nbytes == 80 and len(cache) == 2
+    # One entry can evict several
+    cache.put("d", b"d" * 90)
+    assert list(cache._data) == ["d"] and cache.nbytes == 90
+
+
+def test_replacing_an_entry_counts_its_new_size():
+    cache = sized_cache()
+    cache.put("a", b"a" * 60)
+    cache.put("a", b"a" * 10)
+    cache.put("b", b"b" * 80)
+    assert cache.nbytes == 90 and len(cache) == 2
+
+
+def test_entry_larger_than_the_budget_is_not_cached():
+    cache = sized_cache()
+    cache.put("a", b"a" * 40)
+    cache.put("big", b"x" * 101)
+    assert cache.get("big") is None
+    assert cache.get("a") == b"a" * 40 and cache.nbytes == 40
+    # get_or_compute still returns it, and computes it again next time
+    calls = []
+    for _ in range(2):
+        assert cache.get_or_compute("big", lambda: calls.append(1) or b"x" * 101) == b"x" * 101
+    assert len(calls) == 2 and cache.nbytes == 40
+
+
+def test_count_bound_without_byte_budget():
+    cache = gu.LRUCache(maxsize=2)
+    for key in "abc":
+        cache.put(key, key)
+    assert list(cache._data) == ["b", "c"] and cache.nbytes == 0
+
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def test_concurrent_misses_compute_once():
+    cache = sized_cache()
+    release = threading.Event()
+    calls, results = [], []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)  # until every other thread has missed too
+        return b"value"
+
+    threads = run_threads(16, lambda: results.append(cache.get_or_compute("key", compute)))
+    time.sleep(0.2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1
+    assert results == [b"value"] * 16
+    assert cache.misses == 1 and cache.hits == 15
+
+
+def test_waiters_compute_again_when_the_computation_fails():
+    cache = sized_cache()
+    release = threading.Event()
+    calls, results, errors = [], [], []
+
+    def compute():
+        calls.append(1)
+        if len(calls) == 1:
+            release.wait(5)
+            raise RuntimeError("first computation fails")
+        return b"value"
+
+    def worker():
+        try:
+            results.append(cache.get_or_compute("key", compute))
+        except RuntimeError as error:
+            errors.append(error)
+
+    threads = run_threads(8, worker)
+    time.sleep(0.2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    # The failure only reaches the thread that computed; one of the others computes again
+    assert len(errors) == 1 and len(calls) == 2
+    assert results == [b"value"] * 7
+
+
+def test_different_keys_are_computed_at_the_same_time():
+    cache = sized_cache()
+    started = {key: threading.Event() for key in "ab"}
+
+    def compute(key, other):
+        started[key].set()
+        # Would time out if the cache computed one key at a time
+        assert started[other].wait(5)
+        return key.encode()
+
+    results = {}
+    threads = [threading.Thread(target=lambda key=key, other=other: results.update(
+        {key: cache.get_or_compute(key, lambda: compute(key, other))})) for key, other in ["ab", "ba"]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert results == {"a": b"a", "b": b"b"}
+
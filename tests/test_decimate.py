@@ -0,0 +1,53 @@
+"""decimate_minmax keeps what each pixel column shows: its extremes, its ends and the nan
+breaks of the curve."""
+import numpy as np
+
+import graph_utils as gu
+
+XLOWER, XUPPER, COLUMNS = -2.25, 8.25, 1000
+
+
+def noisy_curve(points=100_000, breaks=()):
+    rng = np.random.default_rng(3)
+    x = np.linspace(XLOWER, XUPPER, points)
+    y = np.cumsum(rng.normal(size=points)) / 30 + np.sin(40 * x)
+    for start, stop in breaks:
+        y[start:stop] = np.nan
+    return x, y
+
+
+def extremes(x, y):
+    """{(column, piece of the curve between breaks): (min, max)} over the finite points."""
+    column = np.floor((x - XLOWER) * (COLUMNS / (XUPPER - XLOWER))).astype(int)
+    piece = np.cumsum(np.isnan(y))
+    finite = ~np.isnan(y)
+    groups = {}
+    for key, value in zip(zip(column[finite].tolist(), piece[finite].tolist()), y[finite].tolist()):
+        low, high = groups.get(key, (value, value))
+        groups[key] = (min(low, value), max(high, value))
+    return groups
+
+
+def test_every_column_keeps_its_lowest_and_highest_point():
+    x, y = noisy_curve()
+    dx, dy = gu.decimate_minmax(x, y, XLOWER, XUPPER, COLUMNS)
+    assert len(dx) <= 4 * COLUMNS
+    assert np.all(np.diff(dx) > 0) and np.isin(dx, x).all()  # a subsequence of the curve
+    assert extremes(dx, dy) == extremes(x, y)
+    assert (dx[0], dx[-1]) == (x[0], x[-1])
+
+
+def test_nan_breaks_survive():
+    # Single nans, a run of them, and one next to a column boundary
+    breaks = [(5_000, 5_001), (20_000, 20_400), (52_380, 52_381), (99_990, 100_000)]
+    x, y = noisy_curve(breaks=breaks)
+    dx, dy = gu.decimate_minmax(x, y, XLOWER, XUPPER, COLUMNS)
+    np.testing.assert_array_equal(dx[np.isnan(dy)], x[np.isnan(y)])
+    # Each piece between breaks keeps its extremes in every column it crosses
+    assert extremes(dx, dy) == extremes(x, y)
+
+
+def test_short_curves_are_unchanged():
+    x, y = noisy_curve(points=4 * COLUMNS)
+    dx, dy = gu.decimate_minmax(x, y, XLOWER, XUPPER, COLUMNS)
+    assert np.array_equal(dx, x) and np.array_equal(dy, y)
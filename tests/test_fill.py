@@ -0,0 +1,40 @@
+"""get_y_values_for_curve against the per-point loop it replaced."""
+import numpy as np
+import pytest
+
+import graph_utils as gu
+
+
+def per_point_y_values(x_fill, curve_points_x, curve_points_y, take_max=True, tolerance=0.01):
+    """The original get_y_values_for_curve: one masked search per x."""
+    sort_idx = np.argsort(curve_points_x)
+    x_sorted = curve_points_x[sort_idx]
+    y_sorted = curve_points_y[sort_idx]
+    y_values = []
+    for x in x_fill:
+        matching_y = y_sorted[np.abs(x_sorted - x) < tolerance]
+        if len(matching_y) > 0:
+            y_values.append(np.max(matching_y) if take_max else np.min(matching_y))
+        else:
+            y_values.append(np.nan)
+    return np.array(y_values)
+
+
+@pytest.mark.parametrize("take_max", [True, False])
+def test_y_values_match_the_per_point_loop(take_max):
+    rng = np.random.default_rng(1)
+    # Several y per x (a closed curve), repeated x values, gaps and points without a y or x
+    t = rng.uniform(0, 2 * np.pi, 5000)
+    x = np.concatenate([np.cos(t) * 3, np.repeat(rng.uniform(-4, 4, 50), 3), [np.nan, 1.0]])
+    y = np.concatenate([np.sin(t) * 2, rng.normal(size=150), [1.0, np.nan]])
+    x_fill = np.linspace(-5, 5, 2001)
+    expected = per_point_y_values(x_fill, x, y, take_max)
+    np.testing.assert_array_equal(gu.get_y_values_for_curve(x_fill, x, y, take_max, tolerance=0.01), expected)
+
+
+def test_default_tolerance_is_the_old_one_in_the_default_viewport():
+    # 0.1% of a 10 unit range is the 0.01 the loop used
+    x = np.linspace(-2, 8, 777)
+    y = np.sin(x)
+    x_fill = np.linspace(-2, 8, 1000)
+    np.testing.assert_array_equal(gu.get_y_values_for_curve(x_fill, x, y), per_point_y_values(x_fill, x, y))
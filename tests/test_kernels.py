@@ -0,0 +1,84 @@
+"""Compiled expression kernels against eval(), which they replace for NumPy arrays: same
+values bit for bit, nan and inf included, and the same errors."""
+import numpy as np
+import pytest
+
+import graph_utils as gu
+
+# Across several chunks, with the values where functions are singular or undefined
+VALUES = np.concatenate([
+    np.linspace(-10, 10, 3 * gu.KERNEL_CHUNK + 17),
+    [0.0, -0.0, 1.0, -1.0, np.pi / 2, 1e-300, -1e-300, 1e308, -1e308, np.inf, -np.inf, np.nan],
+])
+
+EXPRESSIONS = [
+    "x/2 - lib.sin(x)",
+    "lib.tan(x)",
+    "1/x",
+    "x/0",
+    "lib.log(x)",
+    "lib.log10(x)",
+    "lib.log(x)/lib.log(2)",
+    "lib.sqrt(x)",
+    "lib.exp(x**2)",  # overflows
+    "x**2 + 3*x - 1",
+    "x**3",
+    "x**0.5",
+    "x**-1",
+    "x**(1/3)",
+    "2**x",
+    "(-2)**x",
+    "x**x",
+    "E**x",
+    "pi*x - lib.e",
+    "-x",
+    "+x",
+    "x",
+    "lib.asin(x) + lib.acos(x/20)",
+    "lib.atan(x)*2**3",
+    "lib.sin(lib.cos(lib.tan(x)))",
+    "a*lib.sin(b*x) + c",
+    "a**x",
+]
+
+PARAMETERS = {"a": -1.5, "b": 0.5, "c": 2.0}
+
+
+def evaluate_with_eval(python_str, values, parameters=None):
+    namespace = {**(parameters or {}), "x": values, "lib": np, "log": np.log, "log10": np.log10,
+                 "E": gu.E, "pi": np.pi}
+    with np.errstate(all="ignore"):
+        return np.broadcast_to(np.asarray(eval(python_str, namespace), dtype=float), values.shape)
+
+
+@pytest.mark.parametrize("python_str", EXPRESSIONS)
+def test_kernel_matches_eval(python_str):
+    kernel = gu.compile_kernel(python_str)
+    assert kernel is not None
+    with np.errstate(all="ignore"):
+        result = kernel(VALUES, PARAMETERS)
+    expected = evaluate_with_eval(python_str, VALUES, PARAMETERS)
+    # Bit for bit: the same nan and inf, and the sign of zeros
+    np.testing.assert_array_equal(result.view(np.uint64), expected.view(np.uint64))
+
+
+@pytest.mark.parametrize("python_str", ["a*x", "lib.sin(b*x)"])
+def test_missing_parameter_raises_like_eval(python_str):
+    with pytest.raises(NameError) as from_eval:
+        evaluate_with_eval(python_str, VALUES)
+    with pytest.raises(NameError) as from_kernel:
+        gu.compile_kernel(python_str)(VALUES)
+    assert str(from_kernel.value) == str(from_eval.value)
+
+
+@pytest.mark.parametrize("python_str", ["5", "lib.maximum(x)", "abs(x)", "lib.sin(x, y)", "x +"])
+def test_unsupported_expressions_fall_back_to_eval(python_str):
+    assert gu.compile_kernel(python_str) is None
+
+
+def test_evaluate_expression_keeps_the_shape():
+    values = VALUES[:24].reshape(4, 6)
+    with np.errstate(all="ignore"):
+        result = gu.evaluate_expression("lib.tan(x)**2", values)
+    assert result.shape == values.shape
+    assert np.array_equal(result, evaluate_with_eval("lib.tan(x)**2", values), equal_nan=True)
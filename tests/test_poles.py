@@ -0,0 +1,83 @@
+"""Poles found by SymPy, and the breaks eval_function and adaptive_sample make there."""
+import numpy as np
+import pytest
+
+import graph_utils as gu
+
+VIEWPORT = (-2.25, 8.25, -2.25, 8.25)  # the app's default
+PIXEL_SIZE = (1000, 800)
+COMPOSITE = "lib.tan(lib.sin(x))/(x - 1)"  # a pole at 1 that SymPy's singularities() cannot find
+
+
+def multiples(step, offset):
+    n = np.arange(-10, 10)
+    points = offset + step * n
+    return points[(points >= VIEWPORT[0]) & (points <= VIEWPORT[1])]
+
+
+POLES = {
+    "lib.tan(x)": multiples(np.pi, np.pi / 2),
+    "1/lib.sin(x)": multiples(np.pi, 0),  # csc
+    "1/(x**2 - 4)": np.array([-2.0, 2.0]),
+    "lib.log(x)": np.array([0.0]),
+    "lib.sin(x)": np.array([]),
+    "x**2 - 3*x": np.array([]),
+}
+
+
+@pytest.mark.parametrize("user_func", POLES)
+def test_singular_points(user_func):
+    np.testing.assert_allclose(gu.singular_points(user_func, VIEWPORT[0], VIEWPORT[1]), POLES[user_func],
+                               rtol=0, atol=1e-12)
+
+
+def test_composite_has_no_symbolic_poles():
+    assert gu.singular_points(COMPOSITE, VIEWPORT[0], VIEWPORT[1]) is None
+
+
+@pytest.mark.parametrize("user_func", POLES)
+def test_eval_function_breaks_on_both_sides_of_each_pole(user_func):
+    x = np.linspace(VIEWPORT[0], VIEWPORT[1], 100_001)
+    with np.errstate(all='ignore'):
+        y = gu.eval_function(user_func, x, np)
+        undefined = ~np.isfinite(gu._eval_raw(user_func, x))  # e.g. log of negatives
+    near = np.searchsorted(x, POLES[user_func])
+    expected = undefined.copy()
+    expected[np.concatenate([near - 1, near])] = True
+    np.testing.assert_array_equal(np.isnan(y), expected)
+
+
+def test_eval_function_falls_back_to_the_jump_threshold():
+    x = np.linspace(VIEWPORT[0], VIEWPORT[1], 100_001)
+    y = gu.eval_function(COMPOSITE, x, np)
+    near = np.searchsorted(x, 1.0)
+    # Both neighbours of the pole, and the steepest steps next to them, but nothing further
+    assert np.isnan(y[[near - 1, near]]).all()
+    assert (np.abs(x[np.isnan(y)] - 1.0) < 5 * (x[1] - x[0])).all()
+
+
+def test_eval_function_keeps_steep_curves_without_poles():
+    # Steps of 10500 between samples, more than the jump threshold, but no pole
+    x = np.linspace(VIEWPORT[0], VIEWPORT[1], 1001)
+    assert not np.isnan(gu.eval_function("1000000*x", x, np)).any()
+
+
+@pytest.mark.parametrize("user_func", list(POLES) + [COMPOSITE])
+def test_sampled_curve_is_broken_at_the_poles_and_nowhere_else(user_func):
+    x, y = gu.adaptive_sample(user_func, *VIEWPORT, PIXEL_SIZE)
+    poles = POLES.get(user_func, np.array([1.0]))
+    # No segment between two drawn points passes over a pole...
+    joined = np.isfinite(y[:-1]) & np.isfinite(y[1:])
+    for pole in poles:
+        assert not (joined & (x[:-1] <= pole) & (pole <= x[1:])).any()
+    # ...and the curve is only broken where it leaves the window or is undefined
+    with np.errstate(all='ignore'):
+        values = gu._eval_raw(user_func, x[np.isnan(y)])
+    hidden = ~np.isfinite(values) | (values < VIEWPORT[2]) | (values > VIEWPORT[3])
+    assert hidden.all()
+
+
+def test_smooth_curve_is_not_broken():
+    x, y = gu.adaptive_sample("lib.sin(x)", *VIEWPORT, PIXEL_SIZE)
+    assert np.isfinite(y).all()
+    assert x[0] == VIEWPORT[0] and x[-1] == VIEWPORT[1]
@@ -0,0 +1,74 @@
+"""inequality_mask and region_image against the inequalities evaluated directly at the
+pixel centres."""
+import numpy as np
+import pytest
+
+import graph_utils as gu
+
+VIEWPORT = (-2.25, 8.25, -2.25, 8.25)
+WIDTH, HEIGHT = 420, 420  # square pixels, so x == y exactly at the centres on the diagonal
+
+# The functions as Python expressions for graph_utils and as NumPy functions to check with
+FUNCTIONS = [
+    ("x**2 + y**2 - 1", lambda x, y: x ** 2 + y ** 2 - 1),
+    ("x - y", lambda x, y: x - y),  # zero on the diagonal, where only <= and >= hold
+    ("lib.sqrt(x) - y", lambda x, y: np.sqrt(x) - y),  # nan for x < 0, in no region
+    ("y - lib.sin(a*x)", lambda x, y: y - np.sin(2 * x)),
+]
+PARAMETERS = {"a": 2}
+
+
+def centres():
+    xlower, xupper, ylower, yupper = VIEWPORT
+    xs = xlower + (np.arange(WIDTH) + 0.5) * ((xupper - xlower) / WIDTH)
+    ys = ylower + (np.arange(HEIGHT) + 0.5) * ((yupper - ylower) / HEIGHT)
+    return np.meshgrid(xs, ys)  # row 0 at ylower, like the masks
+
+
+def expected_mask(function, relation):
+    with np.errstate(all='ignore'):
+        values = function(*centres())
+    return {"<": values < 0, "<=": values <= 0, ">": values > 0, ">=": values >= 0}[relation]
+
+
+@pytest.mark.parametrize("relation", ["<", "<=", ">", ">="])
+@pytest.mark.parametrize("user_func, function", FUNCTIONS)
+def test_mask_matches_direct_evaluation(user_func, function, relation):
+    mask = gu.inequality_mask(user_func, relation, *VIEWPORT, WIDTH, HEIGHT, PARAMETERS)
+    np.testing.assert_array_equal(mask, expected_mask(function, relation))
+
+
+def test_non_strict_relations_include_the_zero_set():
+    diagonal = np.eye(HEIGHT, WIDTH, dtype=bool)
+    for strict, non_strict in [("<", "<="), (">", ">=")]:
+        without = gu.inequality_mask("x - y", strict, *VIEWPORT, WIDTH, HEIGHT)
+        with_zero = gu.inequality_mask("x - y", non_strict, *VIEWPORT, WIDTH, HEIGHT)
+        assert not without[diagonal].any()
+        assert with_zero[diagonal].all()
+        np.testing.assert_array_equal(with_zero & ~diagonal, without)
+
+
+def test_tiles_give_the_same_mask(monkeypatch):
+    whole = gu._inequality_mask("x**2 + y**2 - 1", "<", *VIEWPORT, WIDTH, HEIGHT)
+    monkeypatch.setattr(gu, "REGION_TILE_PIXELS", WIDTH * 7 + 3)  # tiles of 7 rows, the last one shorter
+    np.testing.assert_array_equal(gu._inequality_mask("x**2 + y**2 - 1", "<", *VIEWPORT, WIDTH, HEIGHT), whole)
+
+
+def test_combined_regions_are_coloured_by_which_regions_cover_each_pixel():
+    (first, first_function), (second, second_function) = FUNCTIONS[0], FUNCTIONS[3]
+    regions = [{"function": first, "relation": "<=", "color": "red"},
+               {"function": second, "relation": ">", "color": "blue"}]
+    image = gu.region_image(regions, *VIEWPORT, WIDTH, HEIGHT, PARAMETERS)
+    assert image.shape == (HEIGHT, WIDTH, 4)
+    in_first = expected_mask(first_function, "<=")
+    in_second = expected_mask(second_function, ">")
+    alone = [gu.region_image([region], *VIEWPORT, WIDTH, HEIGHT, PARAMETERS) for region in regions]
+
+    np.testing.assert_array_equal(image[~in_first & ~in_second], 0)
+    # Where one region covers a pixel by itself it has that region's own colour...
+    np.testing.assert_array_equal(image[in_first & ~in_second], alone[0][in_first & ~in_second])
+    np.testing.assert_array_equal(image[~in_first & in_second], alone[1][~in_first & in_second])
+    # ...and where both do, one blended colour that is more opaque than either
+    both = image[in_first & in_second]
+    assert len(both) and (both == both[0]).all()
+    assert both[0, 3] > max(alone[0][in_first][0, 3], alone[1][in_second][0, 3])
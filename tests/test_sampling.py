@@ -0,0 +1,91 @@
+"""The adaptive sampler against a dense reference raster, and the panning sampler against
+a fresh sample: every pixel the curve passes through must be drawn."""
+import numpy as np
+import pytest
+
+import graph_utils as gu
+
+VIEWPORT = (-2.25, 8.25, -2.25, 8.25)  # the app's default
+PIXEL_SIZE = (3000, 2400)  # 10 x 8 inches at 300 dpi
+REFERENCE_POINTS = 2_000_001
+
+
+def pixels(x, y, viewport=VIEWPORT):
+    """The pixels of the window the polyline through (x, y) passes through."""
+    width, height = PIXEL_SIZE
+    xlower, xupper, ylower, yupper = viewport
+    px = (np.asarray(x) - xlower) * width / (xupper - xlower)
+    py = (np.asarray(y) - ylower) * height / (yupper - ylower)
+    x0, x1, y0, y1 = px[:-1], px[1:], py[:-1], py[1:]
+    finite = np.isfinite(x0 + x1 + y0 + y1)
+    x0, x1, y0, y1 = x0[finite], x1[finite], y0[finite], y1[finite]
+    # Points every half pixel along each segment
+    steps = np.maximum(np.ceil(np.hypot(x1 - x0, y1 - y0) * 2).astype(int), 1)
+    segment = np.repeat(np.arange(len(x0)), steps)
+    fraction = (np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)) / steps[segment]
+    X = x0[segment] + (x1 - x0)[segment] * fraction
+    Y = y0[segment] + (y1 - y0)[segment] * fraction
+    inside = (X >= 0) & (X < width) & (Y >= 0) & (Y < height)
+    image = np.zeros((height, width), dtype=bool)
+    image[Y[inside].astype(int), X[inside].astype(int)] = True
+    return image
+
+
+def dilate(image, radius=2):
+    """image grown by radius pixels, for the rounding of where a segment crosses a pixel."""
+    grown = image.copy()
+    for dx in range(-radius, radius + 1):
+        for dy in range(-radius, radius + 1):
+            grown |= np.roll(np.roll(image, dx, axis=1), dy, axis=0)
+    return grown
+
+
+def reference(x, y):
+    # Far outside the window the dense polyline is cut instead of joined across asymptotes
+    margin = VIEWPORT[3] - VIEWPORT[2]
+    y = np.where((y > VIEWPORT[2] - margin) & (y < VIEWPORT[3] + margin), y, np.nan)
+    return pixels(x, y)
+
+
+def missing(sampled, dense):
+    return int((dense & ~dilate(sampled)).sum())
+
+
+@pytest.mark.parametrize("function", [
+    "x/2 - lib.sin(x)",
+    "lib.tan(x)",
+    "1/x",
+    "x*lib.sin(50*x)",  # leaves the window and comes back between the seeds of a coarse start
+    "lib.sin(200*x)",
+    "lib.sqrt(x)*lib.sin(1/x)",
+])
+def test_explicit_matches_dense_reference(function):
+    x, y = gu.adaptive_sample(function, *VIEWPORT, PIXEL_SIZE)
+    dense_x = np.linspace(VIEWPORT[0], VIEWPORT[1], REFERENCE_POINTS)
+    dense = reference(dense_x, gu._eval_raw(function, dense_x))
+    assert missing(pixels(x, y), dense) == 0
+
+
+def test_parametric_matches_dense_reference():
+    x_func, y_func = "t", "t*lib.sin(50*t)"
+    x, y = gu.adaptive_sample_parametric(x_func, y_func, VIEWPORT[0], VIEWPORT[1], *VIEWPORT, PIXEL_SIZE)
+    t = np.linspace(VIEWPORT[0], VIEWPORT[1], REFERENCE_POINTS)
+    dense = reference(gu._eval_raw(x_func, t, param_var='t'), gu._eval_raw(y_func, t, param_var='t'))
+    assert missing(pixels(x, y), dense) == 0
+
+
+def test_zooming_back_in_after_panning_samples_as_finely_as_a_fresh_window():
+    # Panning and zooming out sample the exposed sides at the coarser scale of those views,
+    # so zooming back in must not reuse them as if they were as fine as the first view
+    function = "lib.sin(200*x)"
+    gu.sample_cache.clear()
+    gu.extent_cache.clear()
+    xlower, xupper, ylower, yupper = VIEWPORT
+    width = xupper - xlower
+    first, panned, zoomed_out = (0, 0), (width / 2, width / 2), (-5 * width, 5 * width)
+    for left, right in [first, panned, zoomed_out]:
+        gu.sampled_function(function, xlower + left, xupper + right, ylower, yupper, PIXEL_SIZE)
+    viewport = (xlower + width, xupper + width, ylower, yupper)  # inside the coarse right side
+    x, y = gu.sampled_function(function, *viewport, PIXEL_SIZE)
+    fresh = gu.adaptive_sample(function, *viewport, PIXEL_SIZE)
+    assert missing(pixels(x, y, viewport), pixels(*fresh, viewport)) == 0
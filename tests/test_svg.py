@@ -0,0 +1,126 @@
+"""compact_svg: the output is well-formed SVG, and its relative, rounded paths stay within
+the rounding of the absolute paths matplotlib wrote."""
+import re
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+import pytest
+
+import graph_utils as gu
+
+AXES = {
+    "xlower": -2.25, "xupper": 8.25, "ylower": -2.25, "yupper": 8.25,
+    "xstep": 2, "ystep": 2, "gridstyle": "None", "xminordivisor": 4, "yminordivisor": 4,
+    "imagewidth": 5, "imageheight": 4,
+    "xuserlower": -2.0, "xuserupper": 8.0, "yuserlower": -2.0, "yuserupper": 8.0,
+    "showvalues": True, "axis_weight": 3.0, "label_size": 20, "white_background": True,
+}
+VIEWPORT = (AXES["xlower"], AXES["xupper"], AXES["ylower"], AXES["yupper"])
+PAIRS = {"M": 1, "L": 1, "Q": 2, "C": 3}  # coordinate pairs per command
+
+
+def scene():
+    x, y = gu.sampled_function("x/2 - lib.sin(x)", *VIEWPORT, (1500, 1200))
+    t, u = gu.sampled_function("lib.tan(x)", *VIEWPORT, (1500, 1200))
+    px, py = gu.sampled_parametric("lib.cos(t)", "lib.sin(t)", -np.pi, np.pi, *VIEWPORT, (1500, 1200))
+    fill = np.linspace(0, 3, 200)
+    return {
+        "axes": AXES,
+        "functions": [{"x": x, "y": y, "color": "blue", "line_style": "-", "zorder": 11},
+                      {"x": t, "y": u, "color": "red", "line_style": "--", "zorder": 12}],
+        "implicit_functions": [{"function": "x**2 + y**2 - 4", "relation": "<", "color": "green",
+                                "line_style": "-", "zorder": 13}],
+        "parametric_functions": [{"x": px, "y": py, "color": "purple", "line_style": ":", "zorder": 14}],
+        "points": [{"x": 1.0, "y": 2.0, "marker": "o", "color": "grey", "zorder": 15}],
+        "areas": [{"x": fill, "lower": np.zeros_like(fill), "upper": np.sin(fill), "color": "yellow",
+                   "opacity": 0.3}],
+    }
+
+
+@pytest.fixture(scope="module")
+def svg():
+    return gu.encode_scene(scene(), "svg", dpi=gu.VECTOR_DPI)
+
+
+def absolute_vertices(d, precision):
+    """The vertices of a path from matplotlib, leaving out the line segments that round to
+    nothing at precision, which _compact_path drops."""
+    scale = 10 ** precision
+    vertices = []
+    current = start = None
+    for command, numbers in gu._SVG_COMMAND.findall(d):
+        if command in "Zz":
+            current = start
+            continue
+        values = np.array(gu._SVG_NUMBER.findall(numbers), dtype=float).reshape(-1, 2)
+        rounded = np.rint(values * scale)
+        if command == "L" and current is not None and (rounded[-1] == current).all():
+            continue
+        vertices.extend(values)
+        current = rounded[-1]
+        if command == "M":
+            start = current
+    return np.array(vertices).reshape(-1, 2)
+
+
+def relative_vertices(d):
+    """The absolute vertices of a path written by _compact_path: M absolute, l, q and c
+    relative to the current point, a command carried over while its letter is omitted."""
+    vertices = []
+    current = start = np.zeros(2)
+    for command, numbers in re.findall(r'([Mlqcz])([^Mlqcz]*)', d):
+        if command == "z":
+            current = start
+            continue
+        values = np.array(gu._SVG_NUMBER.findall(numbers), dtype=float).reshape(-1, 2)
+        pairs = PAIRS[command.upper()]
+        for segment in values.reshape(-1, pairs, 2):
+            points = segment if command == "M" else current + segment
+            vertices.extend(points)
+            current = points[-1]
+            if command == "M":
+                start = current
+    return np.array(vertices).reshape(-1, 2)
+
+
+@pytest.mark.parametrize("precision", [0, 1, 2, 3])
+def test_compact_output_is_well_formed(svg, precision):
+    compact = gu.compact_svg(svg, precision)
+    root = ElementTree.fromstring(compact)
+    original = ElementTree.fromstring(svg)
+    assert root.tag == original.tag == "{http://www.w3.org/2000/svg}svg"
+    assert len(root.findall(".//{*}path")) == len(original.findall(".//{*}path"))
+    assert len(compact) < len(svg)
+    # Every class a shared style became is defined in the stylesheet
+    styles = "".join(element.text or "" for element in root.iter("{http://www.w3.org/2000/svg}style"))
+    for name in set(re.findall(r' class="(s\d+)"', compact)):
+        assert f".{name}{{" in styles
+
+
+@pytest.mark.parametrize("overrides", [{}, {"rasterize_dense": True}])
+def test_compact_export_is_well_formed(overrides):
+    # With the paths simplified first, and with dense layers embedded as images
+    root = ElementTree.fromstring(gu.encode_scene(scene(), "svg-compact", **overrides))
+    assert root.tag == "{http://www.w3.org/2000/svg}svg" and root.findall(".//{*}path")
+
+
+@pytest.mark.parametrize("precision", [0, 1, 2, 3])
+def test_compact_paths_stay_within_the_rounding(svg, precision):
+    originals = gu._SVG_PATH.findall(svg)
+    compacts = gu._SVG_PATH.findall(gu.compact_svg(svg, precision))
+    assert len(compacts) == len(originals) > 10
+    for original, compact in zip(originals, compacts):
+        expected = absolute_vertices(original, precision)
+        got = relative_vertices(compact)
+        assert got.shape == expected.shape
+        # Half a unit of the last decimal, plus the float error of summing the steps
+        assert np.abs(got - expected).max(initial=0) <= 0.5 / 10 ** precision + 1e-9
+
+
+def test_rounding_errors_do_not_add_up_along_a_path():
+    rng = np.random.default_rng(5)
+    points = np.cumsum(rng.uniform(-1, 1, (20_000, 2)), axis=0)
+    d = "M " + " L ".join(f"{x:.17g} {y:.17g}" for x, y in points)
+    got = relative_vertices(gu._compact_path(d, 1))
+    expected = absolute_vertices(d, 1)
+    assert got.shape == expected.shape and np.abs(got - expected).max() <= 0.05 + 1e-9
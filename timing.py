@@ -0,0 +1,183 @@
+"""Lightweight timing spans for finding out where a rerun spends its time.
+
+Wrap a stage in a span, or decorate a function with timed:
+
+    with span("Build scene"):
+        ...
+
+    @timed()
+    def implicit_contour(...):
+        ...
+
+Spans nest. A finished span becomes a record: a dict with the span's name, its path of
+enclosing spans, its depth, its start (seconds since the trace began), its duration,
+the thread it ran in and, while tracemalloc is tracing, the net memory it allocated.
+
+Spans are recorded in two cases:
+- start_trace() collects the records of the spans opened in the current context (and
+  in jobs submitted with in_context()), e.g. for the timing panel of the app.
+- enable() (or the GRAPHS_TIMING environment variable) logs every record as a JSON
+  line on the "graphs.timing" logger. GRAPHS_TIMING=memory also traces memory.
+
+Otherwise a span costs one context variable lookup.
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger("graphs.timing")
+
+ENABLED = False  # log every span, see enable()
+
+# (trace, path of the innermost open span) of the current context, None when not tracing
+_state = contextvars.ContextVar("timing_state", default=None)
+
+
+class Trace:
+    """The records of the spans finished while a trace was active, in order of finishing."""
+
+    def __init__(self, name):
+        self.name = name
+        self.records = []
+        self.start = time.perf_counter()
+        self.seconds = None
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def finish(self):
+        """Stops collecting and returns the records, with the trace itself as the last one."""
+        state = _state.get()
+        if state is not None and state[0] is self:
+            _state.set(None)
+        if self.seconds is None:
+            self.seconds = time.perf_counter() - self.start
+            record = {"name": self.name, "path": self.name, "depth": 0, "start": 0.0,
+                      "seconds": self.seconds, "thread": threading.current_thread().name}
+            self.add(record)
+            if ENABLED and logger.isEnabledFor(logging.INFO):
+                logger.info(json.dumps(record))
+        return self.records
+
+
+def start_trace(name="rerun"):
+    """Starts collecting the spans of the current context into a new Trace, which is
+    returned. Call its finish() at the end; spans nest under name."""
+    trace = Trace(name)
+    _state.set((trace, name))
+    return trace
+
+
+def stop_trace():
+    """Stops collecting into whatever trace the current context has, e.g. one left behind
+    by a Streamlit rerun that was interrupted before it finished its trace."""
+    _state.set(None)
+
+
+def enable(memory=False):
+    """Logs every span from now on, at INFO level on the "graphs.timing" logger (which gets
+    a stderr handler if it has none). memory=True also starts tracemalloc, which slows
+    down allocation-heavy code noticeably."""
+    global ENABLED
+    ENABLED = True
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+
+class _Span:
+    __slots__ = ("name", "state", "token", "start", "memory")
+
+    def __init__(self, name, state):
+        self.name = name
+        self.state = state
+
+    def __enter__(self):
+        trace, parent = self.state or (None, None)
+        path = f"{parent}/{self.name}" if parent else self.name
+        self.token = _state.set((trace, path))
+        self.memory = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        end = time.perf_counter()
+        trace, path = _state.get()
+        _state.reset(self.token)
+        record = {"name": self.name, "path": path, "depth": path.count("/"),
+                  "start": None if trace is None else self.start - trace.start,
+                  "seconds": end - self.start, "thread": threading.current_thread().name}
+        if self.memory is not None and tracemalloc.is_tracing():
+            record["memory"] = tracemalloc.get_traced_memory()[0] - self.memory
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        if trace is not None:
+            trace.add(record)
+        if ENABLED and logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(record))
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name):
+    """A context manager timing the code it wraps as a span called name."""
+    state = _state.get()
+    if state is None and not ENABLED:
+        return _NULL_SPAN
+    return _Span(name, state)
+
+
+def timed(name=None):
+    """Decorator timing every call of a function as a span (named after the function by default)."""
+    def decorate(function):
+        label = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            state = _state.get()
+            if state is None and not ENABLED:
+                return function(*args, **kwargs)
+            with _Span(label, state):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def in_context(function):
+    """Wraps function to run in a copy of the current context, so spans opened by a job
+    on a thread pool nest under the span that submitted it. Wrap once per submitted job:
+    a context can only be entered by one thread at a time."""
+    if _state.get() is None:
+        return function
+    return functools.partial(contextvars.copy_context().run, function)
+
+
+if os.environ.get("GRAPHS_TIMING", "").lower() not in ("", "0", "false", "no"):
+    enable(memory=os.environ["GRAPHS_TIMING"].lower() == "memory")
@@ -0,0 +1,271 @@
+"""Vector previews: a scene as compact JSON that a small script draws as SVG in the browser.
+
+Rasterizing the preview with matplotlib is the most expensive part of a rerun, and the PNG
+is most of the response. In vector preview mode the server only works out where things
+go, on a grid of UNITS_PER_INCH units per inch of the figure, with every curve snapped to
+that grid and stripped of the points that add nothing at that resolution
+(see snap_polyline). PREVIEW_JS draws the result; matplotlib is only used for the SVG and
+PNG downloads.
+
+The preview follows create_graph closely, but tick labels are plain text (π/2 rather than
+a typeset fraction) in the browser's sans-serif font.
+
+This module never imports Streamlit: graphs.py registers PREVIEW_JS as a component.
+"""
+import base64
+import io
+
+import numpy as np
+from matplotlib import rcParams
+from matplotlib.colors import to_hex
+
+from graph_utils import (LRUCache, render_cache, scene_hash, snap_polyline, sample_curve, implicit_contour,
+                         region_image)
+from timing import timed
+
+UNITS_PER_INCH = 144  # grid of the preview: half a point, so curves are within a quarter point
+REGION_DPI = 100  # resolution of the inequality regions, which are sent as PNG images
+AXIS_COLOR = '#435159'
+LABEL_OFFSET = 7  # points between an axis and its tick labels: matplotlib's default pad and tick size
+
+# The drawing order of create_graph and render_scene
+GRID_ZORDER = 1.5
+SPINE_ZORDER = 2.5
+REGION_ZORDER = 4
+AREA_ZORDER = 5
+
+
+tick_text_cache = LRUCache(maxsize=1024)  # tick value -> text
+
+def tick_text(value):
+    """A tick value as plain text, e.g. 1.5707963 -> π/2 (tick_label gives LaTeX)."""
+    value = float(value)
+    return tick_text_cache.get_or_compute(value, lambda: _tick_text(value))
+
+def _tick_text(value):
+    if value.is_integer() and abs(value) < 1e15:
+        return str(int(value)).replace('-', '−')
+    import sympy as sp  # like tick_label, only for ticks that are not integers
+
+    text = str(sp.nsimplify(value, [sp.pi]))
+    for old, new in (('pi', 'π'), ('*', ''), ('sqrt', '√'), ('-', '−')):
+        text = text.replace(old, new)
+    return text
+
+
+def path_data(px, py):
+    """An SVG path through snapped points: the first point of each run after a nan break
+    absolute, the rest relative, as whole numbers."""
+    parts = []
+    nan = np.isnan(px)
+    starts = np.flatnonzero(~nan & np.concatenate(([True], nan[:-1])))
+    ends = np.flatnonzero(~nan & np.concatenate((nan[1:], [True]))) + 1
+    for start, end in zip(starts, ends):
+        x, y = px[start:end].astype(np.int64), py[start:end].astype(np.int64)
+        if end - start == 1:
+            continue
+        steps = np.empty(2 * (end - start - 1), dtype=np.int64)
+        steps[0::2] = np.diff(x)
+        steps[1::2] = np.diff(y)
+        parts.append(f"M{x[0]} {y[0]}l" + " ".join(map(str, steps.tolist())))
+    return "".join(parts)
+
+
+class _Grid:
+    """Maps data coordinates to the units of the preview."""
+
+    def __init__(self, axes):
+        self.viewport = (axes["xlower"], axes["xupper"], axes["ylower"], axes["yupper"])
+        self.width = round(axes["imagewidth"] * UNITS_PER_INCH)
+        self.height = round(axes["imageheight"] * UNITS_PER_INCH)
+        self.points = UNITS_PER_INCH / 72  # units per point
+
+    def x(self, value):
+        xlower, xupper, _, _ = self.viewport
+        return round((value - xlower) * self.width / (xupper - xlower))
+
+    def y(self, value):
+        _, _, ylower, yupper = self.viewport
+        return round((yupper - value) * self.height / (yupper - ylower))
+
+    def path(self, x, y):
+        return path_data(*snap_polyline(x, y, *self.viewport, self.width, self.height))
+
+
+def _stroke(color, linewidth, line_style="-", alpha=1.0, zorder=0, d=""):
+    layer = {"kind": "path", "d": d, "stroke": to_hex(color), "width": round(linewidth, 2), "z": zorder}
+    if line_style in ("--", ":"):
+        # matplotlib's dash patterns, which scale with the line width
+        pattern = rcParams["lines.dashed_pattern" if line_style == "--" else "lines.dotted_pattern"]
+        layer["dash"] = " ".join(f"{step * linewidth:.3g}" for step in pattern)
+    if alpha != 1:
+        layer["opacity"] = alpha
+    return layer
+
+
+@timed()
+def vector_preview(scene, scene_key=None):
+    """The JSON-ready description of a scene that PREVIEW_JS draws, cached in render_cache
+    under scene_hash(scene) like the rendered images."""
+    if scene_key is None:
+        scene_key = scene_hash(scene)
+    return render_cache.get_or_compute((scene_key, "vector", UNITS_PER_INCH), lambda: _vector_preview(scene))
+
+def _vector_preview(scene):
+    axes = scene["axes"]
+    grid = _Grid(axes)
+    xlower, xupper, ylower, yupper = grid.viewport
+    units = grid.points
+    linewidth = axes["axis_weight"] * 1.3 * units
+    layers = []
+
+    # Grid lines, at the ticks of create_graph
+    xticks = np.arange(axes["xuserlower"], axes["xuserupper"] + axes["xstep"], axes["xstep"])
+    yticks = np.arange(axes["yuserlower"], axes["yuserupper"] + axes["ystep"], axes["ystep"])
+    grid_lines = []
+    if axes["gridstyle"] == "Minor":
+        minor_x = np.arange(axes["xuserlower"], axes["xuserupper"] + axes["xstep"],
+                            axes["xstep"] / axes["xminordivisor"])
+        minor_y = np.arange(axes["yuserlower"], axes["yuserupper"] + axes["ystep"],
+                            axes["ystep"] / axes["yminordivisor"])
+        grid_lines.append(('#999999', 0.2, minor_x, minor_y))
+    if axes["gridstyle"] in ("Major", "Minor"):
+        grid_lines.append(('#666666', 0.5, xticks, yticks))
+    for color, alpha, xs, ys in grid_lines:
+        d = "".join(f"M{grid.x(x)} 0V{grid.height}" for x in xs if xlower <= x <= xupper) + \
+            "".join(f"M0 {grid.y(y)}H{grid.width}" for y in ys if ylower <= y <= yupper)
+        layers.append(_stroke(color, axes["axis_weight"] * 0.7 * units, alpha=alpha, zorder=GRID_ZORDER, d=d))
+
+    # Spines through the origin, with the tick labels next to them
+    origin_x, origin_y = grid.x(0), grid.y(0)
+    layers.append(_stroke(AXIS_COLOR, axes["axis_weight"] * units, zorder=SPINE_ZORDER,
+                          d=f"M0 {origin_y}H{grid.width}M{origin_x} 0V{grid.height}"))
+    if axes["showvalues"]:
+        offset = round(LABEL_OFFSET * units)
+        labels = [[grid.x(x), origin_y + offset, tick_text(x), "x"] for x in xticks if x != 0] + \
+                 [[origin_x - offset, grid.y(y), tick_text(y), "y"] for y in yticks if y != 0]
+        layers.append({"kind": "text", "labels": labels, "size": round(axes["label_size"] * units, 2),
+                       "color": AXIS_COLOR, "box": bool(axes["white_background"]), "z": GRID_ZORDER})
+
+    # Inequality regions as one image, like render_scene
+    regions = [implicit_data for implicit_data in scene.get("implicit_functions", []) + scene.get("curves", [])
+               if implicit_data.get("kind", "implicit") == "implicit" and implicit_data.get("relation", "=") != "="]
+    if regions:
+        from PIL import Image  # comes with matplotlib
+
+        image = region_image(sorted(regions, key=lambda region: region["zorder"]), xlower, xupper, ylower, yupper,
+                             int(axes["imagewidth"] * REGION_DPI), int(axes["imageheight"] * REGION_DPI),
+                             scene.get("parameters"))
+        buffer = io.BytesIO()
+        Image.fromarray(image[::-1]).save(buffer, format="png", optimize=True)
+        layers.append({"kind": "image", "href": "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode(),
+                       "z": REGION_ZORDER})
+
+    for area in scene.get("areas", []):
+        # fill_between: one polygon per stretch where both boundaries are defined
+        x, lower, upper = (np.asarray(area[key], dtype=float) for key in ("x", "lower", "upper"))
+        defined = np.isfinite(lower) & np.isfinite(upper)
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], defined.view(np.int8), [0]))))
+        d = ""
+        for start, end in zip(edges[0::2], edges[1::2]):
+            d += grid.path(np.concatenate((x[start:end], x[start:end][::-1], x[start:start + 1])),
+                           np.concatenate((upper[start:end], lower[start:end][::-1], upper[start:start + 1]))) + "Z"
+        layers.append({"kind": "path", "d": d, "fill": to_hex(area["color"]), "opacity": area["opacity"],
+                       "z": AREA_ZORDER})
+
+    for func_data in scene.get("functions", []) + scene.get("parametric_functions", []):
+        layers.append(_stroke(func_data["color"], linewidth, func_data["line_style"], zorder=func_data["zorder"],
+                              d=grid.path(func_data["x"], func_data["y"])))
+
+    for implicit_data in scene.get("implicit_functions", []):
+        contour = implicit_contour(implicit_data["function"], xlower, xupper, ylower, yupper)
+        layers.append(_stroke(implicit_data["color"], linewidth, implicit_data["line_style"],
+                              zorder=implicit_data["zorder"],
+                              d="".join(grid.path(*segment.T) for segment in contour.segments)))
+
+    for curve in scene.get("curves", []):
+        data = sample_curve(curve, scene.get("parameters"), *grid.viewport, (grid.width, grid.height))
+        d = "".join(grid.path(*segment.T) for segment in data) if curve["kind"] == "implicit" else grid.path(*data)
+        layers.append(_stroke(curve["color"], linewidth, curve["line_style"], zorder=curve["zorder"], d=d))
+
+    for point_data in scene.get("points", []):
+        x, y = grid.x(point_data["x"]), grid.y(point_data["y"])
+        edge = axes["axis_weight"] * units
+        if point_data["marker"] == "x":
+            r = round(axes["axis_weight"] * 3 * units)  # half the marker size
+            layers.append(_stroke(point_data["color"], edge, zorder=point_data["zorder"],
+                                  d=f"M{x - r} {y - r}l{2 * r} {2 * r}M{x - r} {y + r}l{2 * r} {-2 * r}"))
+        else:  # circle
+            r = round(axes["axis_weight"] * 1.5 * units)
+            layer = _stroke(point_data["color"], edge, zorder=point_data["zorder"],
+                            d=f"M{x - r} {y}a{r} {r} 0 1 0 {2 * r} 0a{r} {r} 0 1 0 {-2 * r} 0Z")
+            layer["fill"] = layer["stroke"]
+            layers.append(layer)
+
+    layers.sort(key=lambda layer: layer["z"])
+    for layer in layers:
+        del layer["z"]
+    return {"width": grid.width, "height": grid.height,
+            "background": "#ffffff" if axes["white_background"] else None, "layers": layers}
+
+
+# Draws the JSON of vector_preview as an SVG element, replacing the one of the last rerun
+PREVIEW_JS = """
+const SVG = "http://www.w3.org/2000/svg";
+
+function element(parent, name, attributes) {
+    const node = document.createElementNS(SVG, name);
+    for (const [key, value] of Object.entries(attributes)) {
+        if (value !== undefined && value !== null) node.setAttribute(key, value);
+    }
+    parent.appendChild(node);
+    return node;
+}
+
+export default function (component) {
+    const { data, parentElement } = component;
+    let svg = parentElement.querySelector("svg");
+    if (!svg) {
+        svg = element(parentElement, "svg", { width: "100%", style: "display: block" });
+    }
+    svg.replaceChildren();
+    svg.setAttribute("viewBox", `0 0 ${data.width} ${data.height}`);
+    const clip = element(element(svg, "defs", {}), "clipPath", { id: "plot" });
+    element(clip, "rect", { width: data.width, height: data.height });
+    const root = element(svg, "g", { "clip-path": "url(#plot)" });
+    if (data.background) {
+        element(root, "rect", { width: data.width, height: data.height, fill: data.background });
+    }
+    for (const layer of data.layers) {
+        if (layer.kind === "path") {
+            element(root, "path", {
+                d: layer.d, fill: layer.fill || "none", stroke: layer.stroke, "stroke-width": layer.width,
+                "stroke-dasharray": layer.dash, opacity: layer.opacity,
+                "stroke-linejoin": "round", "stroke-linecap": layer.dash ? "butt" : "square",
+            });
+        } else if (layer.kind === "image") {
+            element(root, "image", {
+                href: layer.href, width: data.width, height: data.height,
+                preserveAspectRatio: "none", style: "image-rendering: pixelated",
+            });
+        } else if (layer.kind === "text") {
+            const group = element(root, "g", {
+                "font-family": "sans-serif", "font-size": layer.size, fill: layer.color,
+            });
+            for (const [x, y, text, axis] of layer.labels) {
+                const label = element(group, "text", {
+                    x, y, "text-anchor": axis === "x" ? "middle" : "end",
+                    "dominant-baseline": axis === "x" ? "hanging" : "central",
+                });
+                label.textContent = text;
+                if (layer.box) {
+                    const box = label.getBBox();
+                    group.insertBefore(element(group, "rect", {
+                        x: box.x - 2, y: box.y - 2, width: box.width + 4, height: box.height + 4, fill: "white",
+                    }), label);
+                }
+            }
+        }
+    }
+}
+"""